@@ -0,0 +1,206 @@
+"""
+Micro-benchmarks of per-call overhead of metric types.
+
+Run from the root of the repository:
+
+    python -m benchmarks.metrics --output results.json
+
+and to check for regressions against a stored baseline:
+
+    python -m benchmarks.metrics --output results.json --baseline baseline.json
+
+This will exit with a status of 1 if any benchmark failed, or got slower than the baseline by
+more than --tolerance.
+"""
+import argparse
+import contextlib
+import json
+import platform
+import sys
+import tempfile
+import timeit
+import traceback
+import typing as tp
+
+import satella
+from satella.instrumentation.metrics import getMetric, MetricLevel
+from satella.instrumentation.metrics.metric_types import METRIC_NAMES_TO_CLASSES
+from satella.instrumentation.metrics.metric_types.multiprocess import MultiprocessMetric
+from satella.instrumentation.metrics.multiprocess import enable_multiprocess, \
+    disable_multiprocess, collect_multiprocess
+
+# arguments to call handle() with, for types that don't accept a single value
+HANDLE_ARGS = {
+    'cps': (),
+    'linkfail': (True,),
+}
+# types that don't accept handle() at all
+NOT_HANDLED = {'base', 'callable', 'uptime'}
+# extra arguments to construct a metric of given type with
+CONSTRUCTOR_KWARGS = {
+    'callable': {'value_getter': lambda: 1},
+}
+LEVELS = {
+    'runtime': (MetricLevel.RUNTIME, 'runtime'),
+    'debug': (MetricLevel.DEBUG, 'debug'),
+    'disabled': (MetricLevel.DISABLED, 'runtime'),
+}
+SERIES_COUNTS = (1, 100, 1000)
+
+
+def time_per_call(fun: tp.Callable[[], None], min_time: float) -> float:
+    """
+    Return the best time of a single call to fun, in nanoseconds
+    """
+    timer = timeit.Timer(fun)
+    number, _ = timer.autorange()
+    number = max(int(number * min_time / 0.2), 1)
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e9
+
+
+def new_metric(metric_type: str, metric_level: tp.Optional[MetricLevel] = None):
+    getMetric().reset()
+    return getMetric('benchmark.metric', metric_type, metric_level,
+                     **CONSTRUCTOR_KWARGS.get(metric_type, {}))
+
+
+def is_multiprocess(metric_type: str) -> bool:
+    return issubclass(METRIC_NAMES_TO_CLASSES[metric_type], MultiprocessMetric)
+
+
+@contextlib.contextmanager
+def multiprocess_enabled() -> tp.Iterator[str]:
+    """
+    Enable multiprocess metrics in a fresh temporary directory, yielding it
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        enable_multiprocess(directory)
+        try:
+            yield directory
+        finally:
+            disable_multiprocess()
+
+
+def benchmark_handle(metric_type: str, min_time: float) -> tp.Dict[str, float]:
+    results = {}
+    if metric_type in NOT_HANDLED:
+        return results
+    args = HANDLE_ARGS.get(metric_type, (1,))
+    for with_labels in (False, True):
+        labels = {'key': 'value'} if with_labels else {}
+        for level_name, (level, method_name) in LEVELS.items():
+            with multiprocess_enabled():
+                metric = new_metric(metric_type, level)
+                method = getattr(metric, method_name)
+                results['handle.%s.%s.%s' % (metric_type, 'labels' if with_labels else 'plain',
+                                             level_name)] = \
+                    time_per_call(lambda: method(*args, **labels), min_time)
+    return results
+
+
+def benchmark_to_metric_data(metric_type: str, min_time: float) -> tp.Dict[str, float]:
+    """
+    Benchmark collecting the data of a metric with different amounts of series.
+
+    Multiprocess metrics output nothing in to_metric_data(), so collect_multiprocess() is
+    benchmarked for them instead.
+    """
+    results = {}
+    args = HANDLE_ARGS.get(metric_type, (1,))
+    for series in SERIES_COUNTS:
+        if metric_type in NOT_HANDLED and series > 1:
+            break
+        with multiprocess_enabled() as directory:
+            metric = new_metric(metric_type)
+            if metric_type not in NOT_HANDLED:
+                for i in range(series):
+                    metric.runtime(*args, key=i)
+            if is_multiprocess(metric_type):
+                results['collect_multiprocess.%s.%s' % (metric_type, series)] = \
+                    time_per_call(lambda: collect_multiprocess(directory), min_time)
+            else:
+                results['to_metric_data.%s.%s' % (metric_type, series)] = \
+                    time_per_call(metric.to_metric_data, min_time)
+    return results
+
+
+def run(types: tp.Iterable[str],
+        min_time: float) -> tp.Tuple[tp.Dict[str, float], tp.List[str]]:
+    """
+    Run the benchmarks, printing the tracebacks of these that failed.
+
+    :return: a tuple of (results, names of benchmarks that failed)
+    """
+    results = {}
+    failures = []
+    for metric_type in types:
+        print('Benchmarking %s' % (metric_type,), file=sys.stderr)
+        for benchmark in (benchmark_handle, benchmark_to_metric_data):
+            try:
+                results.update(benchmark(metric_type, min_time))
+            except Exception:
+                name = '%s.%s' % (benchmark.__name__[len('benchmark_'):], metric_type)
+                print('%s failed:' % (name,), file=sys.stderr)
+                traceback.print_exc()
+                failures.append(name)
+    getMetric().reset()
+    return results, failures
+
+
+def compare(results: tp.Dict[str, float], baseline: tp.Dict[str, float],
+            tolerance: float) -> tp.List[str]:
+    """
+    Print a comparison of results against the baseline.
+
+    :return: names of benchmarks that got slower by more than tolerance
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            print('%-50s %12.1f ns          new' % (name, results[name]))
+            continue
+        ratio = results[name] / baseline[name]
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+        print('%-50s %12.1f ns %+11.1f%%%s' % (name, results[name], (ratio - 1) * 100,
+                                               ' REGRESSION' if ratio > 1 + tolerance else ''))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark per-call overhead of metric types')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file with results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline, as a fraction')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum time of a single repetition, in seconds')
+    parser.add_argument('types', nargs='*', help='metric types to benchmark, all by default')
+    arguments = parser.parse_args()
+
+    types = arguments.types or sorted(METRIC_NAMES_TO_CLASSES)
+    results, failures = run(types, arguments.min_time)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            json.dump({'satella': satella.__version__,
+                       'python': platform.python_implementation() + ' ' +
+                                 platform.python_version(),
+                       'results': results}, file, indent=2, sort_keys=True)
+
+    baseline = {}
+    if arguments.baseline:
+        with open(arguments.baseline, 'r') as file:
+            baseline = json.load(file)['results']
+    regressions = compare(results, baseline, arguments.tolerance)
+    if failures:
+        print('%s benchmarks failed: %s' % (len(failures), ', '.join(failures)),
+              file=sys.stderr)
+    if regressions:
+        print('%s benchmarks got slower than the baseline' % (len(regressions),),
+              file=sys.stderr)
+    return 1 if failures or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
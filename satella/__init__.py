@@ -1 +1 @@
-__version__ = '2.26.2'
+__version__ = '2.27.0'
@@ -1,6 +1,7 @@
 from .dictionaries import DictObject, apply_dict_object, DictionaryView, TwoWayDictionary, \
     DirtyDict, KeyAwareDefaultDict, ExpiringEntryDict, SelfCleaningDefaultDict, \
-    CacheDict, ExclusiveWritebackCache, CountingDict, LRUCacheDict, DefaultDict
+    CacheDict, ExclusiveWritebackCache, CountingDict, LRUCacheDict, TinyLFUCacheDict, DefaultDict, \
+    TwoTierCacheDict
 from .hashable_objects import HashableWrapper
 from .heaps import Heap, SetHeap, TimeBasedHeap, TimeBasedSetHeap
 from .immutable import Immutable, frozendict, NotEqualToAnything, NOT_EQUAL_TO_ANYTHING
@@ -17,6 +18,7 @@ from .singleton import Singleton, SingletonWithRegardsTo, get_instances_for_sing
 from .sorted_list import SortedList, SliceableDeque
 from .sparse_matrix import SparseMatrix
 from .syncable_droppable import DBStorage, SyncableDroppable
+from .tinylfu import WTinyLFU, CountMinSketch
 from .tuples import Vector
 from .typednamedtuple import typednamedtuple
 from .zip_dict import SetZip
@@ -27,6 +29,7 @@ __all__ = [
     'DBStorage', 'SyncableDroppable',
     'LRU',
     'LRUCacheDict',
+    'WTinyLFU', 'CountMinSketch', 'TinyLFUCacheDict', 'TwoTierCacheDict',
     'NotEqualToAnything', 'NOT_EQUAL_TO_ANYTHING',
     'HashableMixin',
     'CountingDict', 'DictionaryEQAble',
@@ -1,4 +1,4 @@
-from .cache_dict import CacheDict, LRUCacheDict
+from .cache_dict import CacheDict, LRUCacheDict, TinyLFUCacheDict, TwoTierCacheDict
 from .counting import CountingDict
 from .default import DefaultDict
 from .dict_object import apply_dict_object, DictObject
@@ -9,4 +9,4 @@ from .writeback_cache import ExclusiveWritebackCache
 __all__ = ['DictObject', 'DirtyDict', 'DictionaryView', 'CacheDict', 'KeyAwareDefaultDict',
            'TwoWayDictionary', 'apply_dict_object', 'ExpiringEntryDict',
            'SelfCleaningDefaultDict', 'ExclusiveWritebackCache',
-           'CountingDict', 'LRUCacheDict', 'DefaultDict']
+           'CountingDict', 'LRUCacheDict', 'TinyLFUCacheDict', 'DefaultDict']
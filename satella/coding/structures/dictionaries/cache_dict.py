@@ -1,11 +1,16 @@
 import logging
+import pickle
+import sqlite3
+import threading
 import time
 import typing as tp
 from concurrent.futures import ThreadPoolExecutor, Executor, Future
 
 from satella.coding.decorators.decorators import short_none
 from satella.coding.recast_exceptions import silence_excs
+from satella.coding.structures.dictionaries.expiring import Cleanupable, ExpiringEntryDictThread
 from satella.coding.structures.lru import LRU
+from satella.coding.structures.tinylfu import WTinyLFU
 from satella.coding.typing import K, V, NoArgCallable
 
 logger = logging.getLogger(__name__)
@@ -45,7 +50,7 @@ def _parse_time_string(s: tp.Union[int, float, str]) -> float:
     return float(s)
 
 
-class CacheDict(tp.Mapping[K, V]):
+class CacheDict(tp.Mapping[K, V], Cleanupable):
     """
     A dictionary that you can use as a cache.
 
@@ -62,6 +67,22 @@ class CacheDict(tp.Mapping[K, V]):
     Note that value_getter raising KeyError is not cached, so don't use this
     cache for situations where misses are frequent.
 
+    Reads served from memory are counted in hits, and reads that had to wait for value_getter
+    are counted in misses, see :attr:`hit_ratio`.
+
+    At most a single value_getter call per key will be in progress at a time. Concurrent
+    readers of a missing or expired key, as well as refreshes of a stale key, will wait for
+    the call that's already running instead of launching their own.
+
+    Entries that are not read anymore are not removed on their own. Call :meth:`sweep`
+    periodically, or pass sweep_in_background=True, to remove entries that expired
+    and failures that are no longer cached. This will also refresh entries that are due for
+    a refresh ahead.
+
+    If keys are stored at the same time, they will all go stale at the same time. Give jitter
+    to make the ages at which entries go stale or are refreshed ahead pseudo-random, so that
+    the refreshes are spread out.
+
     :param stale_interval: time in seconds after which an entry will be stale, ie.
         it will be served from cache, but a task will be launched in background to
         refresh it. Note that this will accept time-like strings eg. 23m.
@@ -79,6 +100,21 @@ class CacheDict(tp.Mapping[K, V]):
     :param default_value_factory: if given, this is the callable that will return values
         that will be given to user instead of throwing KeyError. If not given (default),
         KeyError will be thrown
+    :param value_getter_many: a callable that accepts a list of keys, and returns a dict of
+        values for them, used by :meth:`get_many` to fetch many keys in a single call. Keys
+        missing from the returned dict are treated as if value_getter raised KeyError for them.
+        If not given, :meth:`get_many` will call value_getter for each of the keys.
+    :param refresh_ahead: time in seconds after which an entry that was read since it's been
+        stored will be refreshed in background by :meth:`sweep`, so that keys that are read
+        frequently are refreshed before they go stale. Must not be larger than stale_interval.
+        Note that this will accept time-like strings eg. 23m.
+    :param jitter: fraction of stale_interval and refresh_ahead, from 0 to 1, by which they will
+        be shortened for each entry. The amount is pseudo-random, derived from the key and the
+        time the entry was stored. Expiration interval is never shortened.
+    :param sweep_in_background: whether to call :meth:`sweep` every few seconds from the thread
+        that cleans up :class:`~satella.coding.structures.ExpiringEntryDict`
+    :param sweep_batch_size: maximum amount of entries that a single call to :meth:`sweep`
+        will look at
     """
 
     def __len__(self) -> int:
@@ -93,6 +129,7 @@ class CacheDict(tp.Mapping[K, V]):
         """
         self.data[key] = value
         self.timestamp_data[key] = timestamp or self.time_getter()
+        self.read_keys.discard(key)
 
     def has_info_about(self, key: K) -> bool:
         """
@@ -122,13 +159,24 @@ class CacheDict(tp.Mapping[K, V]):
                  value_getter_executor: tp.Optional[Executor] = None,
                  cache_failures_interval: tp.Optional[tp.Union[float, int, str]] = None,
                  time_getter: NoArgCallable[float] = time.monotonic,
-                 default_value_factory: tp.Optional[NoArgCallable[V]] = None):
+                 default_value_factory: tp.Optional[NoArgCallable[V]] = None,
+                 value_getter_many: tp.Optional[tp.Callable[[tp.List[K]], tp.Dict[K, V]]] = None,
+                 refresh_ahead: tp.Optional[tp.Union[float, int, str]] = None,
+                 jitter: float = 0,
+                 sweep_in_background: bool = False,
+                 sweep_batch_size: int = 1000):
         self.stale_interval = _parse_time_string(stale_interval)
         self.expiration_interval = _parse_time_string(expiration_interval)
         assert self.stale_interval <= self.expiration_interval, 'Stale interval may not be larger ' \
                                                                 'than expiration interval!'
+        self.refresh_ahead = short_none(_parse_time_string)(refresh_ahead)
+        assert self.refresh_ahead is None or self.refresh_ahead <= self.stale_interval, \
+            'Refresh ahead may not be larger than stale interval!'
+        assert 0 <= jitter <= 1, 'Jitter must be between 0 and 1!'
+        self.jitter = jitter
         self.default_value_factory = default_value_factory
         self.value_getter = value_getter
+        self.value_getter_many = value_getter_many
         if value_getter_executor is None:
             value_getter_executor = ThreadPoolExecutor(max_workers=4)
         self.value_getter_executor = value_getter_executor
@@ -138,6 +186,226 @@ class CacheDict(tp.Mapping[K, V]):
         self.cache_failures = cache_failures_interval is not None
         self.cache_failures_interval = short_none(_parse_time_string)(cache_failures_interval)
         self.time_getter = time_getter
+        self.in_flight = {}  # type: tp.Dict[K, Future]
+        self.in_flight_lock = threading.Lock()
+        self.hits = 0  # type: int
+        self.misses = 0  # type: int
+        # keys read since they were stored, tracked only if refresh_ahead is given
+        self.read_keys = set()  # type: tp.Set[K]
+        self.sweep_batch_size = sweep_batch_size
+        self.sweep_queue = []  # type: tp.List[K]
+        if sweep_in_background:
+            ExpiringEntryDictThread().add_dict(self)
+
+    @property
+    def hit_ratio(self) -> float:
+        """
+        Fraction of reads that were served from memory, or 0 if there were no reads
+        """
+        reads = self.hits + self.misses
+        return self.hits / reads if reads else 0.0
+
+    def _jittered(self, key: K, timestamp: float, interval: float) -> float:
+        """
+        Return interval shortened by a pseudo-random fraction of jitter for given entry
+        """
+        if not self.jitter:
+            return interval
+        fraction = (hash((key, timestamp)) & 0xFFFF) / 0x10000
+        return interval * (1 - self.jitter * fraction)
+
+    def _mark_as_read(self, key: K) -> None:
+        if self.refresh_ahead is not None:
+            self.read_keys.add(key)
+
+    def sweep(self, max_entries: tp.Optional[int] = None) -> int:
+        """
+        Remove entries that expired and failures that are no longer cached, and schedule
+        refreshes of entries that are due for a refresh ahead.
+
+        Consecutive calls continue where the previous one stopped, so that every entry is
+        looked at once per len(self) / max_entries calls.
+
+        :param max_entries: maximum amount of entries to look at, by default sweep_batch_size
+        :return: amount of entries removed
+        """
+        if max_entries is None:
+            max_entries = self.sweep_batch_size
+        if not self.sweep_queue:
+            self.sweep_queue = list(self.timestamp_data)
+        now = self.time_getter()
+        removed = 0
+        for _ in range(min(max_entries, len(self.sweep_queue))):
+            key = self.sweep_queue.pop()
+            try:
+                timestamp = self.timestamp_data[key]
+            except KeyError:  # removed in the meantime
+                continue
+            age = now - timestamp
+            if key in self.cache_missed:
+                if age > self.cache_failures_interval:
+                    self.invalidate(key)
+                    removed += 1
+            elif age > self.expiration_interval:
+                self.invalidate(key)
+                removed += 1
+            elif key in self.read_keys and \
+                    age > self._jittered(key, timestamp, self.refresh_ahead):
+                self.read_keys.discard(key)
+                self.schedule_a_fetch(key)
+        return removed
+
+    def cleanup(self) -> None:
+        self.sweep()
+
+    def fetch(self, key: K) -> tp.Tuple[Future, bool]:
+        """
+        Return a future of a value_getter call for given key, submitting it if there's
+        none in progress.
+
+        :param key: key to fetch
+        :return: a tuple of (future, whether it was submitted by this call)
+        """
+        with self.in_flight_lock:
+            future = self.in_flight.get(key)
+            if future is not None and not future.done():
+                return future, False
+            future = self.value_getter_executor.submit(self.value_getter, key)
+            self.in_flight[key] = future
+
+        def on_done(fut: Future) -> None:
+            with self.in_flight_lock:
+                if self.in_flight.get(key) is fut:
+                    del self.in_flight[key]
+
+        future.add_done_callback(on_done)
+        return future, True
+
+    def fetch_many(self, keys: tp.Iterable[K]) -> tp.Tuple[tp.Dict[K, Future], tp.Set[K]]:
+        """
+        Return futures of values for given keys, fetching the keys that are not already
+        in progress with a single call to value_getter_many, if it's given.
+
+        A future of a key missing from the result of value_getter_many will raise KeyError.
+
+        :param keys: keys to fetch
+        :return: a tuple of (a dict of key to it's future, keys that were submitted by this call)
+        """
+        if self.value_getter_many is None:
+            futures, submitted = {}, set()
+            for key in keys:
+                futures[key], was_submitted = self.fetch(key)
+                if was_submitted:
+                    submitted.add(key)
+            return futures, submitted
+
+        futures, submitted = {}, set()
+        with self.in_flight_lock:
+            for key in keys:
+                future = self.in_flight.get(key)
+                if future is None or future.done():
+                    future = self.in_flight[key] = Future()
+                    future.set_running_or_notify_cancel()
+                    submitted.add(key)
+                futures[key] = future
+
+        def on_done(key: K, fut: Future) -> None:
+            with self.in_flight_lock:
+                if self.in_flight.get(key) is fut:
+                    del self.in_flight[key]
+
+        def get_many() -> None:
+            try:
+                values = self.value_getter_many(list(submitted))
+            except Exception as e:  # pylint: disable=broad-except
+                for key in submitted:
+                    futures[key].set_exception(e)
+                return
+            for key in submitted:
+                if key in values:
+                    futures[key].set_result(values[key])
+                else:
+                    futures[key].set_exception(KeyError(key))
+
+        if submitted:
+            for key in submitted:
+                futures[key].add_done_callback(lambda fut, key=key: on_done(key, fut))
+            try:
+                self.value_getter_executor.submit(get_many)
+            except Exception as e:
+                # fail the futures, so that concurrent fetches of these keys don't wait forever
+                for key in submitted:
+                    futures[key].set_exception(e)
+                raise
+        return futures, submitted
+
+    def get_many(self, keys: tp.Iterable[K]) -> tp.Dict[K, V]:
+        """
+        Get values for many keys at once.
+
+        Fresh and stale values are served from memory, and the rest are fetched with a single
+        call to value_getter_many, if it's given. Stale keys are refreshed in background,
+        also with a single call.
+
+        Failures are cached as in :meth:`__getitem__`. Keys that could not be found will be
+        given values from default_value_factory, or will be missing from the result if it
+        is not given.
+
+        :param keys: keys to get
+        :return: a dict of key to it's value
+        """
+        now = self.time_getter()
+        result = {}
+        to_fetch = []
+        to_refresh = []
+        for key in keys:
+            try:
+                timestamp = self.timestamp_data[key]
+                if key in self.cache_missed:
+                    if now - timestamp <= self.cache_failures_interval:
+                        if self.default_value_factory:
+                            result[key] = self.default_value_factory()
+                        continue
+                else:
+                    age = now - timestamp
+                    if age <= self.expiration_interval:
+                        result[key] = self.data[key]
+                        self._mark_as_read(key)
+                        if age > self._jittered(key, timestamp, self.stale_interval):
+                            to_refresh.append(key)
+                        continue
+            except KeyError:  # not present, or invalidated by another thread in the meantime
+                pass
+            to_fetch.append(key)
+
+        self.hits += len(result)
+        self.misses += len(to_fetch)
+        if to_refresh:
+            futures, submitted = self.fetch_many(to_refresh)
+            for key in submitted:
+                futures[key].add_done_callback(
+                    lambda fut, key=key: self._on_fetched(key, fut))
+
+        if to_fetch:
+            futures, _ = self.fetch_many(to_fetch)
+            for key, future in futures.items():
+                try:
+                    result[key] = future.result()
+                except KeyError:
+                    self._on_failure(key)
+                    if self.default_value_factory:
+                        result[key] = self.default_value_factory()
+                else:
+                    self[key] = result[key]
+        return result
+
+    def _on_fetched(self, key: K, future: Future) -> None:
+        try:
+            result = future.result()
+        except KeyError:
+            self._on_failure(key)
+        else:
+            self[key] = result
 
     def get_value_block(self, key: K) -> V:
         """
@@ -145,7 +413,7 @@ class CacheDict(tp.Mapping[K, V]):
 
         :raises KeyError: the value is not present at all
         """
-        future = self.value_getter_executor.submit(self.value_getter, key)
+        future, _ = self.fetch(key)
         try:
             value = future.result()
         except KeyError:
@@ -170,22 +438,14 @@ class CacheDict(tp.Mapping[K, V]):
 
     def schedule_a_fetch(self, key: K) -> Future:
         """
-        Schedule a value refresh for given key
+        Schedule a value refresh for given key, unless one is already in progress
 
         :param key: key to schedule the refresh for
         :return: future that was queued to ask for given key
         """
-        future = self.value_getter_executor.submit(self.value_getter, key)
-
-        def on_done_callback(fut: Future) -> None:
-            try:
-                result = fut.result()
-            except KeyError:
-                self._on_failure(key)
-            else:
-                self[key] = result
-
-        future.add_done_callback(on_done_callback)
+        future, submitted = self.fetch(key)
+        if submitted:
+            future.add_done_callback(lambda fut: self._on_fetched(key, fut))
         return future
 
     @silence_excs(KeyError)
@@ -205,8 +465,10 @@ class CacheDict(tp.Mapping[K, V]):
     def _on_cache_hit_empty(self, key: K, timestamp: float, now: float) -> V:
         if key in self.cache_missed:
             if now - timestamp > self.cache_failures_interval:
+                self.misses += 1
                 return self.get_value_block(key)
             else:
+                self.hits += 1
                 if self.default_value_factory:
                     return self.default_value_factory()
                 else:
@@ -214,6 +476,7 @@ class CacheDict(tp.Mapping[K, V]):
 
     def __getitem__(self, key: K) -> V:
         if key not in self.data and key not in self.cache_missed:
+            self.misses += 1
             return self.get_value_block(key)
 
         timestamp = self.timestamp_data[key]
@@ -226,18 +489,21 @@ class CacheDict(tp.Mapping[K, V]):
 
     def _on_cache_hit(self, key: K, timestamp: float, now: float) -> V:
         if now - timestamp > self.expiration_interval:
+            self.misses += 1
             return self.get_value_block(key)
-        elif now - timestamp > self.stale_interval:
+        self.hits += 1
+        self._mark_as_read(key)
+        if now - timestamp > self._jittered(key, timestamp, self.stale_interval):
             self.schedule_a_fetch(key)
-            return self.data[key]
-        else:
-            return self.data[key]
+        return self.data[key]
 
     def __delitem__(self, key: K) -> None:
-        del self.data[key]
-        del self.timestamp_data[key]
-        with silence_excs(KeyError):
+        if key in self.cache_missed:
             self.cache_missed.remove(key)
+        else:
+            del self.data[key]
+        del self.timestamp_data[key]
+        self.read_keys.discard(key)
 
     def __setitem__(self, key: K, value: V) -> None:
         """
@@ -245,6 +511,7 @@ class CacheDict(tp.Mapping[K, V]):
         """
         self.data[key] = value
         self.timestamp_data[key] = self.time_getter()
+        self.read_keys.discard(key)
         with silence_excs(KeyError):
             self.cache_missed.remove(key)
 
@@ -253,14 +520,47 @@ class LRUCacheDict(CacheDict[K, V]):
     """
     A dictionary that you can use as a cache with a maximum size, items evicted by LRU policy.
 
+    Optionally, entries can also be weighed, eg. by their size in bytes, and least recently
+    used entries will be evicted until their total weight is at most max_weight. An entry
+    heavier than max_weight will be evicted right after it's stored.
+
     :param max_size: maximum size
+    :param weigher: a callable that accepts a key and a value and returns the weight of the entry.
+        If max_weight is given but weigher is not, the size of the value in bytes, as
+        computed by :func:`~satella.instrumentation.memory.get_size`, will be used.
+    :param max_weight: maximum total weight of the entries
     """
 
-    def __init__(self, *args, max_size: int = 100, **kwargs):
+    def __init__(self, *args, max_size: int = 100,
+                 weigher: tp.Optional[tp.Callable[[K, V], int]] = None,
+                 max_weight: tp.Optional[int] = None, **kwargs):
         super().__init__(*args, **kwargs)
         assert max_size > 0, 'Too small max_size!'
         self.max_size = max_size
         self.lru = LRU()
+        if max_weight is not None and weigher is None:
+            from satella.instrumentation.memory import get_size
+
+            def weigher(key: K, value: V) -> int:
+                return get_size(value)
+        self.weigher = weigher
+        self.max_weight = max_weight
+        self.weights = {}  # type: tp.Dict[K, int]
+        self.total_weight = 0  # type: int
+
+    def _weigh(self, key: K) -> None:
+        """
+        Account for the weight of a just stored entry, and evict entries if the total weight
+        is too large
+        """
+        if self.weigher is None:
+            return
+        weight = self.weigher(key, self.data[key])
+        self.total_weight += weight - self.weights.get(key, 0)
+        self.weights[key] = weight
+        if self.max_weight is not None:
+            while self.total_weight > self.max_weight and self.lru:
+                self.evict()
 
     def make_room(self) -> None:
         """
@@ -293,13 +593,16 @@ class LRUCacheDict(CacheDict[K, V]):
         self.lru.mark_as_used(key)
         return super().__getitem__(key)
 
-    def get_value_block(self, key: K) -> V:
-        v = super().get_value_block(key)
-        self.lru.add(key)
-        return v
+    def get_many(self, keys: tp.Iterable[K]) -> tp.Dict[K, V]:
+        keys = list(keys)
+        for key in keys:
+            if key in self.data:
+                self.lru.mark_as_used(key)
+        return super().get_many(keys)
 
     def __delitem__(self, key: K) -> None:
         super().__delitem__(key)
+        self.total_weight -= self.weights.pop(key, 0)
         self.lru.remove(key)
 
     def feed(self, key: K, value: V, timestamp: tp.Optional[float] = None):
@@ -310,6 +613,7 @@ class LRUCacheDict(CacheDict[K, V]):
             self.make_room()
         super().feed(key, value, timestamp)
         self.lru.add(key)
+        self._weigh(key)
 
     def __setitem__(self, key: K, value: V) -> None:
         """
@@ -318,3 +622,196 @@ class LRUCacheDict(CacheDict[K, V]):
         self.make_room()
         self.lru.mark_as_used(key)
         super().__setitem__(key, value)
+        self._weigh(key)
+
+
+class TinyLFUCacheDict(CacheDict[K, V]):
+    """
+    A dictionary that you can use as a cache with a maximum size, items evicted by
+    the W-TinyLFU policy (see :class:`~satella.coding.structures.WTinyLFU`).
+
+    Unlike :class:`LRUCacheDict`, a burst of keys that are read only once will not evict
+    the keys that are read frequently.
+
+    :param max_size: maximum size
+    :param window_fraction: fraction of max_size reserved for the window of recently added keys
+    """
+
+    def __init__(self, *args, max_size: int = 100, window_fraction: float = 0.01, **kwargs):
+        super().__init__(*args, **kwargs)
+        assert max_size > 0, 'Too small max_size!'
+        self.max_size = max_size
+        self.policy = WTinyLFU(max_size, window_fraction)  # type: WTinyLFU[K]
+
+    def _admit(self, key: K) -> None:
+        if key not in self.policy:
+            for evicted in self.policy.add(key):
+                self.invalidate(evicted)
+
+    def __getitem__(self, key: K) -> V:
+        self.policy.mark_as_used(key)
+        return super().__getitem__(key)
+
+    def get_many(self, keys: tp.Iterable[K]) -> tp.Dict[K, V]:
+        keys = list(keys)
+        for key in keys:
+            self.policy.mark_as_used(key)
+        return super().get_many(keys)
+
+    def __delitem__(self, key: K) -> None:
+        super().__delitem__(key)
+        self.policy.remove(key)
+
+    def feed(self, key: K, value: V, timestamp: tp.Optional[float] = None):
+        """
+        Feed this data into the cache
+        """
+        super().feed(key, value, timestamp)
+        self._admit(key)
+
+    def __setitem__(self, key: K, value: V) -> None:
+        """
+        Store a value with current timestamp
+        """
+        super().__setitem__(key, value)
+        self._admit(key)
+
+
+class TwoTierCacheDict(LRUCacheDict[K, V]):
+    """
+    A :class:`LRUCacheDict` backed by a SQLite database on disk.
+
+    Entries evicted from memory are spilled to disk, and keys missing from memory are looked
+    for on disk before value_getter is called. An entry loaded from disk is moved back into
+    memory, and is refreshed if it's stale, like any other entry. Entries that are still in
+    memory are written to disk by :meth:`close`, so that the cache survives a restart of the
+    program. Entries that expired are removed from disk by :meth:`sweep`.
+
+    Timestamps are stored on disk as wall clock time, so that stale and expiration intervals
+    hold across restarts, as long as the wall clock is not changed in the meantime.
+
+    Keys and values are stored pickled, so keys have to pickle the same way each time they
+    are pickled, eg. strings, numbers or tuples of them.
+
+    Can be used as a context manager, which will close it on exit. After it's closed, sweeps
+    and removals from disk do nothing.
+
+    :param path: path to the database file. It will be created if it doesn't exist.
+    """
+
+    def __init__(self, *args, path: str, **kwargs):
+        self.closed = False
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.disk_lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, '
+                                    'value BLOB NOT NULL, timestamp REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS entries_timestamp '
+                                    'ON entries (timestamp)')
+
+    def __enter__(self) -> 'TwoTierCacheDict[K, V]':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        self.close()
+        return False
+
+    def spill(self, *keys: K) -> None:
+        """
+        Write entries that are present in memory to disk, in a single transaction
+
+        :raises KeyError: an entry is not present in memory
+        """
+        offset = time.time() - self.time_getter()
+        rows = [(pickle.dumps(key), pickle.dumps(self.data[key]),
+                 self.timestamp_data[key] + offset) for key in keys]
+        with self.disk_lock:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                            rows)
+
+    def load(self, key: K) -> bool:
+        """
+        Move an entry that did not expire from disk into memory
+
+        :return: whether the entry was loaded
+        """
+        with self.disk_lock:
+            with self.connection:
+                row = self.connection.execute('SELECT value, timestamp FROM entries WHERE key=?',
+                                              (pickle.dumps(key),)).fetchone()
+                if row is None:
+                    return False
+                self.connection.execute('DELETE FROM entries WHERE key=?', (pickle.dumps(key),))
+        value, timestamp = row
+        age = time.time() - timestamp
+        if age > self.expiration_interval:
+            return False
+        self.feed(key, pickle.loads(value), self.time_getter() - age)
+        return True
+
+    def _remove_from_disk(self, key: K) -> None:
+        with self.disk_lock:
+            if self.closed:
+                return
+            with self.connection:
+                self.connection.execute('DELETE FROM entries WHERE key=?', (pickle.dumps(key),))
+
+    @silence_excs(KeyError)
+    def evict(self):
+        key = self.lru.get_item_to_evict()
+        if key in self.data:
+            self.spill(key)
+        super().invalidate(key)
+
+    @silence_excs(KeyError)
+    def invalidate(self, key: K) -> None:
+        """
+        Remove all information about given key from the cache, both from memory and from disk
+        """
+        self._remove_from_disk(key)
+        super().invalidate(key)
+
+    def get_value_block(self, key: K) -> V:
+        if self.load(key):
+            timestamp = self.timestamp_data[key]
+            if self.time_getter() - timestamp > self._jittered(key, timestamp,
+                                                               self.stale_interval):
+                self.schedule_a_fetch(key)
+            return self.data[key]
+        return super().get_value_block(key)
+
+    def get_many(self, keys: tp.Iterable[K]) -> tp.Dict[K, V]:
+        keys = list(keys)
+        for key in keys:
+            if key not in self.data and key not in self.cache_missed:
+                self.load(key)
+        return super().get_many(keys)
+
+    def sweep(self, max_entries: tp.Optional[int] = None) -> int:
+        if self.closed:
+            return 0
+        removed = super().sweep(max_entries)
+        with self.disk_lock:
+            if self.closed:
+                return removed
+            with self.connection:
+                removed += self.connection.execute(
+                    'DELETE FROM entries WHERE timestamp<?',
+                    (time.time() - self.expiration_interval,)).rowcount
+        return removed
+
+    def close(self) -> None:
+        """
+        Write all entries that are in memory to disk and close the database.
+
+        Does nothing if it's already closed.
+        """
+        if self.closed:
+            return
+        self.spill(*[key for key in list(self.data) if key in self.timestamp_data])
+        with self.disk_lock:
+            self.closed = True
+            self.connection.close()
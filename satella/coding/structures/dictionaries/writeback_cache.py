@@ -1,11 +1,17 @@
-import time
+import logging
+import threading
 import typing as tp
-from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 
 from satella.coding.concurrent.monitor import Monitor
-from satella.coding.concurrent.sync import sync_threadpool
 from satella.coding.recast_exceptions import silence_excs
 from satella.coding.typing import V, K
+from satella.exceptions import WouldWaitMore
+
+logger = logging.getLogger(__name__)
+
+_DELETED = object()
+_CLEAN = object()
 
 
 class ExclusiveWritebackCache(tp.Generic[K, V]):
@@ -20,62 +26,203 @@ class ExclusiveWritebackCache(tp.Generic[K, V]):
     :param delete_method: optional, a blocking callable (key) that erases the data from the storage.
         If not given, it will be a TypeError to delete the data from this storage
     :param executor: an executor to execute the calls with. If None (default) is given, a
-        ThreadPoolExecutor with 4 workers will be created
-    :param no_concurrent_executors: number of concurrent jobs that the executor is able
-        to handle. This is used by sync()
+        ThreadPoolExecutor with no_concurrent_executors workers will be created
+    :param no_concurrent_executors: number of workers of the executor that will be created if
+        executor is not given, by default 4
     :param store_key_errors: whether to remember KeyErrors raised by read_method
+    :param coalesce: whether to collect written and deleted keys instead of writing them back
+        right away. Repeated writes of a key will be collapsed into a single write of it's
+        latest value. Collected keys are written back in batches, when flush_size of them
+        are collected, or flush_interval seconds after the first of them was, or when
+        :meth:`flush` or :meth:`sync` is called. Batches are written one after another,
+        so that writes of a key are applied in order, which is not guaranteed otherwise.
+    :param flush_interval: maximum time in seconds for which a key will wait to be written back
+    :param flush_size: amount of collected keys that will trigger a write back
+    :param max_dirty: maximum amount of keys waiting to be written back, at least 1. Writers of
+        further keys will block until a batch is written. By default there's no limit.
+    :param write_many: optional, a blocking callable (dict of key to value) that writes a batch
+        of values. If not given, write_method will be called for each of them.
+    :param delete_many: optional, a blocking callable (list of keys) that erases a batch of keys.
+        If not given, delete_method will be called for each of them.
+
+    Keys are removed from the collected ones only after they are written back. If writing
+    them back fails, they will be retried by the next flush. A flush in background that
+    failed is logged and retried after flush_interval. Until a flush succeeds, neither
+    flush_size nor blocked writers will trigger an immediate flush.
+
+    :raises ValueError: max_dirty is less than 1
     """
     __slots__ = ('executor', 'read_method', 'write_method', 'delete_method',
                  'no_concurrent_executors', 'in_cache', 'cache_lock',
-                 'cache', 'operations', 'store_key_errors')
+                 'cache', 'operations', 'store_key_errors', 'pending', 'pending_condition',
+                 'coalesce', 'flush_interval', 'flush_size', 'max_dirty', 'write_many',
+                 'delete_many', 'dirty', 'dirty_condition', 'flush_lock', 'flush_timer',
+                 'flush_failed')
 
     def __init__(self, write_method: tp.Callable[[K, V], None],
                  read_method: tp.Callable[[K], V],
                  delete_method: tp.Optional[tp.Callable[[K], None]] = None,
                  executor: tp.Optional[Executor] = None,
                  no_concurrent_executors: tp.Optional[int] = None,
-                 store_key_errors: bool = True
+                 store_key_errors: bool = True,
+                 coalesce: bool = False,
+                 flush_interval: float = 1,
+                 flush_size: int = 100,
+                 max_dirty: tp.Optional[int] = None,
+                 write_many: tp.Optional[tp.Callable[[tp.Dict[K, V]], None]] = None,
+                 delete_many: tp.Optional[tp.Callable[[tp.List[K]], None]] = None
                  ):
+        if max_dirty is not None and max_dirty < 1:
+            raise ValueError('max_dirty must be at least 1, not %s' % (max_dirty,))
+        self.no_concurrent_executors = no_concurrent_executors or 4
         if executor is None:
-            self.executor = ThreadPoolExecutor(max_workers=4)
+            self.executor = ThreadPoolExecutor(max_workers=self.no_concurrent_executors)
         else:
             self.executor = executor
         self.store_key_errors = store_key_errors
         self.write_method = write_method
         self.delete_method = delete_method
         self.read_method = read_method
-        self.no_concurrent_executors = no_concurrent_executors or 4
         self.in_cache = set()
         self.cache_lock = Monitor()
         self.cache = {}
         self.operations = 0
+        self.pending = 0
+        self.pending_condition = threading.Condition()
+        self.coalesce = coalesce
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size if max_dirty is None else min(flush_size, max_dirty)
+        self.max_dirty = max_dirty
+        self.write_many = write_many
+        self.delete_many = delete_many
+        self.dirty = {}  # type: tp.Dict[K, tp.Any]
+        self.dirty_condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.flush_timer = None  # type: tp.Optional[threading.Timer]
+        self.flush_failed = False  # type: bool
 
     def get_queue_length(self) -> int:
         """
         Return current amount of entries waiting for writeback
         """
-        # noinspection PyProtectedMember
-        if isinstance(self.executor, ThreadPoolExecutor):
-            return self.executor._work_queue.qsize()
-        elif isinstance(self.executor, ProcessPoolExecutor):
-            return self.executor._call_queue.qsize()
-        else:
-            return 0
+        return self.pending + len(self.dirty)
+
+    def _submit(self, fun: tp.Callable, *args) -> None:
+        with self.pending_condition:
+            self.pending += 1
+        self.executor.submit(fun, *args).add_done_callback(self._on_done)
+
+    def _on_done(self, future: Future) -> None:
+        with self.pending_condition:
+            self.pending -= 1
+            if not self.pending:
+                self.pending_condition.notify_all()
+
+    def _schedule_flush(self, delay: float) -> None:
+        """
+        Schedule a flush in background, unless one is scheduled to happen earlier.
+
+        Must be called with dirty_condition held.
+        """
+        if self.flush_timer is not None:
+            if delay or not self.flush_timer.interval:
+                return
+            self.flush_timer.cancel()
+        self.flush_timer = threading.Timer(delay, self._flush_in_background)
+        self.flush_timer.daemon = True
+        self.flush_timer.start()
+
+    def flush(self, timeout: tp.Optional[float] = None) -> None:
+        """
+        Write back keys that were collected so far, waiting for a write back in progress
+        to complete first. Does nothing if coalesce is not enabled.
+
+        :param timeout: timeout to wait for the write back in progress. None means wait
+            indefinitely.
+        :raises WouldWaitMore: if timeout has expired
+        :raises Exception: anything that write_many, write_method, delete_many or
+            delete_method raised. Keys that were not written back will be retried by the
+            next flush.
+        """
+        if not self.flush_lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise WouldWaitMore('timeout exceeded')
+        try:
+            with self.dirty_condition:
+                batch = dict(self.dirty)
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+
+            written = []
+            failed = True
+            try:
+                to_write = {key: value for key, value in batch.items() if value is not _DELETED}
+                to_delete = [key for key, value in batch.items() if value is _DELETED]
+                if to_write:
+                    if self.write_many is not None:
+                        self.write_many(to_write)
+                        written.extend(to_write)
+                    else:
+                        for key, value in to_write.items():
+                            self.write_method(key, value)
+                            written.append(key)
+                if to_delete:
+                    if self.delete_many is not None:
+                        self.delete_many(to_delete)
+                        written.extend(to_delete)
+                    else:
+                        for key in to_delete:
+                            self.delete_method(key)
+                            written.append(key)
+                failed = False
+            finally:
+                with self.dirty_condition:
+                    self.flush_failed = failed
+                    for key in written:
+                        # unless it was written again in the meantime
+                        if self.dirty.get(key, _CLEAN) is batch[key]:
+                            del self.dirty[key]
+                    self.dirty_condition.notify_all()
+        finally:
+            self.flush_lock.release()
+
+    def _flush_in_background(self) -> None:
+        try:
+            self.flush()
+        except Exception:   # pylint: disable=broad-except
+            logger.exception('Writing back the cache failed, will retry')
+            with self.dirty_condition:
+                if self.dirty:
+                    self._schedule_flush(self.flush_interval)
+
+    def _mark_dirty(self, key: K, value) -> None:
+        with self.dirty_condition:
+            if self.max_dirty is not None:
+                while key not in self.dirty and len(self.dirty) >= self.max_dirty:
+                    # don't cut the back off short after a failed flush
+                    self._schedule_flush(self.flush_interval if self.flush_failed else 0)
+                    self.dirty_condition.wait()
+            self.dirty[key] = value
+            if len(self.dirty) >= self.flush_size and not self.flush_failed:
+                self._schedule_flush(0)
+            else:
+                self._schedule_flush(self.flush_interval)
 
     def sync(self, timeout: tp.Optional[float] = None) -> None:
         """
         Wait until current tasks are complete.
 
+        If coalesce is enabled, write back the keys that were collected so far.
+
         :param timeout: timeout to wait. None means wait indefinitely.
         :raises WouldWaitMore: if timeout has expired
         """
-        while self.get_queue_length() > 0:
-            time.sleep(0.1)
-
-        def fix():
+        if self.coalesce:
+            self.flush(timeout)
             return
-
-        sync_threadpool(self.executor, max_wait=timeout)
+        with self.pending_condition:
+            if not self.pending_condition.wait_for(lambda: not self.pending, timeout):
+                raise WouldWaitMore('timeout exceeded')
 
     def _operate(self):
         self.operations += 1
@@ -86,6 +233,12 @@ class ExclusiveWritebackCache(tp.Generic[K, V]):
 
     def __getitem__(self, item: K) -> V:
         self._operate()
+        if self.coalesce:
+            value = self.dirty.get(item, _CLEAN)
+            if value is _DELETED:
+                raise KeyError(item)
+            elif value is not _CLEAN:
+                return value
         if item not in self.in_cache:
             try:
                 value = self.executor.submit(self.read_method, item).result()
@@ -105,19 +258,25 @@ class ExclusiveWritebackCache(tp.Generic[K, V]):
                 return self.cache[item]
 
     def __delitem__(self, key: K) -> None:
-        if self.delete_method is None:
+        if self.delete_method is None and (not self.coalesce or self.delete_many is None):
             raise TypeError('Cannot delete from this writeback cache!')
         if self.store_key_errors:
             with self.cache_lock:
                 self.in_cache.add(key)
         with silence_excs(KeyError):
             del self.cache[key]
-        self.executor.submit(self.delete_method, key)
+        if self.coalesce:
+            self._mark_dirty(key, _DELETED)
+        else:
+            self._submit(self.delete_method, key)
         self._operate()
 
     def __setitem__(self, key: K, value: V) -> None:
         with self.cache_lock:
             self.cache[key] = value
             self.in_cache.add(key)
-        self.executor.submit(self.write_method, key, value)
+        if self.coalesce:
+            self._mark_dirty(key, value)
+        else:
+            self._submit(self.write_method, key, value)
         self._operate()
@@ -34,14 +34,84 @@ class Heap(collections.UserList, tp.Generic[T]):
         self.data.extend(items)
         heapq.heapify(self.data)
 
+    def _lower(self, a: T, b: T) -> bool:
+        """
+        Should a be closer to the top of the heap than b?
+        """
+        return a < b
+
+    def _place(self, index: int, elem: T) -> None:
+        """
+        Put an element at given index of the list. Called for each element that is moved.
+        """
+        self.data[index] = elem
+
+    def _sift_up(self, index: int) -> int:
+        """
+        Move the element at given index towards the top of the heap, while it's lower
+        than it's parent.
+
+        :return: final index of the element
+        """
+        elem = self.data[index]
+        while index > 0:
+            parent_index = (index - 1) >> 1
+            parent = self.data[parent_index]
+            if not self._lower(elem, parent):
+                break
+            self._place(index, parent)
+            index = parent_index
+        self._place(index, elem)
+        return index
+
+    def _sift_down(self, index: int) -> int:
+        """
+        Move the element at given index towards the leaves of the heap, while any of it's
+        children is lower than it.
+
+        :return: final index of the element
+        """
+        elem = self.data[index]
+        length = len(self.data)
+        child_index = 2 * index + 1
+        while child_index < length:
+            right_index = child_index + 1
+            if right_index < length and self._lower(self.data[right_index],
+                                                    self.data[child_index]):
+                child_index = right_index
+            child = self.data[child_index]
+            if not self._lower(child, elem):
+                break
+            self._place(index, child)
+            index = child_index
+            child_index = 2 * index + 1
+        self._place(index, elem)
+        return index
+
+    def _remove_at(self, index: int) -> T:
+        """
+        Remove the element at given index of the list, maintaining the heap invariant
+        in O(log n)
+
+        :return: the removed element
+        """
+        last = self.data.pop()
+        if index == len(self.data):
+            return last
+        elem = self.data[index]
+        self._place(index, last)
+        self._sift_up(self._sift_down(index))
+        return elem
+
     def pop_item(self, item: T) -> T:
         """
-        Pop an item off the heap, maintaining the heap invariant
+        Pop an item off the heap, maintaining the heap invariant.
+
+        Finding the item takes O(n), but removing it takes only O(log n).
 
         :raise ValueError: element not found
         """
-        self.data.remove(item)  # raises: ValueError
-        heapq.heapify(self.data)
+        self._remove_at(self.data.index(item))  # raises: ValueError
         return item
 
     def push(self, item: T, *args) -> None:
@@ -166,6 +236,16 @@ class SetHeap(Heap):
         self.set.remove(item)
         return item
 
+    def pop_item(self, item: T) -> T:
+        """
+        Pop an item off the heap, maintaining the heap invariant
+
+        :raise ValueError: element not found
+        """
+        super().pop_item(item)
+        self.set.remove(item)
+        return item
+
     def __contains__(self, item: T) -> bool:
         return item in self.set
 
@@ -1,10 +1,10 @@
-import heapq
+import copy
 import time
 import typing as tp
 
-from satella.coding.recast_exceptions import rethrow_as
+from satella.coding.recast_exceptions import rethrow_as, silence_excs
 from satella.coding.structures.heaps.base import Heap
-from satella.coding.typing import T, Number, NoArgCallable
+from satella.coding.typing import T, Number, NoArgCallable, Predicate
 
 
 class TimeBasedHeap(Heap):
@@ -54,9 +54,7 @@ class TimeBasedHeap(Heap):
         """
         for index, item in enumerate(self.data):
             if item[0] == timestamp:
-                ts, item = self.data.pop(index)
-                heapq.heapify(self.data)
-                return item
+                return self._remove_at(index)[1]
         raise ValueError('Element not found!')
 
     def get_timestamp(self, item: T) -> Number:
@@ -77,9 +75,7 @@ class TimeBasedHeap(Heap):
         """
         for index, elem in enumerate(self.data):
             if elem[1] == item:
-                obj = self.data.pop(index)
-                heapq.heapify(self.data)
-                return obj
+                return self._remove_at(index)
         raise ValueError('Element not found!')
 
     def put(self, timestamp_or_value: tp.Union[T, Number],
@@ -156,6 +152,13 @@ class TimeBasedSetHeap(Heap):
 
     Default is time.monotonic
 
+    Positions of items in the heap are indexed, so that popping an item or a timestamp and
+    putting an item that's already present take O(log n). Items with equal timestamps are
+    popped in unspecified order.
+
+    append(), extend() and += put elements like push() does. Operations that modify the
+    heap at given positions, such as item assignment, del, insert() or sort(), raise TypeError.
+
     #notthreadsafe
     """
 
@@ -184,7 +187,78 @@ class TimeBasedSetHeap(Heap):
         """
         self.default_clock_source = default_clock_source or time.monotonic
         super().__init__(from_list=())
-        self.item_to_timestamp = {}
+        self.item_to_timestamp = {}  # type: tp.Dict[T, Number]
+        self.item_to_index = {}  # type: tp.Dict[T, int]
+        self.timestamp_to_items = {}  # type: tp.Dict[Number, tp.Set[T]]
+
+    def __copy__(self) -> 'TimeBasedSetHeap':
+        heap = self.__class__(self.default_clock_source)
+        heap.push_many(self.data)
+        return heap
+
+    def __deepcopy__(self, memo={}) -> 'TimeBasedSetHeap':
+        heap = self.__class__(self.default_clock_source)
+        heap.push_many(copy.deepcopy(self.data, memo=memo))
+        return heap
+
+    def __contains__(self, item: tp.Tuple[Number, T]) -> bool:
+        try:
+            return self.item_to_timestamp[item[1]] == item[0]
+        except KeyError:
+            return False
+
+    def _lower(self, a: tp.Tuple[Number, T], b: tp.Tuple[Number, T]) -> bool:
+        return a[0] < b[0]
+
+    def _place(self, index: int, elem: tp.Tuple[Number, T]) -> None:
+        self.data[index] = elem
+        self.item_to_index[elem[1]] = index
+
+    def _remove_at(self, index: int) -> tp.Tuple[Number, T]:
+        elem = super()._remove_at(index)
+        ts, item = elem
+        del self.item_to_index[item]
+        del self.item_to_timestamp[item]
+        items = self.timestamp_to_items[ts]
+        items.discard(item)
+        if not items:
+            del self.timestamp_to_items[ts]
+        return elem
+
+    def push_many(self, items: tp.Iterable[tp.Tuple[Number, T]]) -> None:
+        for item in items:
+            self.push(item)
+
+    def filter_map(self, filter_fun: tp.Optional[Predicate[tp.Tuple[Number, T]]] = None,
+                   map_fun: tp.Optional[tp.Callable[[tp.Tuple[Number, T]], tp.Any]] = None):
+        super().filter_map(filter_fun=filter_fun, map_fun=map_fun)
+        self.item_to_timestamp = {item: ts for ts, item in self.data}
+        self.item_to_index = {item: index for index, (ts, item) in enumerate(self.data)}
+        self.timestamp_to_items = {}
+        for ts, item in self.data:
+            self.timestamp_to_items.setdefault(ts, set()).add(item)
+
+    def append(self, item: tp.Tuple[Number, T]) -> None:
+        self.push(item)
+
+    def extend(self, items: tp.Iterable[tp.Tuple[Number, T]]) -> None:
+        self.push_many(items)
+
+    def __iadd__(self, items: tp.Iterable[tp.Tuple[Number, T]]) -> 'TimeBasedSetHeap':
+        self.push_many(items)
+        return self
+
+    def clear(self) -> None:
+        self.data.clear()
+        self.item_to_timestamp.clear()
+        self.item_to_index.clear()
+        self.timestamp_to_items.clear()
+
+    def _not_supported(self, *args, **kwargs):
+        raise TypeError('%s does not support positional modification, use push() or '
+                        'pop_item() instead' % (self.__class__.__name__,))
+
+    __setitem__ = __delitem__ = __imul__ = insert = sort = reverse = _not_supported
 
     def pop_timestamp(self, timestamp: Number) -> T:
         """
@@ -193,13 +267,11 @@ class TimeBasedSetHeap(Heap):
 
         :raise ValueError: element not found
         """
-        for index, item in enumerate(self.data):
-            if item[0] == timestamp:
-                obj = self.data.pop(index)
-                del self.item_to_timestamp[obj[1]]
-                heapq.heapify(self.data)
-                return obj[1]
-        raise ValueError('Element not found!')
+        try:
+            item = next(iter(self.timestamp_to_items[timestamp]))
+        except KeyError:
+            raise ValueError('Element not found!')
+        return self._remove_at(self.item_to_index[item])[1]
 
     def pop_item(self, item: T) -> tp.Tuple[Number, T]:
         """
@@ -209,25 +281,39 @@ class TimeBasedSetHeap(Heap):
 
         :raise ValueError: element not found
         """
-        for index, elem in enumerate(self.data):
-            if elem[1] == item:
-                obj = self.data.pop(index)
-                heapq.heapify(self.data)
-                del self.item_to_timestamp[obj[1]]
-                return obj
-        raise ValueError('Element not found!')
+        try:
+            index = self.item_to_index[item]
+        except KeyError:
+            raise ValueError('Element not found!')
+        return self._remove_at(index)
 
     def push(self, item: tp.Tuple[Number, T]) -> None:
-        if item[1] in self.item_to_timestamp:
-            self.pop_item(item[1])
-
-        super().push(item)
-        self.item_to_timestamp[item[1]] = item[0]
+        timestamp, obj = item
+        try:
+            index = self.item_to_index[obj]
+        except KeyError:
+            index = len(self.data)
+            self.data.append(item)
+        else:
+            old_timestamp = self.data[index][0]
+            items = self.timestamp_to_items[old_timestamp]
+            items.discard(obj)
+            if not items:
+                del self.timestamp_to_items[old_timestamp]
+            self.data[index] = item
+        self.item_to_timestamp[obj] = timestamp
+        self.timestamp_to_items.setdefault(timestamp, set()).add(obj)
+        self._sift_down(self._sift_up(index))
 
     def pop(self) -> tp.Tuple[Number, T]:
-        item = super().pop()
-        del self.item_to_timestamp[item[1]]
-        return item
+        """
+        Return the element with the smallest timestamp.
+
+        :raises IndexError: on empty heap
+        """
+        if not self.data:
+            raise IndexError('pop from an empty heap')
+        return self._remove_at(0)
 
     def put(self, timestamp_or_value: tp.Union[T, Number],
             value: tp.Optional[T] = None) -> None:
@@ -264,8 +350,9 @@ class TimeBasedSetHeap(Heap):
                 return
             yield self.pop()
 
+    @silence_excs(ValueError)
     def remove(self, item: T) -> None:
         """
         Remove all things equal to item
         """
-        self.filter_map(filter_fun=lambda i: i[1] != item)
+        self.pop_item(item)
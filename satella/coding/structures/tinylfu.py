@@ -0,0 +1,138 @@
+import typing as tp
+from collections import OrderedDict
+
+T = tp.TypeVar('T', covariant=tp.Hashable)
+
+_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+class CountMinSketch(tp.Generic[T]):
+    """
+    An approximate counter of how frequently were given items seen, in constant memory.
+
+    Counters saturate at 15, and all of them are halved after sample_size increments, so that
+    the sketch forgets items that used to be popular.
+
+    :param width: amount of counters per row, will be rounded up to a power of two
+    :param sample_size: amount of increments after which all counters are halved
+    """
+
+    def __init__(self, width: int, sample_size: int):
+        self.width_bits = max(width - 1, 1).bit_length()  # type: int
+        self.counters = [bytearray(1 << self.width_bits) for _ in _SEEDS] \
+            # type: tp.List[bytearray]
+        self.sample_size = sample_size  # type: int
+        self.additions = 0  # type: int
+
+    def _indices(self, item: T) -> tp.Iterator[int]:
+        hash_ = hash(item) & _MASK_64
+        shift = 64 - self.width_bits
+        for seed in _SEEDS:
+            yield ((hash_ * seed) & _MASK_64) >> shift
+
+    def increment(self, item: T) -> None:
+        """
+        Count an occurrence of item
+        """
+        for row, index in zip(self.counters, self._indices(item)):
+            if row[index] < 15:
+                row[index] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.age()
+
+    def estimate(self, item: T) -> int:
+        """
+        Return an estimate of how many times was item seen
+        """
+        return min(row[index] for row, index in zip(self.counters, self._indices(item)))
+
+    def age(self) -> None:
+        """
+        Halve all the counters
+        """
+        self.counters = [bytearray(counter >> 1 for counter in row) for row in self.counters]
+        self.additions //= 2
+
+
+class WTinyLFU(tp.Generic[T]):
+    """
+    A class to choose which objects to evict using the W-TinyLFU policy, described in
+    `TinyLFU: A Highly Efficient Cache Admission Policy <https://arxiv.org/abs/1512.00727>`_.
+
+    New objects enter a small LRU window. Objects evicted from the window are admitted into the
+    main segmented LRU only if they were used more frequently than the object that would be evicted
+    from there, so a scan of objects that are used once will not flush the frequently used ones.
+
+    :param max_size: maximum amount of objects
+    :param window_fraction: fraction of max_size reserved for the window
+    :param protected_fraction: fraction of the main LRU reserved for objects that were used
+        at least twice while in the cache
+    """
+
+    def __init__(self, max_size: int, window_fraction: float = 0.01,
+                 protected_fraction: float = 0.8):
+        self.window_size = max(int(max_size * window_fraction), 1)  # type: int
+        self.main_size = max(max_size - self.window_size, 0)  # type: int
+        self.protected_size = int(self.main_size * protected_fraction)  # type: int
+        self.sketch = CountMinSketch(max(max_size, 16), 10 * max(max_size, 16)) \
+            # type: CountMinSketch[T]
+        self.window = OrderedDict()  # type: tp.Dict[T, bool]
+        self.probation = OrderedDict()  # type: tp.Dict[T, bool]
+        self.protected = OrderedDict()  # type: tp.Dict[T, bool]
+
+    def __contains__(self, item: T) -> bool:
+        return item in self.window or item in self.probation or item in self.protected
+
+    def __len__(self) -> int:
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+    def mark_as_used(self, item: T) -> None:
+        """
+        Record an access to item, whether it's present or not
+        """
+        self.sketch.increment(item)
+        if item in self.window:
+            self.window.move_to_end(item)
+        elif item in self.probation:
+            del self.probation[item]
+            self.protected[item] = True
+            if len(self.protected) > self.protected_size:
+                demoted, _ = self.protected.popitem(last=False)
+                self.probation[demoted] = True
+        elif item in self.protected:
+            self.protected.move_to_end(item)
+
+    def add(self, item: T) -> tp.List[T]:
+        """
+        Add an object that's not present.
+
+        :return: objects that have to be evicted, which might include item
+        """
+        self.window[item] = True
+        if len(self.window) <= self.window_size:
+            return []
+
+        candidate, _ = self.window.popitem(last=False)
+        if len(self.probation) + len(self.protected) < self.main_size:
+            self.probation[candidate] = True
+            return []
+        if not self.main_size:
+            return [candidate]
+
+        segment = self.probation if self.probation else self.protected
+        victim = next(iter(segment))
+        if self.sketch.estimate(candidate) > self.sketch.estimate(victim):
+            del segment[victim]
+            self.probation[candidate] = True
+            return [victim]
+        return [candidate]
+
+    def remove(self, item: T) -> None:
+        """
+        Remove an object, if it's present
+        """
+        for segment in (self.window, self.probation, self.protected):
+            if segment.pop(item, None) is not None:
+                return
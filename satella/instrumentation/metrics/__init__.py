@@ -15,7 +15,10 @@ __all__ = ['getMetric', 'MetricLevel', 'MetricDataCollection',
            'AggregateMetric', 'LabeledMetric']
 
 metrics = {}
-metrics_lock = threading.Lock()
+# reentrant, since metrics may obtain other metrics in their constructors
+metrics_lock = threading.RLock()
+# (name, type) -> metric, for already registered metrics. Read without taking metrics_lock.
+metrics_by_type = {}  # type: tp.Dict[tp.Tuple[str, str], Metric]
 
 
 def adjust_metric_level_for_root(metric_level: tp.Optional[MetricLevel],
@@ -72,6 +75,15 @@ def getMetric(metric_name: str = '',
     :raise MetricAlreadyExists: a metric having this name already exists, but with a different type
     :raise ValueError: metric name contains a forbidden character
     """
+    try:
+        metric = metrics_by_type[metric_name, metric_type]
+    except KeyError:
+        pass
+    else:
+        if metric_level is not None:
+            metric.level = metric_level
+        return metric
+
     for character in metric_name.upper():
         if character not in ALLOWED_CHARACTERS:
             raise ValueError('Metric name contains a forbidden character %s' % (character,))
@@ -98,4 +110,5 @@ def getMetric(metric_name: str = '',
         if metric_level is not None:
             metric.level = metric_level
 
+        metrics_by_type[metric_name, metric_type] = metric
         return metric
@@ -4,6 +4,50 @@ from satella.coding.structures import frozendict
 from satella.json import JSONAble
 
 
+class _InternedLabels(frozendict):
+    """
+    A frozendict of labels that computes it's hash only once
+    """
+    __slots__ = ('hash',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hash = frozendict.__hash__(self)
+
+    def __hash__(self):
+        return self.hash
+
+
+_EMPTY_LABELS = _InternedLabels()
+MAX_INTERNED_LABELS = 65536
+_interned_labels = {}  # type: tp.Dict[tuple, _InternedLabels]
+
+
+def intern_labels(labels: tp.Optional[dict]) -> frozendict:
+    """
+    Return a frozendict of given labels, with a cached hash.
+
+    Equal label sets are shared between all MetricData that use them. At most
+    MAX_INTERNED_LABELS label sets are remembered, after that the table is cleared.
+
+    :param labels: labels to intern, or None for no labels
+    """
+    if not labels:
+        return _EMPTY_LABELS
+    if type(labels) is _InternedLabels:
+        return labels
+    # types are a part of the key, since 1 == 1.0 == True, but they render differently
+    key = tuple(labels.items()), tuple(map(type, labels.values()))
+    try:
+        return _interned_labels[key]
+    except KeyError:
+        if len(_interned_labels) >= MAX_INTERNED_LABELS:
+            _interned_labels.clear()
+        return _interned_labels.setdefault(key, _InternedLabels(labels))
+    except TypeError:  # unhashable label values
+        return frozendict(labels)
+
+
 def join_metric_data_name(prefix: str, name: str):
     if prefix == '':
         return name
@@ -20,13 +64,11 @@ class MetricData(JSONAble):
         self.name = name  # type: str
         self.internal = internal  # type: bool
         self.value = value  # type: tp.Any
-        self.labels = frozendict(labels) if labels is not None else frozendict()
+        self.labels = intern_labels(labels)  # type: frozendict
         self.timestamp = timestamp  # type: tp.Optional[float]
 
     def add_labels(self, labels: dict) -> None:
-        labels_current = dict(self.labels)
-        labels_current.update(labels)
-        self.labels = frozendict(labels_current)
+        self.labels = intern_labels({**self.labels, **labels})
 
     def __eq__(self, other: 'MetricData') -> bool:
         return self.labels == other.labels and self.name == other.name
@@ -70,7 +112,9 @@ class MetricData(JSONAble):
 
 class MetricDataCollection(JSONAble):
     """
-    A bunch of metric datas
+    A bunch of metric datas.
+
+    Note that adding another collection to this one will modify this collection in place.
     """
     __slots__ = ('values',)
 
@@ -129,43 +173,44 @@ class MetricDataCollection(JSONAble):
 
     def prefix_with(self, prefix: str) -> 'MetricDataCollection':
         """Prefix every child with given prefix and return self"""
+        if not prefix:
+            return self
+        # names take part in the hash, so the set needs to be rebuilt
+        values = set()
         for child in self.values:
             child.prefix_with(prefix)
+            values.add(child)
+        self.values = values
+        return self
 
     def postfix_with(self, postfix: str) -> 'MetricDataCollection':
         """Postfix every child with given postfix and return self"""
+        values = set()
         for child in self.values:
             child.postfix_with(postfix)
+            values.add(child)
+        self.values = values
         return self
 
     def __add_metric_data(self, other: MetricData):
         values = self.values.copy()
-        if other in values:
-            values.remove(other)
+        values.discard(other)
         values.add(other)
         return MetricDataCollection(values)
 
     def __add_metric_data_collection(self, other: 'MetricDataCollection') -> 'MetricDataCollection':
-        b = other.values.copy()
-
-        for c in self.values:
-            if c not in b:
-                b.add(c)
-
-        return MetricDataCollection(b)
+        # a union keeps the elements of the left operand, so other's values take precedence
+        return MetricDataCollection(other.values | self.values)
 
     def __iadd_metric_data_collection(self, other: 'MetricDataCollection') -> \
             'MetricDataCollection':
-        other_values = other.values.copy()
-        for elem in self.values:
-            if elem not in other_values:
-                other_values.add(elem)
-        self.values = other_values
+        if other.values is not self.values:
+            self.values -= other.values
+            self.values |= other.values
         return self
 
     def __iadd_metric_data(self, other: 'MetricData') -> 'MetricDataCollection':
-        if other in self.values:
-            self.values.remove(other)
+        self.values.discard(other)
         self.values.add(other)
         return self
 
@@ -1,3 +1,7 @@
-from .prometheus import metric_data_collection_to_prometheus, PrometheusHTTPExporterThread
+from .prometheus import metric_data_collection_to_prometheus, PrometheusHTTPExporterThread, \
+    PrometheusRenderCache
+from .push import PushExporterThread, metric_data_to_statsd, metric_data_to_graphite
 
-__all__ = ['metric_data_collection_to_prometheus', 'PrometheusHTTPExporterThread']
+__all__ = ['metric_data_collection_to_prometheus', 'PrometheusHTTPExporterThread',
+           'PrometheusRenderCache', 'PushExporterThread', 'metric_data_to_statsd',
+           'metric_data_to_graphite']
@@ -1,12 +1,42 @@
+import gzip
 import http.server
 import io
+import math
+import threading
 import typing as tp
+import urllib.parse
 
 from satella.coding.concurrent import TerminableThread
+from satella.instrumentation import metrics
 from .. import getMetric
 from ..data import MetricData, MetricDataCollection
 
-__all__ = ['metric_data_collection_to_prometheus', 'PrometheusHTTPExporterThread']
+__all__ = ['metric_data_collection_to_prometheus', 'PrometheusHTTPExporterThread',
+           'PrometheusRenderCache']
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def _accepts_token(header: tp.Optional[str], token: str) -> bool:
+    """
+    Does given Accept or Accept-Encoding header allow given token with a non-zero q?
+    """
+    if not header:
+        return False
+    for entry in header.split(','):
+        value, *params = entry.strip().split(';')
+        if value.strip().lower() != token:
+            continue
+        for param in params:
+            key, _, q_value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    return float(q_value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
 
 
 class PrometheusHandler(http.server.BaseHTTPRequestHandler):
@@ -14,17 +44,33 @@ class PrometheusHandler(http.server.BaseHTTPRequestHandler):
 
     def do_GET(self):
         """only GETs are supported"""
-        if self.path != '/metrics':
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/metrics':
             self.send_error(404, 'Unknown path. Only /metrics is supported.')
             return
 
-        metric_data = self.server.get_metric_data()
-        metric_data.add_labels(self.server.extra_labels)
-        metric_data = metric_data_collection_to_prometheus(metric_data)
+        prefix = urllib.parse.parse_qs(url.query).get('prefix', [''])[0]
+        if prefix:
+            metric_data = self.server.get_metric_data_for_prefix(prefix)
+            if metric_data is None:
+                self.send_error(404, 'Metric %s not found' % (prefix,))
+                return
+        else:
+            metric_data = self.server.get_metric_data()
+
+        openmetrics = _accepts_token(self.headers.get('Accept'), 'application/openmetrics-text')
+        metric_data = self.server.get_render_cache(prefix, openmetrics).render(metric_data)
+        metric_data = metric_data.encode('utf8')
         self.send_response(200)
-        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Type',
+                         OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        if _accepts_token(self.headers.get('Accept-Encoding'), 'gzip'):
+            metric_data = gzip.compress(metric_data)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        self.send_header('Content-Length', str(len(metric_data)))
         self.end_headers()
-        self.wfile.write(metric_data.encode('utf8'))
+        self.wfile.write(metric_data)
         self.server.metric.runtime()
 
 
@@ -37,29 +83,52 @@ class PrometheusHTTPExporterThread(TerminableThread):
     which is a cps with time_unit_vectors=[1, 20, 60] counting the amount of exports in given time
     period.
 
+    Metrics are served at /metrics. Responses are gzipped if the client accepts it, and rendered in
+    the OpenMetrics format if the client asks for application/openmetrics-text. Passing a query
+    parameter of prefix, eg. /metrics?prefix=a.b will export only the subtree of metric a.b,
+    without collecting the rest of the tree.
+
     :param interface: a interface to bind to
     :param port: a port to bind to
     :param extra_labels: extra labels to add to each metric data point, such as the name of the
         service or the hostname
     :param enable_metric: whether to enable the metric
+    :param threaded: whether to serve each request in a separate thread, so that concurrent
+        scrapers don't queue up behind each other
     """
 
     def __init__(self, interface: str, port: int, extra_labels: tp.Optional[dict] = None,
-                 enable_metric: bool = False):
+                 enable_metric: bool = False, threaded: bool = False):
         super().__init__(daemon=True)
         self.interface = interface  # type: str
         self.port = port  # type: int
 
         self_2 = self
 
-        class HTTPServer(http.server.HTTPServer):
+        server_class = http.server.ThreadingHTTPServer if threaded else http.server.HTTPServer
+
+        class HTTPServer(server_class):
             def __init__(self):
                 super().__init__((self_2.interface, self_2.port), PrometheusHandler,
                                  bind_and_activate=False)
+                self.render_caches = {}  # type: tp.Dict[tp.Tuple[str, bool], PrometheusRenderCache]
+                self.render_caches_lock = threading.Lock()
 
             def get_metric_data(self):
                 return self_2.get_metric_data()
 
+            def get_metric_data_for_prefix(self, prefix: str):
+                return self_2.get_metric_data_for_prefix(prefix)
+
+            def get_render_cache(self, prefix: str, openmetrics: bool) -> 'PrometheusRenderCache':
+                with self.render_caches_lock:
+                    try:
+                        return self.render_caches[prefix, openmetrics]
+                    except KeyError:
+                        cache = PrometheusRenderCache(self.extra_labels, openmetrics=openmetrics)
+                        self.render_caches[prefix, openmetrics] = cache
+                        return cache
+
         self.httpd = HTTPServer()
         self.httpd.extra_labels = extra_labels or {}
         self.httpd.metric = getMetric('prometheus.exports_per_time',
@@ -80,6 +149,31 @@ class PrometheusHTTPExporterThread(TerminableThread):
         """
         return getMetric().to_metric_data()
 
+    def get_metric_data_for_prefix(self, prefix: str) -> tp.Optional[MetricDataCollection]:
+        """
+        Obtain metric data only for the metric of given name and it's children, or None if
+        such a metric does not exist.
+
+        Only the subtree of this metric is collected. If this metric wouldn't be exported by it's
+        ancestors, due to it's level, an empty collection is returned. Overload to provide
+        custom source of metric data.
+
+        :param prefix: fully qualified name of the metric
+        """
+        metric = metrics.metrics.get(prefix)
+        if metric is None:
+            return None
+        child = metric
+        while child.root_metric is not None:
+            if child.level > child.root_metric.level:
+                return MetricDataCollection()
+            child = child.root_metric
+        mdc = metric.to_metric_data()
+        parent_name = prefix.rpartition('.')[0]
+        if parent_name:
+            mdc.prefix_with(parent_name)
+        return mdc
+
     def terminate(self, force: bool = False) -> 'PrometheusHTTPExporterThread':
         """
         Order this thread to terminate and return self.
@@ -92,6 +186,37 @@ class PrometheusHTTPExporterThread(TerminableThread):
         return super().terminate(force=force)
 
 
+def _render_value(value) -> str:
+    """Render a number, spelling out infinities and NaNs the way Prometheus does"""
+    if type(value) is float and not math.isfinite(value):
+        if math.isnan(value):
+            return 'NaN'
+        return '+Inf' if value > 0 else '-Inf'
+    return str(value)
+
+
+def _escape_label_value(value) -> str:
+    return _render_value(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _render_prefix(name: str, labels: dict) -> str:
+    """Render the part of the line preceding the value"""
+    name = name.replace('.', '_')
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (key, _escape_label_value(value))
+                                      for key, value in labels.items()))
+
+
+def _render_line(prefix: str, md: MetricData, openmetrics: bool = False) -> str:
+    value = _render_value(md.value)
+    if md.timestamp is not None:
+        if openmetrics:
+            return '%s %s %s\n' % (prefix, value, md.timestamp)
+        return '%s %s %s\n' % (prefix, value, int(md.timestamp * 1000))
+    return '%s %s\n' % (prefix, value)
+
+
 class RendererObject(io.StringIO):
 
     def render(self, md: MetricData):
@@ -99,17 +224,81 @@ class RendererObject(io.StringIO):
         if md.internal:  # Don't output internal metrics
             return
 
-        self.write(md.name.replace('.', '_'))
-        if md.labels:
-            self.write('{')
-            self.write(','.join('%s="%s"' % (
-                key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for
-                                key, value in md.labels.items()))
-            self.write('}')
-        self.write(' %s' % (md.value,))
-        if md.timestamp is not None:
-            self.write(' %s' % (int(md.timestamp * 1000),))
-        self.write('\n')
+        self.write(_render_line(_render_prefix(md.name, md.labels), md))
+
+
+class PrometheusRenderCache:
+    """
+    A renderer of MetricDataCollections into Prometheus' format that remembers what it rendered.
+
+    Escaped name-and-labels prefixes are computed once per series, and a series' line is
+    serialized anew only if it's value or timestamp changed since the previous render.
+    Series that disappear from the collection are forgotten.
+
+    Values marked as internal will be skipped.
+
+    This is safe to use from multiple threads.
+
+    :param extra_labels: extra labels to add to each series. These take precedence over
+        the series' own labels.
+    :param openmetrics: whether to render in the OpenMetrics format instead. Series will then be
+        grouped into families of type unknown, timestamps will be in seconds, and the output
+        will be terminated with an EOF marker.
+    """
+    __slots__ = ('extra_labels', 'openmetrics', 'series', 'lock')
+
+    def __init__(self, extra_labels: tp.Optional[dict] = None, openmetrics: bool = False):
+        self.extra_labels = extra_labels or {}
+        self.openmetrics = openmetrics
+        self.lock = threading.Lock()
+        # (name, labels) -> (value type, value, timestamp, prefix, rendered line)
+        self.series = {}  # type: tp.Dict[tp.Tuple[str, tp.Any], tuple]
+
+    def render(self, mdc: MetricDataCollection) -> str:
+        """
+        Render given MetricDataCollection
+
+        :param mdc: collection to render
+        :return: a string output to present to Prometheus
+        """
+        with self.lock:
+            return self._render(mdc)
+
+    def _render(self, mdc: MetricDataCollection) -> str:
+        old_series = self.series
+        new_series = {}
+        output = []
+        families = {}  # type: tp.Dict[str, tp.List[str]]
+        for md in mdc.values:
+            if md.internal:
+                continue
+            key = md.name, md.labels
+            try:
+                value_type, value, timestamp, prefix, line = old_series[key]
+            except KeyError:
+                if self.extra_labels:
+                    prefix = _render_prefix(md.name, {**md.labels, **self.extra_labels})
+                else:
+                    prefix = _render_prefix(md.name, md.labels)
+                line = _render_line(prefix, md, self.openmetrics)
+            else:
+                if value_type is not type(md.value) or value != md.value or \
+                        timestamp != md.timestamp:
+                    line = _render_line(prefix, md, self.openmetrics)
+            new_series[key] = type(md.value), md.value, md.timestamp, prefix, line
+            if self.openmetrics:
+                families.setdefault(md.name, []).append(line)
+            else:
+                output.append(line)
+        self.series = new_series
+        if self.openmetrics:
+            for name, lines in families.items():
+                output.append('# TYPE %s unknown\n' % (name.replace('.', '_'),))
+                output.extend(lines)
+            output.append('# EOF\n')
+        elif not output:
+            return '\n'
+        return ''.join(output)
 
 
 def metric_data_collection_to_prometheus(mdc: MetricDataCollection) -> str:
@@ -0,0 +1,219 @@
+import collections
+import logging
+import numbers
+import socket
+import time
+import typing as tp
+
+from satella.coding.concurrent import IntervalTerminableThread
+from .. import getMetric
+from ..data import MetricData, MetricDataCollection
+
+__all__ = ['PushExporterThread', 'metric_data_to_statsd', 'metric_data_to_graphite',
+           'pack_lines']
+
+logger = logging.getLogger(__name__)
+
+# characters that would break a line, replaced with underscores in label keys and values
+_STATSD_TRANSLATION = str.maketrans({character: '_' for character in ':,|#\r\n'})
+_GRAPHITE_TRANSLATION = str.maketrans({character: '_' for character in ';= \t\r\n'})
+
+
+def metric_data_to_statsd(md: MetricData, extra_labels: tp.Optional[dict] = None) -> str:
+    """
+    Render a MetricData as a StatsD gauge. Labels will be rendered as DogStatsD-style tags.
+
+    Characters that are special to the protocol (``:,|#`` and newlines) are replaced with
+    underscores in label keys and values.
+
+    :param md: metric data to render
+    :param extra_labels: extra labels to add. These take precedence over md's labels.
+    :return: a single line, without a trailing newline
+    """
+    labels = {**md.labels, **extra_labels} if extra_labels else md.labels
+    line = '%s:%s|g' % (md.name, md.value)
+    if labels:
+        line += '|#' + ','.join('%s:%s' % (str(key).translate(_STATSD_TRANSLATION),
+                                           str(value).translate(_STATSD_TRANSLATION))
+                                for key, value in labels.items())
+    return line
+
+
+def metric_data_to_graphite(md: MetricData, extra_labels: tp.Optional[dict] = None,
+                            timestamp: tp.Optional[float] = None) -> str:
+    """
+    Render a MetricData in Graphite's plaintext protocol. Labels will be rendered as Graphite tags.
+
+    Characters that are special to the protocol (``;=``, spaces, tabs and newlines) are replaced
+    with underscores in label keys and values.
+
+    :param md: metric data to render
+    :param extra_labels: extra labels to add. These take precedence over md's labels.
+    :param timestamp: timestamp to use if md doesn't have any. Defaults to current time.
+    :return: a single line, without a trailing newline
+    """
+    labels = {**md.labels, **extra_labels} if extra_labels else md.labels
+    name = md.name
+    if labels:
+        name += ';' + ';'.join('%s=%s' % (str(key).translate(_GRAPHITE_TRANSLATION),
+                                          str(value).translate(_GRAPHITE_TRANSLATION))
+                               for key, value in labels.items())
+    if md.timestamp is not None:
+        timestamp = md.timestamp
+    elif timestamp is None:
+        timestamp = time.time()
+    return '%s %s %s' % (name, md.value, int(timestamp))
+
+
+def pack_lines(lines: tp.Iterable[bytes], max_size: int) -> tp.Iterator[bytes]:
+    """
+    Join lines with newlines into packets of at most max_size bytes.
+
+    A line longer than max_size will be put into a packet of it's own.
+
+    :param lines: lines to pack, without trailing newlines
+    :param max_size: maximum size of a packet in bytes
+    :return: an iterator of packets
+    """
+    packet = []
+    packet_size = 0
+    for line in lines:
+        if packet and packet_size + 1 + len(line) > max_size:
+            yield b'\n'.join(packet)
+            packet = []
+            packet_size = 0
+        if packet:
+            packet_size += 1
+        packet.append(line)
+        packet_size += len(line)
+    if packet:
+        yield b'\n'.join(packet)
+
+
+class PushExporterThread(IntervalTerminableThread):
+    """
+    A daemon thread that periodically takes a snapshot of metric data and pushes it to a StatsD
+    or a Graphite server. Use it for processes that are too short-lived to be scraped.
+
+    Over UDP, lines are packed into datagrams of at most max_packet_size bytes. Over TCP, a single
+    persistent connection is used, and reestablished on the next flush if it breaks. Lines that
+    could not be sent are kept for the next flush, but at most max_pending_lines of them, after
+    that the oldest ones are dropped and counted in lines_dropped. Note that if sending fails
+    midway, some lines might be sent twice.
+
+    Values are sent as StatsD gauges, since every flush sends the current state of each metric.
+    Non-numeric values and internal metrics are skipped.
+
+    A final flush is made when this thread terminates.
+
+    :param host: host to send the data to
+    :param port: port to send the data to
+    :param protocol: either 'statsd' or 'graphite'
+    :param transport: either 'udp' or 'tcp'
+    :param interval: time between flushes, in seconds, or a time string
+    :param extra_labels: extra labels to add to each metric data point, such as the name of the
+        service or the hostname
+    :param max_packet_size: maximum size of a single UDP datagram
+    :param max_pending_lines: maximum amount of lines to keep if they could not be sent
+    :param send_timeout: timeout for TCP operations, in seconds
+    """
+
+    def __init__(self, host: str, port: int, protocol: str = 'statsd',
+                 transport: str = 'udp', interval: tp.Union[str, float] = 10,
+                 extra_labels: tp.Optional[dict] = None,
+                 max_packet_size: int = 1432,
+                 max_pending_lines: int = 100000,
+                 send_timeout: float = 5):
+        super().__init__(interval, daemon=True)
+        if protocol not in ('statsd', 'graphite'):
+            raise ValueError('Unknown protocol %s' % (protocol,))
+        if transport not in ('udp', 'tcp'):
+            raise ValueError('Unknown transport %s' % (transport,))
+        self.address = host, port  # type: tp.Tuple[str, int]
+        self.protocol = protocol  # type: str
+        self.transport = transport  # type: str
+        self.extra_labels = extra_labels or {}  # type: dict
+        self.max_packet_size = max_packet_size  # type: int
+        self.send_timeout = send_timeout  # type: float
+        self.pending = collections.deque(maxlen=max_pending_lines)  # type: tp.Deque[bytes]
+        self.lines_dropped = 0  # type: int
+        self.socket = None  # type: tp.Optional[socket.socket]
+
+    def get_metric_data(self) -> MetricDataCollection:
+        """
+        Obtain metric data.
+
+        Overload to provide custom source of metric data.
+        """
+        return getMetric().to_metric_data()
+
+    def render(self, mdc: MetricDataCollection) -> tp.List[bytes]:
+        """
+        Render metric data into lines of the chosen protocol
+        """
+        lines = []
+        now = time.time()
+        for md in mdc.values:
+            if md.internal or isinstance(md.value, bool) or \
+                    not isinstance(md.value, numbers.Real):
+                continue
+            if self.protocol == 'statsd':
+                line = metric_data_to_statsd(md, self.extra_labels)
+            else:
+                line = metric_data_to_graphite(md, self.extra_labels, now)
+            lines.append(line.encode('utf8'))
+        return lines
+
+    def _connect(self) -> socket.socket:
+        if self.socket is None:
+            if self.transport == 'udp':
+                family, type_, proto, _, address = socket.getaddrinfo(
+                    *self.address, type=socket.SOCK_DGRAM)[0]
+                sock = socket.socket(family, type_, proto)
+                try:
+                    sock.connect(address)
+                except OSError:
+                    sock.close()
+                    raise
+                self.socket = sock
+            else:
+                self.socket = socket.create_connection(self.address, timeout=self.send_timeout)
+        return self.socket
+
+    def _close(self) -> None:
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def flush(self) -> None:
+        """
+        Take a snapshot of metric data and send it, along with any lines pending from previous
+        flushes
+        """
+        for line in self.render(self.get_metric_data()):
+            if len(self.pending) == self.pending.maxlen:
+                self.lines_dropped += 1
+            self.pending.append(line)
+
+        if not self.pending:
+            return
+
+        try:
+            sock = self._connect()
+            if self.transport == 'udp':
+                for packet in pack_lines(self.pending, self.max_packet_size):
+                    sock.send(packet)
+            else:
+                sock.sendall(b'\n'.join(self.pending) + b'\n')
+        except OSError as e:
+            logger.warning('Failed to push metrics to %s: %s', self.address, e)
+            self._close()
+        else:
+            self.pending.clear()
+
+    def loop(self) -> None:
+        self.flush()
+
+    def cleanup(self) -> None:
+        self.flush()
+        self._close()
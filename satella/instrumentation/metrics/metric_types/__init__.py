@@ -4,8 +4,11 @@ from .callable import CallableMetric
 from .counter import CounterMetric
 from .cps import ClicksPerTimeUnitMetric
 from .empty import EmptyMetric
+from .ewma import EWMAMetric
 from .histogram import HistogramMetric
 from .linkfail import LinkfailMetric
+from .multiprocess import MultiprocessMetric, MultiprocessCounterMetric, \
+    MultiprocessHistogramMetric, MultiprocessSummaryMetric
 from .registry import register_metric, METRIC_NAMES_TO_CLASSES
 from .simple import IntegerMetric, FloatMetric
 from .summary import QuantileMetric, SummaryMetric
@@ -15,5 +18,6 @@ __all__ = ['Metric', 'LeafMetric', 'EmbeddedSubmetrics', 'ClicksPerTimeUnitMetri
            'IntegerMetric', 'FloatMetric',
            'QuantileMetric', 'register_metric', 'METRIC_NAMES_TO_CLASSES', 'SummaryMetric',
            'HistogramMetric', 'EmptyMetric', 'LinkfailMetric', 'CallableMetric', 'MetricLevel',
-           'UptimeMetric', 'CounterMetric',
+           'UptimeMetric', 'CounterMetric', 'EWMAMetric', 'MultiprocessMetric', 'MultiprocessCounterMetric',
+           'MultiprocessHistogramMetric', 'MultiprocessSummaryMetric',
            'INHERIT', 'DEBUG', 'RUNTIME', 'DISABLED']
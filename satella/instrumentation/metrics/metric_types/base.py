@@ -1,3 +1,4 @@
+import collections
 import enum
 import time
 import typing as tp
@@ -32,8 +33,8 @@ class Metric:
     :param enable_timestamp: append timestamp of last update to the metric
     :param internal: if True, this metric won't be visible in exporters
     """
-    __slots__ = ('name', 'root_metric', 'internal', '_level', 'enable_timestamp',
-                 'last_updated', 'children')
+    __slots__ = ('name', 'root_metric', 'internal', '_level', '_effective_level',
+                 'enable_timestamp', 'last_updated', 'children')
 
     CLASS_NAME = 'base'
 
@@ -52,16 +53,24 @@ class Metric:
         Also, if called on root metric, sets the runlevel to RUNTIME
         """
         from satella.instrumentation import metrics
+        from .callable import forget_timed_metrics
         if self.name == '':
             with metrics.metrics_lock:
                 metrics.metrics = {}
+                metrics.metrics_by_type = {}
                 metrics.level = MetricLevel.RUNTIME
+                forget_timed_metrics('')
         else:
             with metrics.metrics_lock:
+                name = self.get_fully_qualified_name()
+                forget_timed_metrics(name)
                 metrics.metrics = {k: v for k, v in metrics.metrics.items() if
-                                   not k.startswith(self.get_fully_qualified_name() + '.')}
-                del metrics.metrics[self.get_fully_qualified_name()]
+                                   not k.startswith(name + '.')}
+                del metrics.metrics[name]
+                metrics.metrics_by_type = {k: v for k, v in metrics.metrics_by_type.items()
+                                           if k[0] != name and not k[0].startswith(name + '.')}
         self.children = []
+        self._update_effective_level()
 
     def __init__(self, name, root_metric: 'Metric' = None,
                  metric_level: tp.Optional[tp.Union[MetricLevel, int]] = None,
@@ -77,6 +86,7 @@ class Metric:
             else:
                 metric_level = MetricLevel.INHERIT
         self._level = MetricLevel(metric_level)  # type: MetricLevel
+        self._effective_level = self._compute_effective_level()  # type: int
         self.enable_timestamp = kwargs.get('enable_timestamp', False)
         self.last_updated = time.time() if self.enable_timestamp else None \
             # type: tp.Optional[float]
@@ -93,12 +103,27 @@ class Metric:
     def __str__(self) -> str:
         return self.name
 
+    def _compute_effective_level(self) -> int:
+        if self._level != MetricLevel.INHERIT or self.root_metric is None:
+            return int(self._level)
+        return self.root_metric._effective_level
+
+    def _update_effective_level(self) -> None:
+        """
+        Recompute the cached effective level of this metric and all of it's descendants
+        """
+        self._effective_level = self._compute_effective_level()
+        for child in self.children:
+            child._update_effective_level()
+
     @property
     def level(self) -> MetricLevel:
-        metric = self
-        while metric._level == MetricLevel.INHERIT:
-            metric = metric.root_metric
-        return metric._level
+        """
+        Effective level of this metric, ie. with INHERIT resolved.
+
+        This is cached, and recomputed for the entire subtree only when some level is set.
+        """
+        return MetricLevel(self._effective_level)
 
     @level.setter
     @for_argument(None, MetricLevel)
@@ -107,12 +132,13 @@ class Metric:
                 value == MetricLevel.INHERIT and self.name == ''), \
             'Cannot set INHERIT for the root metric!'
         self._level = value
+        self._update_effective_level()
 
     def append_child(self, metric: 'Metric'):
         self.children.append(metric)
 
-    def can_process_this_level(self, target_level: MetricLevel) -> bool:
-        return self.level >= target_level
+    def can_process_this_level(self, target_level: tp.Union[int, MetricLevel]) -> bool:
+        return self._effective_level >= target_level
 
     def to_metric_data(self) -> MetricDataCollection:
         output = MetricDataCollection()
@@ -134,9 +160,8 @@ class Metric:
         """
         raise TypeError('This is a container metric!')
 
-    @for_argument(None, MetricLevel)
     def handle(self, level: tp.Union[int, MetricLevel], *args, **kwargs) -> None:
-        if self.can_process_this_level(level):
+        if self._effective_level >= level:
             if self.enable_timestamp:
                 self.last_updated = time.time()
             self._handle(*args, **kwargs)
@@ -184,8 +209,17 @@ class EmbeddedSubmetrics(LeafMetric):
     All please pass all the arguments received from child class into this constructor, as this
     constructor actually stores them!
     Refer to :py:class:`.cps.ClicksPerTimeUnitMetric` on how to do that.
+
+    To bound the amount of children, pass max_children as a keyword argument. If a new set of
+    labels arrives when there are already max_children children, the least recently updated child
+    will be evicted. It's data will be added to an overflow child, with the same label names
+    but all values equal to ``__overflow__``. Overflow children do not count towards max_children.
+    The amount of evictions will be reported as a metric named ``<name>.evictions``. Only metrics
+    that can add up data of their children, ie. implement :meth:`absorb`, support max_children,
+    and it must be at least 1.
     """
-    __slots__ = ('args', 'kwargs', 'embedded_submetrics_enabled', 'children_mapping')
+    __slots__ = ('args', 'kwargs', 'embedded_submetrics_enabled', 'children_mapping',
+                 'max_children', 'evictions', 'overflow_children')
 
     def __init__(self, name, root_metric: 'Metric' = None, metric_level: str = None,
                  labels: tp.Optional[dict] = None, internal: bool = False, *args, **kwargs):
@@ -193,35 +227,85 @@ class EmbeddedSubmetrics(LeafMetric):
         self.args = args  # type: tp.List
         self.kwargs = kwargs  # type: tp.Dict
         self.embedded_submetrics_enabled = False  # type: bool
-        self.children_mapping = {}  # type: tp.Dict[tp.Any, Metric]
+        self.children_mapping = collections.OrderedDict()  # type: tp.Dict[tp.Any, Metric]
+        self.max_children = kwargs.get('max_children')  # type: tp.Optional[int]
+        if self.max_children is not None and self.max_children < 1:
+            raise ValueError('max_children must be at least 1, not %s' % (self.max_children,))
+        if self.max_children is not None and type(self).absorb is EmbeddedSubmetrics.absorb:
+            raise ValueError('%s metrics do not support max_children, since they cannot keep '
+                             'data of evicted children' % (self.CLASS_NAME,))
+        self.evictions = 0  # type: int
+        self.overflow_children = {}  # type: tp.Dict[tp.Any, Metric]
         self.last_updated = time.time()  # type: float
 
     def _handle(self, *args, **labels):
         if self.enable_timestamp:
             self.last_updated = time.time()
 
-        key = tuple(sorted(labels.items()))
-        if key:
+        if labels:
             self.embedded_submetrics_enabled = True
         else:
             return
 
-        if key in self.children_mapping:
-            # noinspection PyProtectedMember
-            self.children_mapping[key]._handle(*args)
-        else:
+        # noinspection PyProtectedMember
+        self.get_child(labels)._handle(*args)
+
+    def get_child(self, labels: dict) -> 'LeafMetric':
+        """
+        Return a child metric for given set of labels, creating it if it does not exist yet
+        """
+        key = tuple(sorted(labels.items()))
+        try:
+            child = self.children_mapping[key]
+        except KeyError:
+            if self.max_children is not None:
+                while len(self.children_mapping) >= self.max_children:
+                    self.evict_child()
             clone = self.clone(labels)
             self.children_mapping[key] = clone
             self.children.append(clone)
-            # noinspection PyProtectedMember
-            self.children_mapping[key]._handle(*args)
+            return clone
+        if self.max_children is not None:
+            try:
+                self.children_mapping.move_to_end(key)
+            except KeyError:    # evicted by another thread in the meantime
+                pass
+        return child
+
+    def evict_child(self) -> None:
+        """
+        Evict the least recently updated child, adding it's data to the overflow child
+        """
+        try:
+            key, child = self.children_mapping.popitem(last=False)
+        except KeyError:    # emptied by another thread in the meantime
+            return
+        self.children.remove(child)
+        self.evictions += 1
+        overflow_key = tuple((label, '__overflow__') for label, _ in key)
+        try:
+            overflow = self.overflow_children[overflow_key]
+        except KeyError:
+            overflow = self.overflow_children[overflow_key] = self.clone(dict(overflow_key))
+            self.children.append(overflow)
+        overflow.absorb(child)
+
+    def absorb(self, child: 'LeafMetric') -> None:
+        """
+        Add data of child, an evicted child of the same type, to this metric.
+
+        Override to support max_children.
+        """
 
     def to_metric_data(self) -> MetricDataCollection:
         if self.embedded_submetrics_enabled:
             v = MetricDataCollection()
             for child in self.children:
                 if child.level <= self.level:
-                    v = v + child.to_metric_data()
+                    v += child.to_metric_data()
+            if self.max_children is not None:
+                v += MetricData(self.name + '.evictions', self.evictions, self.labels,
+                                self.get_timestamp(), self.internal)
             return v
         else:
             return super().to_metric_data()
@@ -240,6 +324,7 @@ class EmbeddedSubmetrics(LeafMetric):
         """
 
         return self.__class__(self.name, self, MetricLevel.INHERIT, *self.args, labels=labels,
+                              internal=self.internal,
                               **self.kwargs)
 
 
@@ -1,32 +1,140 @@
+import concurrent.futures
 import copy
+import logging
+import threading
 import time
 import typing as tp
+import weakref
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 
 from .base import LeafMetric, MetricLevel
 from .registry import register_metric
 from ..data import MetricDataCollection, MetricData
 
+logger = logging.getLogger(__name__)
+
+SLOW_CALLABLES_METRIC_NAME = 'satella.metrics.slow_callables'
+
+_default_executor = None  # type: tp.Optional[Executor]
+_default_executor_lock = threading.Lock()
+# CallableMetrics that evaluate their callables in background
+_timed_metrics = weakref.WeakSet()  # type: tp.MutableSet[CallableMetric]
+
+
+def _get_default_executor() -> Executor:
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = ThreadPoolExecutor(max_workers=8,
+                                                   thread_name_prefix='callable-metrics')
+        return _default_executor
+
+
+def forget_timed_metrics(name: str) -> None:
+    """
+    Stop evaluating callables of metrics named name or below it, in background.
+    Called when they are reset.
+
+    :param name: fully qualified name of the metric, or an empty string for all of them
+    """
+    for metric in list(_timed_metrics):
+        metric_name = metric.get_fully_qualified_name()
+        if not name or metric_name == name or metric_name.startswith(name + '.'):
+            _timed_metrics.discard(metric)
+
+
+class _CallableState:
+    """
+    Last good value of a single callable, and it's evaluation in progress, if any
+
+    :param source: an object whose callable attribute is the callable
+    :param labels: labels to report the value with
+    """
+    __slots__ = ('source', 'labels', 'future', 'deadline', 'value', 'timestamp',
+                 'updated_at')
+
+    def __init__(self, source, labels: dict):
+        self.source = source
+        self.labels = labels
+        self.future = None  # type: tp.Optional[Future]
+        self.deadline = None  # type: tp.Optional[float]
+        self.value = None  # type: tp.Optional[float]
+        self.timestamp = None  # type: tp.Optional[float]
+        self.updated_at = None  # type: tp.Optional[float]
+
+    def is_stale(self, now: float, ttl: float) -> bool:
+        return self.future is None and (self.updated_at is None or now - self.updated_at >= ttl)
+
+    def submit(self, executor: Executor, deadline: tp.Optional[float]) -> None:
+        self.deadline = deadline
+        self.future = future = executor.submit(self.source.callable)
+        future.add_done_callback(self.on_done)
+
+    def on_done(self, future: Future) -> None:
+        if self.future is not future:     # already processed
+            return
+        try:
+            value = future.result()
+        except Exception:   # pylint: disable=broad-except
+            logger.warning('Callable of a metric failed', exc_info=True)
+        else:
+            self.value = value
+            self.timestamp = time.time()
+            self.updated_at = time.monotonic()
+        self.future = None
+
 
 @register_metric
 class CallableMetric(LeafMetric):
     """
     A metric whose value at any given point in time is the result of it's callable.
 
+    If timeout is given, callables will be evaluated concurrently on an executor. When a
+    snapshot is requested, all stale callables of all such metrics are submitted at once, and
+    they are waited for only until timeout passes since the submission, so a snapshot takes
+    at most around timeout regardless of the amount of callables. If a callable doesn't
+    complete in time, or it raises an exception, it's last good value will be served instead,
+    and timeouts will be counted by an internal counter metric called
+    satella.metrics.slow_callables, labelled with the name of the metric.
+
     :param value_getter: a callable() that returns a float - the current value of this metric.
         It should be easy and cheap to compute, as this callable will be called each time
         a snapshot of metric state is requested
+    :param timeout: time in seconds to wait for the callables. None means that callables will
+        be called synchronously, unless ttl is given, in which case they will be waited for
+        without a timeout.
+    :param ttl: time in seconds for which a value will be served without calling the callable
+        again
+    :param executor: executor to evaluate the callables on. By default, a shared
+        ThreadPoolExecutor with 8 workers will be used.
     """
     CLASS_NAME = 'callable'
 
-    __slots__ = ('callable', 'labeled_metrics')
+    __slots__ = ('callable', 'labeled_metrics', 'timeout', 'ttl', 'executor', 'states',
+                 'slow_callables', '__weakref__')
 
     def __init__(self, name, root_metric: 'Metric' = None,
                  metric_level: tp.Optional[MetricLevel] = None,
                  labels: tp.Optional[dict] = None, internal: bool = False,
-                 value_getter: tp.Optional[tp.Callable[[], float]] = None, *args, **kwargs):
+                 value_getter: tp.Optional[tp.Callable[[], float]] = None,
+                 timeout: tp.Optional[float] = None,
+                 ttl: float = 0,
+                 executor: tp.Optional[Executor] = None, *args, **kwargs):
         super().__init__(name, root_metric, metric_level, labels, internal, *args, **kwargs)
         self.callable = value_getter
         self.labeled_metrics = []
+        self.timeout = timeout  # type: tp.Optional[float]
+        self.ttl = ttl  # type: float
+        self.executor = executor  # type: tp.Optional[Executor]
+        # labeled metric or None for own callable -> it's state
+        self.states = {}  # type: tp.Dict[tp.Any, _CallableState]
+        self.slow_callables = None
+        if timeout is not None or ttl:
+            from satella.instrumentation import metrics
+            # created up front, so that scrapes don't register new metrics
+            self.slow_callables = metrics.getMetric(SLOW_CALLABLES_METRIC_NAME, 'counter',
+                                                    internal=True)
+            _timed_metrics.add(self)
 
     def register_labeled_metric(self, labeled_metric):
         self.labeled_metrics.append(labeled_metric)
@@ -34,15 +142,73 @@ class CallableMetric(LeafMetric):
     def _handle(self, *args, **kwargs) -> None:
         raise TypeError('You are not supposed to call this!')
 
-    def to_metric_data(self) -> MetricDataCollection:
-        mdc = MetricDataCollection()
+    def get_states(self) -> tp.List[_CallableState]:
+        """
+        Return states of all callables of this metric, creating them if necessary
+        """
+        states = []
         for labeled_metric in self.labeled_metrics:
-            labels = copy.copy(self.labels)
-            labels.update(labeled_metric.labels)
-            mdc += MetricData(self.name, labeled_metric.callable(), labels, time.time(),
-                              self.internal)
-
+            try:
+                state = self.states[labeled_metric]
+            except KeyError:
+                labels = copy.copy(self.labels)
+                labels.update(labeled_metric.labels)
+                state = self.states[labeled_metric] = _CallableState(labeled_metric, labels)
+            states.append(state)
         if self.callable:
-            mdc += MetricData(self.name, self.callable(), self.labels, time.time(), self.internal)
+            if None not in self.states:
+                self.states[None] = _CallableState(self, self.labels)
+            states.append(self.states[None])
+        return states
+
+    def submit_stale(self, now: float) -> None:
+        """
+        Submit evaluations of this metric's callables whose values are stale
+        """
+        deadline = None if self.timeout is None else now + self.timeout
+        executor = self.executor or _get_default_executor()
+        for state in self.get_states():
+            if state.is_stale(now, self.ttl):
+                state.submit(executor, deadline)
+
+    def to_metric_data(self) -> MetricDataCollection:
+        if self.timeout is None and not self.ttl:
+            mdc = MetricDataCollection()
+            for labeled_metric in self.labeled_metrics:
+                labels = copy.copy(self.labels)
+                labels.update(labeled_metric.labels)
+                mdc += MetricData(self.name, labeled_metric.callable(), labels, time.time(),
+                                  self.internal)
+
+            if self.callable:
+                mdc += MetricData(self.name, self.callable(), self.labels, time.time(),
+                                  self.internal)
+
+            return mdc
+
+        now = time.monotonic()
+        states = self.get_states()
+        if any(state.is_stale(now, self.ttl) for state in states):
+            # start a wave of evaluations, so that the rest of the snapshot finds them running
+            for metric in list(_timed_metrics):
+                metric.submit_stale(now)
+
+        output = []
+        for state in states:
+            future = state.future
+            if future is not None:
+                timeout = None if state.deadline is None else \
+                    max(state.deadline - time.monotonic(), 0)
+                try:
+                    future.result(timeout)
+                except concurrent.futures.TimeoutError:
+                    self.slow_callables.runtime(1, metric=self.get_fully_qualified_name())
+                except Exception:   # pylint: disable=broad-except
+                    pass    # logged by on_done
+                else:
+                    state.on_done(future)
 
-        return mdc
+            if state.updated_at is not None:
+                output.append(MetricData(self.name, state.value, state.labels, state.timestamp,
+                                         self.internal))
+        return MetricDataCollection(output)
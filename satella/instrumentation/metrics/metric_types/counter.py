@@ -3,18 +3,28 @@ import typing as tp
 from .base import EmbeddedSubmetrics, MetricLevel
 from .measurable_mixin import MeasurableMixin
 from .registry import register_metric
+from .sampling import SamplingMixin, sample_rate_to_every
+from .shards import ThreadShards
 from ..data import MetricData, MetricDataCollection
 
 
 @register_metric
-class CounterMetric(EmbeddedSubmetrics, MeasurableMixin):
+class CounterMetric(SamplingMixin, EmbeddedSubmetrics, MeasurableMixin):
     """
     A counter that can be adjusted by a given value.
 
     :param sum_children: whether to sum up all calls to children
     :param count_calls: count the amount of calls to handle()
+    :param sharded: if True, each thread will update it's own shard of this counter,
+        and the shards will be summed up in to_metric_data(). This makes handle() correct
+        under concurrent access without taking a lock. Shards of threads that died are
+        merged, so short-lived threads don't accumulate them.
+    :param sample_rate: fraction of calls to handle() that will be recorded. Every N-th call,
+        where N is 1/sample_rate rounded, is recorded, and the value and the amount of calls
+        are multiplied by N in to_metric_data().
     """
-    __slots__ = ('sum_children', 'count_calls', 'calls', 'value')
+    __slots__ = ('sum_children', 'count_calls', 'calls', 'value', 'shards', 'sample_every',
+                 'sample_countdown')
 
     CLASS_NAME = 'counter'
 
@@ -22,34 +32,78 @@ class CounterMetric(EmbeddedSubmetrics, MeasurableMixin):
                  metric_level: tp.Optional[MetricLevel] = None,
                  internal: bool = False,
                  sum_children: bool = True,
-                 count_calls: bool = False, *args, **kwargs):
+                 count_calls: bool = False,
+                 sharded: bool = False,
+                 sample_rate: float = 1, *args, **kwargs):
         super().__init__(name, root_metric, metric_level, internal=internal,
-                         sum_children=sum_children, count_calls=count_calls, *args, **kwargs)
+                         sum_children=sum_children, count_calls=count_calls, sharded=sharded,
+                         sample_rate=sample_rate, *args, **kwargs)
+        self.sample_every = sample_rate_to_every(sample_rate)  # type: int
+        self.sample_countdown = self.sample_every  # type: int
         self.sum_children = sum_children  # type: bool
         self.count_calls = count_calls  # type: bool
         self.calls = 0  # type: int
         self.value = 0  # type: float
+        if sharded:
+            self.shards = ThreadShards(
+                lambda: [0, 0], lambda a, b: [a[0] + b[0], a[1] + b[1]]
+            )  # type: tp.Optional[ThreadShards]
+        else:
+            self.shards = None
+
+    def get_value_and_calls(self) -> tp.Tuple[float, int]:
+        """
+        Return current value of this counter and the amount of calls, merging the shards if
+        this counter is sharded
+        """
+        if self.shards is None:
+            return self.value, self.calls
+        value, calls = self.value, self.calls
+        for shard_value, shard_calls in self.shards:
+            value += shard_value
+            calls += shard_calls
+        return value, calls
+
+    def absorb(self, child: 'CounterMetric') -> None:
+        value, calls = child.get_value_and_calls()
+        self.value += value
+        self.calls += calls
 
     def to_metric_data(self) -> MetricDataCollection:
+        value, calls = self.get_value_and_calls()
+        if self.sample_every > 1:
+            value, calls = value * self.sample_every, calls * self.sample_every
         if self.embedded_submetrics_enabled:
             k = super().to_metric_data()
             if self.sum_children:
-                k += MetricData(self.name + '.sum', self.value, self.labels, self.get_timestamp(),
+                k += MetricData(self.name + '.sum', value, self.labels, self.get_timestamp(),
                                 self.internal)
             if self.count_calls:
-                k += MetricData(self.name + '.count', self.calls, self.labels, self.get_timestamp(),
+                k += MetricData(self.name + '.count', calls, self.labels, self.get_timestamp(),
                                 self.internal)
             return k
 
         p = super().to_metric_data()
-        p.set_value(self.value)
+        p.set_value(value)
         if self.count_calls:
-            p += MetricData(self.name + '.count', self.calls, self.labels, self.get_timestamp(),
+            p += MetricData(self.name + '.count', calls, self.labels, self.get_timestamp(),
                             self.internal)
 
         return p
 
     def _handle(self, delta: float = 0, **labels):
+        if self.shards is not None:
+            shard = self.shards.get()
+            if self.embedded_submetrics_enabled or labels:
+                if self.sum_children:
+                    shard[0] += delta
+                shard[1] += 1
+                return super()._handle(delta, **labels)
+
+            shard[0] += delta
+            shard[1] += 1
+            return
+
         if self.embedded_submetrics_enabled or labels:
             if self.sum_children:
                 self.value += delta
@@ -1,4 +1,4 @@
-import collections
+import math
 import time
 import typing as tp
 
@@ -15,61 +15,93 @@ class ClicksPerTimeUnitMetric(EmbeddedSubmetrics):
 
     By default (if you do not specify otherwise) this will track calls made during the last second.
 
+    Calls are counted in a ring buffer of bins, each resolution seconds wide, spanning the longest
+    of the time periods. Memory use and the cost of to_metric_data() therefore do not depend on
+    the rate of calls, but time periods are effectively rounded to resolution.
+
     This was once deprecated but out of platforms which suck at calculating derivatives of their
     series (AWS, I'm looking at you!) this was decided to be undeprecated.
+
+    :param time_unit_vectors: time periods, in seconds, to count the calls over
+    :param aggregate_children: whether to sum up children values (if present)
+    :param resolution: width of a single bin, in seconds
     """
-    __slots__ = 'last_clicks', 'aggregate_children', 'cutoff_period', 'time_unit_vectors'
+    __slots__ = ('aggregate_children', 'cutoff_period', 'time_unit_vectors', 'resolution',
+                 'bins', 'bin_indices')
 
     CLASS_NAME = 'cps'
 
     def __init__(self, *args, time_unit_vectors: tp.Optional[tp.List[float]] = None,
-                 aggregate_children: bool = True, internal: bool = False, **kwargs):
-        super().__init__(*args, internal=internal, time_unit_vectors=time_unit_vectors, **kwargs)
+                 aggregate_children: bool = True, internal: bool = False,
+                 resolution: float = 0.1, **kwargs):
+        super().__init__(*args, internal=internal, time_unit_vectors=time_unit_vectors,
+                         resolution=resolution, **kwargs)
         time_unit_vectors = time_unit_vectors or [1]
-        self.last_clicks = collections.deque()  # type: tp.List[float]
         self.aggregate_children = aggregate_children  # type: bool
         self.cutoff_period = max(time_unit_vectors)  # type: int
         self.time_unit_vectors = time_unit_vectors  # type: tp.List[int]
+        self.resolution = resolution  # type: float
+        bin_count = math.ceil(self.cutoff_period / resolution) + 1
+        self.bins = [0] * bin_count  # type: tp.List[int]
+        # absolute number of the bin that given slot currently holds
+        self.bin_indices = [-1] * bin_count  # type: tp.List[int]
 
     def _handle(self, **labels) -> None:
         if labels or self.embedded_submetrics_enabled:
             return super()._handle(**labels)
 
-        mono_time = time.monotonic()
-        self.last_clicks.append(time.monotonic())
-        try:
-            while self.last_clicks[0] <= mono_time - self.cutoff_period:
-                self.last_clicks.popleft()
-        except IndexError:
-            pass
+        index = int(time.monotonic() / self.resolution)
+        slot = index % len(self.bins)
+        if self.bin_indices[slot] == index:
+            self.bins[slot] += 1
+        else:
+            self.bin_indices[slot] = index
+            self.bins[slot] = 1
+
+    def absorb(self, child: 'ClicksPerTimeUnitMetric') -> None:
+        for slot, index in enumerate(child.bin_indices):
+            if index == self.bin_indices[slot]:
+                self.bins[slot] += child.bins[slot]
+            elif index > self.bin_indices[slot]:
+                self.bin_indices[slot] = index
+                self.bins[slot] = child.bins[slot]
+
+    def count_clicks(self) -> tp.List[int]:
+        """
+        Return the amount of calls during each of time_unit_vectors
+        """
+        now = int(time.monotonic() / self.resolution)
+        cutoffs = [now - round(v / self.resolution) for v in self.time_unit_vectors]
+        count_map = [0] * len(self.time_unit_vectors)
+        for index, amount in zip(self.bin_indices, self.bins):
+            for vector_index, cutoff in enumerate(cutoffs):
+                if index > cutoff:
+                    count_map[vector_index] += amount
+        return count_map
 
-    def to_metric_data(self) -> tp.List[int]:
+    def to_metric_data(self) -> MetricDataCollection:
         if self.embedded_submetrics_enabled:
             k = super().to_metric_data()
             if not self.aggregate_children:
                 return k
             else:
-                last_clicks = []
+                count_map = [0] * len(self.time_unit_vectors)
                 for child in self.children:
-                    last_clicks.extend(child.last_clicks)
+                    for index, count in enumerate(child.count_clicks()):
+                        count_map[index] += count
 
-                sum_data = self.count_vectors(last_clicks)
+                sum_data = self.count_vectors(count_map)
                 sum_data.postfix_with('total')
 
-                return k + sum_data
-
-        return self.count_vectors(self.last_clicks)
-
-    def count_vectors(self, last_clicks) -> MetricDataCollection:
-        count_map = [0] * len(self.time_unit_vectors)
-        mono_time = time.monotonic()
-        time_unit_vectors = [mono_time - v for v in self.time_unit_vectors]
+                k += sum_data
+                return k
 
-        for v in last_clicks:
-            for index, cutoff in enumerate(time_unit_vectors):
-                if v >= cutoff:
-                    count_map[index] += 1
+        return self.count_vectors(self.count_clicks())
 
+    def count_vectors(self, count_map: tp.List[int]) -> MetricDataCollection:
+        """
+        Turn the amounts of calls during each of time_unit_vectors into metric data
+        """
         output = []
         for time_unit, count in zip(self.time_unit_vectors, count_map):
             output.append(MetricData(self.name, count, {'period': time_unit, **self.labels},
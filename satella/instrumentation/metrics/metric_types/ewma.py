@@ -0,0 +1,134 @@
+import math
+import time
+import typing as tp
+
+from satella.coding.typing import NoArgCallable
+from .base import EmbeddedSubmetrics
+from .measurable_mixin import MeasurableMixin
+from .registry import register_metric
+from ..data import MetricData, MetricDataCollection
+
+
+@register_metric
+class EWMAMetric(EmbeddedSubmetrics, MeasurableMixin):
+    """
+    Exponentially weighted moving averages of the rate of calls to handle() and of the values
+    passed to it, over a few half-lives, like Unix's 1, 5 and 15-minute load averages.
+
+    Each call decays the state by the time elapsed since the previous call, so both memory and
+    the cost of a call are constant, regardless of the rate of calls.
+
+    The rate will be reported as <name>.rate, in calls per second, and the average of values as
+    <name>, both with a label of half_life. The average is weighted by both the amount of calls
+    and their age, and will be reported only if any value was passed to handle(). Note that
+    the rate starts from zero, so it will take a few half-lives to warm up.
+
+    Use like:
+
+    >>> requests = getMetric('requests.latency', 'ewma')
+    >>> requests.runtime(0.2)   # or
+    >>> requests.runtime()      # to count only the rate
+
+    :param half_lives: half-lives of the averages, in seconds
+    :param aggregate_children: whether to compute averages over calls to all children as well
+    :param time_getter: a callable returning current time in seconds
+    """
+    __slots__ = ('half_lives', 'decay_rates', 'aggregate_children', 'time_getter',
+                 'last_call', 'counts', 'value_counts', 'sums')
+
+    CLASS_NAME = 'ewma'
+
+    def __init__(self, *args, half_lives: tp.Sequence[float] = (60, 300, 900),
+                 aggregate_children: bool = True,
+                 time_getter: NoArgCallable[float] = time.monotonic,
+                 internal: bool = False, **kwargs):
+        super().__init__(*args, internal=internal, half_lives=half_lives,
+                         aggregate_children=aggregate_children, time_getter=time_getter,
+                         **kwargs)
+        self.half_lives = list(half_lives)  # type: tp.List[float]
+        self.decay_rates = [math.log(2) / half_life for half_life in half_lives] \
+            # type: tp.List[float]
+        self.aggregate_children = aggregate_children  # type: bool
+        self.time_getter = time_getter  # type: NoArgCallable[float]
+        self.last_call = None  # type: tp.Optional[float]
+        # calls, calls with a value and sum of values, all decayed as of last_call
+        self.counts = [0.0] * len(half_lives)  # type: tp.List[float]
+        self.value_counts = [0.0] * len(half_lives)  # type: tp.List[float]
+        self.sums = [0.0] * len(half_lives)  # type: tp.List[float]
+
+    def _handle(self, value: tp.Optional[float] = None, **labels) -> None:
+        if labels or self.embedded_submetrics_enabled:
+            super()._handle(value, **labels)
+            if not self.aggregate_children:
+                return
+
+        now = self.time_getter()
+        elapsed = 0 if self.last_call is None else now - self.last_call
+        self.last_call = now
+        for index, decay_rate in enumerate(self.decay_rates):
+            decay = math.exp(-decay_rate * elapsed)
+            self.counts[index] = self.counts[index] * decay + 1
+            if value is not None:
+                self.value_counts[index] = self.value_counts[index] * decay + 1
+                self.sums[index] = self.sums[index] * decay + value
+            elif elapsed:
+                self.value_counts[index] *= decay
+                self.sums[index] *= decay
+
+    def absorb(self, child: 'EWMAMetric') -> None:
+        if child.last_call is None:
+            return
+        if self.last_call is None:
+            self.last_call = child.last_call
+        now = max(self.last_call, child.last_call)
+        for index, decay_rate in enumerate(self.decay_rates):
+            own_decay = math.exp(-decay_rate * (now - self.last_call))
+            child_decay = math.exp(-decay_rate * (now - child.last_call))
+            self.counts[index] = self.counts[index] * own_decay + \
+                child.counts[index] * child_decay
+            self.value_counts[index] = self.value_counts[index] * own_decay + \
+                child.value_counts[index] * child_decay
+            self.sums[index] = self.sums[index] * own_decay + child.sums[index] * child_decay
+        self.last_call = now
+
+    def get_rates(self) -> tp.List[float]:
+        """
+        Return the average rates of calls per second, for each of the half-lives
+        """
+        if self.last_call is None:
+            return [0.0] * len(self.half_lives)
+        elapsed = self.time_getter() - self.last_call
+        return [count * math.exp(-decay_rate * elapsed) * decay_rate
+                for count, decay_rate in zip(self.counts, self.decay_rates)]
+
+    def get_averages(self) -> tp.List[tp.Optional[float]]:
+        """
+        Return the average values, for each of the half-lives, or Nones if no values were given
+        """
+        return [sum_ / value_count if value_count else None
+                for sum_, value_count in zip(self.sums, self.value_counts)]
+
+    def to_metric_data(self) -> MetricDataCollection:
+        if self.embedded_submetrics_enabled:
+            k = super().to_metric_data()
+            if self.aggregate_children:
+                totals = self.get_vectors()
+                totals.postfix_with('total')
+                k += totals
+            return k
+        return self.get_vectors()
+
+    def get_vectors(self) -> MetricDataCollection:
+        """
+        Turn own rates and averages into metric data
+        """
+        output = []
+        for half_life, rate, average in zip(self.half_lives, self.get_rates(),
+                                            self.get_averages()):
+            labels = {'half_life': half_life, **self.labels}
+            output.append(MetricData(self.name + '.rate', rate, labels, self.get_timestamp(),
+                                     self.internal))
+            if average is not None:
+                output.append(MetricData(self.name, average, labels, self.get_timestamp(),
+                                         self.internal))
+        return MetricDataCollection(output)
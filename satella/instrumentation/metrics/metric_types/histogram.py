@@ -1,15 +1,23 @@
-import itertools
+import bisect
 import math
+import time
 import typing as tp
 
 from .base import EmbeddedSubmetrics, MetricLevel
 from .measurable_mixin import MeasurableMixin
 from .registry import register_metric
+from .sampling import SamplingMixin, sample_rate_to_every
+from .shards import ThreadShards
 from ..data import MetricData, MetricDataCollection
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 @register_metric
-class HistogramMetric(EmbeddedSubmetrics, MeasurableMixin):
+class HistogramMetric(SamplingMixin, EmbeddedSubmetrics, MeasurableMixin):
     """
     A histogram, by  `Prometheus' <https://github.com/prometheus/client_python#histogram/>`_
     interpretation.
@@ -18,8 +26,16 @@ class HistogramMetric(EmbeddedSubmetrics, MeasurableMixin):
         value to second, last bucket will be from last value to infinity. So there are
         len(buckets)+1 buckets. Buckets are expected to be passed in sorted!
     :param aggregate_children: whether to accept child calls to be later presented as total
+    :param sharded: if True, each thread will update it's own shard of this histogram,
+        and the shards will be merged in to_metric_data(). This makes handle() correct
+        under concurrent access without taking a lock. Shards of threads that died are
+        merged, so short-lived threads don't accumulate them.
+    :param sample_rate: fraction of calls to handle() that will be recorded. Every N-th call,
+        where N is 1/sample_rate rounded, is recorded, and the buckets, the sum and the count
+        are multiplied by N in to_metric_data().
     """
-    __slots__ = ('bucket_limits', 'buckets', 'aggregate_children', 'count', 'sum')
+    __slots__ = ('bucket_limits', 'buckets', 'aggregate_children', 'count', 'sum', 'shards',
+                 'sample_every', 'sample_countdown')
 
     CLASS_NAME = 'histogram'
 
@@ -28,18 +44,112 @@ class HistogramMetric(EmbeddedSubmetrics, MeasurableMixin):
                  internal: bool = False,
                  buckets: tp.Sequence[float] = (.005, .01, .025, .05, .075, .1, .25, .5,
                                                 .75, 1.0, 2.5, 5.0, 7.5, 10.0),
-                 aggregate_children: bool = True, *args, **kwargs):
+                 aggregate_children: bool = True,
+                 sharded: bool = False,
+                 sample_rate: float = 1, *args, **kwargs):
         super().__init__(name, root_metric, metric_level, internal=internal, buckets=buckets,
-                         aggregate_children=aggregate_children, *args, **kwargs)
+                         aggregate_children=aggregate_children, sharded=sharded,
+                         sample_rate=sample_rate, *args, **kwargs)
+        self.sample_every = sample_rate_to_every(sample_rate)  # type: int
+        self.sample_countdown = self.sample_every  # type: int
         self.bucket_limits = list(buckets)  # type: tp.List[float]
         self.buckets = [0] * (len(buckets) + 1)  # type: tp.List[int]
         self.aggregate_children = aggregate_children  # type: bool
         self.count = 0  # type: int
         self.sum = 0.0  # type: float
+        if sharded:
+            self.shards = ThreadShards(self._new_shard,
+                                       self._merge_shards)  # type: tp.Optional[ThreadShards]
+        else:
+            self.shards = None
+
+    def _new_shard(self) -> list:
+        return [0, 0.0, [0] * len(self.buckets)]
+
+    @staticmethod
+    def _merge_shards(shard_a: list, shard_b: list) -> list:
+        return [shard_a[0] + shard_b[0], shard_a[1] + shard_b[1],
+                [a + b for a, b in zip(shard_a[2], shard_b[2])]]
+
+    def _add_to_buckets(self, buckets: tp.List[int], value: float) -> None:
+        if value >= 0:
+            buckets[bisect.bisect_right(self.bucket_limits, value)] += 1
+
+    def _bin_many(self, values: tp.Sequence[float]) -> tp.Tuple[tp.List[int], float, int]:
+        """
+        Put values into buckets.
+
+        :return: a tuple of (bucket counts, sum of values, amount of values)
+        """
+        if numpy is not None:
+            array = numpy.asarray(values, dtype=float)
+            indices = numpy.searchsorted(self.bucket_limits, array, side='right')
+            counts = numpy.bincount(indices[array >= 0], minlength=len(self.buckets))
+            return counts.tolist(), float(array.sum()), len(array)
+
+        counts = [0] * len(self.buckets)
+        sum_ = 0.0
+        for value in values:
+            sum_ += value
+            self._add_to_buckets(counts, value)
+        return counts, sum_, len(values)
+
+    def handle_many(self, values: tp.Sequence[float],
+                    logging_level: MetricLevel = MetricLevel.RUNTIME, **labels) -> None:
+        """
+        Register a batch of values at once. This is equivalent to calling handle() for each value,
+        but much faster, especially if numpy is installed, since then the values will be binned
+        in a single vectorized pass.
+
+        If this histogram is sampled, every N-th value will be taken.
+
+        :param values: a sequence of values, or a numpy array
+        :param logging_level: one of RUNTIME or DEBUG
+        :param labels: extra labels to call handle() with
+        """
+        if not self.can_process_this_level(logging_level):
+            return
+        if self.enable_timestamp:
+            self.last_updated = time.time()
+        if self.sample_every > 1:
+            values = values[self.sample_every - 1::self.sample_every]
+        self._handle_many(*self._bin_many(values), **labels)
+
+    def _handle_many(self, counts: tp.List[int], sum_: float, count: int, **labels) -> None:
+        if self.shards is not None:
+            shard = self.shards.get()
+            shard[0] += count
+            shard[1] += sum_
+            buckets = shard[2]
+        else:
+            self.count += count
+            self.sum += sum_
+            buckets = self.buckets
+
+        if self.embedded_submetrics_enabled or labels:
+            if self.enable_timestamp:
+                self.last_updated = time.time()
+            if labels:
+                self.embedded_submetrics_enabled = True
+                # noinspection PyProtectedMember
+                self.get_child(labels)._handle_many(counts, sum_, count)
+
+            if not self.aggregate_children:
+                return
+
+        for index, amount in enumerate(counts):
+            buckets[index] += amount
 
     def _handle(self, value, **labels):
-        self.count += 1
-        self.sum += value
+        if self.shards is not None:
+            shard = self.shards.get()
+            shard[0] += 1
+            shard[1] += value
+            buckets = shard[2]
+        else:
+            self.count += 1
+            self.sum += value
+            buckets = self.buckets
 
         if self.embedded_submetrics_enabled or labels:
             super()._handle(value, **labels)
@@ -47,33 +157,56 @@ class HistogramMetric(EmbeddedSubmetrics, MeasurableMixin):
             if not self.aggregate_children:
                 return
 
-        lower_bound = 0.0
-        for index, upper_bound in itertools.chain(enumerate(self.bucket_limits),
-                                                  [(len(self.bucket_limits), math.inf)]):
-            if lower_bound <= value < upper_bound:
-                self.buckets[index] += 1
-            lower_bound = upper_bound
+        self._add_to_buckets(buckets, value)
+
+    def get_state(self) -> tp.Tuple[tp.List[int], float, int]:
+        """
+        Return a tuple of (buckets, sum, count), merging the shards if this histogram is sharded
+        """
+        if self.shards is None:
+            return self.buckets, self.sum, self.count
+        buckets, sum_, count = list(self.buckets), self.sum, self.count
+        for shard_count, shard_sum, shard_buckets in self.shards:
+            count += shard_count
+            sum_ += shard_sum
+            for index, amount in enumerate(shard_buckets):
+                buckets[index] += amount
+        return buckets, sum_, count
+
+    def absorb(self, child: 'HistogramMetric') -> None:
+        buckets, sum_, count = child.get_state()
+        for index, amount in enumerate(buckets):
+            self.buckets[index] += amount
+        self.sum += sum_
+        self.count += count
 
     def to_metric_data(self) -> MetricDataCollection:
+        buckets, sum_, count = self.get_state()
+        if self.sample_every > 1:
+            buckets = [amount * self.sample_every for amount in buckets]
+            sum_, count = sum_ * self.sample_every, count * self.sample_every
         if self.embedded_submetrics_enabled:
             k = super().to_metric_data()
             if self.aggregate_children:
-                mdc = self.containers_to_metric_data()
+                mdc = self.containers_to_metric_data(buckets)
                 mdc.postfix_with('total')
-                mdc += MetricData(self.name + '.total.sum', self.sum, {}, self.get_timestamp())
-                mdc += MetricData(self.name + '.total.count', self.count, {}, self.get_timestamp())
+                mdc += MetricData(self.name + '.total.sum', sum_, {}, self.get_timestamp())
+                mdc += MetricData(self.name + '.total.count', count, {}, self.get_timestamp())
                 k += mdc
             return k
 
-        mdc = self.containers_to_metric_data()
-        mdc += MetricData(self.name + '.sum', self.sum, self.labels, self.get_timestamp())
-        mdc += MetricData(self.name + '.count', self.count, self.labels, self.get_timestamp())
+        mdc = self.containers_to_metric_data(buckets)
+        mdc += MetricData(self.name + '.sum', sum_, self.labels, self.get_timestamp())
+        mdc += MetricData(self.name + '.count', count, self.labels, self.get_timestamp())
         return mdc
 
-    def containers_to_metric_data(self) -> MetricDataCollection:
+    def containers_to_metric_data(self, buckets: tp.Optional[tp.List[int]] = None) -> \
+            MetricDataCollection:
+        if buckets is None:
+            buckets = self.get_state()[0]
         output = []
         lower_bound = 0.0
-        for amount, upper_bound in zip(self.buckets,
+        for amount, upper_bound in zip(buckets,
                                        self.bucket_limits + [math.inf]):
             labels = self.labels.copy()
             labels.update(ge=upper_bound,
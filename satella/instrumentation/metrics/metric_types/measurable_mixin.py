@@ -1,5 +1,7 @@
+import asyncio
 import inspect
 import time
+import typing as tp
 from concurrent.futures import Future
 
 from satella.coding.decorators.decorators import wraps
@@ -37,7 +39,8 @@ class MeasurableMixin:
 
     def measure(self, include_exceptions: bool = True,
                 logging_level: MetricLevel = MetricLevel.RUNTIME,
-                value_getter: NoArgCallable[float] = time.monotonic, **labels):
+                value_getter: tp.Optional[NoArgCallable[float]] = None,
+                nanoseconds: bool = False, **labels):
         """
         A decorator to measure a difference between some value after the method call
         and before it.
@@ -54,17 +57,38 @@ class MeasurableMixin:
         If wrapped around p_gen, it will time it from the first element to the last,
         so beware that it will depend on the speed of the consumer.
 
-        It also can be used as a context manager:
+        Coroutine functions and async generators are supported as well, and their awaited
+        execution will be timed:
+
+        >>> @call_time.measure()
+        >>> async def measure_my_execution(args):
+        >>>     ...
+
+        Cancellation of a coroutine or an async generator counts as an exception. asend(),
+        athrow() and aclose() of an async generator are passed to the wrapped one.
+
+        It also can be used as a context manager, both synchronous and asynchronous:
 
         >>> with call_time.measure(logging_level=MetricLevel.DEBUG, label='key'):
         >>>     ...
+        >>> async with call_time.measure(label='key'):
+        >>>     ...
 
         :param include_exceptions: whether to include exceptions
         :param logging_level: one of RUNTIME or DEBUG
         :param value_getter: a callable that takes no arguments and returns a float, which is
-            the value
+            the value. Defaults to time.monotonic
+        :param nanoseconds: if True, time.perf_counter_ns will be used as value_getter, so
+            values will be integer nanoseconds
         :param labels: extra labels to call handle() with
+        :raises ValueError: both value_getter and nanoseconds were given
         """
+        if nanoseconds:
+            if value_getter is not None:
+                raise ValueError('Cannot use a custom value_getter with nanoseconds')
+            value_getter = time.perf_counter_ns
+        elif value_getter is None:
+            value_getter = time.monotonic
 
         class MeasurableMixinInternal:
             def __init__(self, metric_class, include_exceptions, value_getter,
@@ -113,8 +137,63 @@ class MeasurableMixin:
                         if excepted is not None:
                             raise excepted
 
+                @wraps(fun)
+                async def inner_coroutine(*args, **kwargs):
+                    start_value = value_getter()
+                    excepted = None
+                    try:
+                        return await fun(*args, **kwargs)
+                    except (Exception, asyncio.CancelledError) as e:
+                        excepted = e
+                    finally:
+                        value_taken = value_getter() - start_value
+                        if excepted is not None and not self.include_exceptions:
+                            raise excepted
+
+                        self.metric_class.handle(self.logging_level, value_taken, **self.labels)
+
+                        if excepted is not None:
+                            raise excepted
+
+                @wraps(fun)
+                async def inner_async_generator(*args, **kwargs):
+                    start_value = value_getter()
+                    excepted = None
+                    generator = fun(*args, **kwargs)
+                    try:
+                        # delegate to the wrapped generator, like yield from would
+                        try:
+                            item = await generator.__anext__()
+                            while True:
+                                try:
+                                    sent = yield item
+                                except GeneratorExit:
+                                    await generator.aclose()
+                                    raise
+                                except BaseException as e:  # pylint: disable=broad-except
+                                    item = await generator.athrow(e)
+                                else:
+                                    item = await generator.asend(sent)
+                        except StopAsyncIteration:
+                            pass
+                    except (Exception, asyncio.CancelledError) as e:
+                        excepted = e
+                    finally:
+                        value_taken = value_getter() - start_value
+                        if excepted is not None and not self.include_exceptions:
+                            raise excepted
+
+                        self.metric_class.handle(self.logging_level, value_taken, **self.labels)
+
+                        if excepted is not None:
+                            raise excepted
+
                 if inspect.isgeneratorfunction(fun):
                     return inner_generator
+                elif inspect.iscoroutinefunction(fun):
+                    return inner_coroutine
+                elif inspect.isasyncgenfunction(fun):
+                    return inner_async_generator
                 else:
                     return inner_normal
 
@@ -131,5 +210,11 @@ class MeasurableMixin:
 
                 return False
 
+            async def __aenter__(self):
+                return self.__enter__()
+
+            async def __aexit__(self, exc_type, exc_val, exc_tb):
+                return self.__exit__(exc_type, exc_val, exc_tb)
+
         return MeasurableMixinInternal(self, include_exceptions, value_getter,
                                        logging_level, labels)
@@ -0,0 +1,157 @@
+import bisect
+import math
+import typing as tp
+
+from .base import LeafMetric, MetricLevel
+from .measurable_mixin import MeasurableMixin
+from .registry import register_metric
+from .sketch import DDSketch
+from ..data import MetricDataCollection
+from ..multiprocess import get_multiprocess_store, encode_key
+
+
+class MultiprocessMetric(LeafMetric):
+    """
+    Base class for metrics that write their values into the multiprocess store of current process,
+    instead of keeping them in memory.
+
+    Labels passed to handle() are written straight into the store, no child metrics are created.
+
+    These metrics output nothing in to_metric_data(), their values are read by
+    :func:`~satella.instrumentation.metrics.multiprocess.collect_multiprocess`.
+
+    :func:`~satella.instrumentation.metrics.multiprocess.enable_multiprocess` must be called
+    before they are updated.
+    """
+    __slots__ = ('fully_qualified_name', 'keys')
+
+    def __init__(self, name, root_metric: 'Metric' = None,
+                 metric_level: tp.Optional[MetricLevel] = None,
+                 internal: bool = False, *args, **kwargs):
+        super().__init__(name, root_metric, metric_level, internal=internal, *args, **kwargs)
+        self.fully_qualified_name = self.get_fully_qualified_name()  # type: str
+        self.keys = {}  # type: tp.Dict[tuple, tp.List[str]]
+
+    def get_keys(self, labels: dict, encode: tp.Callable[[dict], tp.List[str]],
+                 discriminator: tp.Hashable = None) -> tp.List[str]:
+        """
+        Return keys of the store for a series with given labels, computing them only once.
+
+        :param labels: labels passed to handle()
+        :param encode: a callable to compute the keys from all labels of the series
+        :param discriminator: extra part of the cache key, if encode depends on something
+            else than the labels
+        """
+        cache_key = discriminator, tuple(labels.items())
+        try:
+            return self.keys[cache_key]
+        except KeyError:
+            keys = self.keys[cache_key] = encode({**self.labels, **labels})
+            return keys
+
+    def to_metric_data(self) -> MetricDataCollection:
+        return MetricDataCollection()
+
+
+@register_metric
+class MultiprocessCounterMetric(MultiprocessMetric, MeasurableMixin):
+    """
+    A counter, summed across all processes
+    """
+    __slots__ = ()
+
+    CLASS_NAME = 'mp_counter'
+
+    def _encode(self, labels: dict) -> tp.List[str]:
+        return [encode_key('value', self.fully_qualified_name, labels)]
+
+    def _handle(self, delta: float = 0, **labels) -> None:
+        get_multiprocess_store().add(self.get_keys(labels, self._encode)[0], delta)
+
+
+@register_metric
+class MultiprocessHistogramMetric(MultiprocessMetric, MeasurableMixin):
+    """
+    A histogram, summed across all processes. Outputs the same data as HistogramMetric without
+    children.
+
+    :param buckets: bucket limits, in ascending order
+    """
+    __slots__ = ('bucket_limits',)
+
+    CLASS_NAME = 'mp_histogram'
+
+    def __init__(self, name, root_metric: 'Metric' = None,
+                 metric_level: tp.Optional[MetricLevel] = None,
+                 internal: bool = False,
+                 buckets: tp.Sequence[float] = (.005, .01, .025, .05, .075, .1, .25, .5,
+                                                .75, 1.0, 2.5, 5.0, 7.5, 10.0),
+                 *args, **kwargs):
+        super().__init__(name, root_metric, metric_level, internal=internal, buckets=buckets,
+                         *args, **kwargs)
+        self.bucket_limits = list(buckets)  # type: tp.List[float]
+
+    def _encode(self, labels: dict) -> tp.List[str]:
+        keys = []
+        lower_bound = 0.0
+        for upper_bound in self.bucket_limits + [math.inf]:
+            keys.append(encode_key('value', self.fully_qualified_name,
+                                   {**labels, 'ge': upper_bound, 'le': lower_bound}))
+            lower_bound = upper_bound
+        keys.append(encode_key('value', self.fully_qualified_name + '.sum', labels))
+        keys.append(encode_key('value', self.fully_qualified_name + '.count', labels))
+        return keys
+
+    def _handle(self, value: float, **labels) -> None:
+        store = get_multiprocess_store()
+        keys = self.get_keys(labels, self._encode)
+        if value >= 0:
+            store.add(keys[bisect.bisect_right(self.bucket_limits, value)], 1)
+        store.add(keys[-2], value)
+        store.add(keys[-1], 1)
+
+
+@register_metric
+class MultiprocessSummaryMetric(MultiprocessMetric, MeasurableMixin):
+    """
+    A summary, with quantiles computed over values from all processes by merging DDSketches.
+
+    Quantiles are computed over all values seen, not over a sliding window.
+
+    :param quantiles: a sequence of quantiles to return
+    :param count_calls: whether to output total amount of calls and total sum of values
+    :param relative_accuracy: relative accuracy of the sketch
+    """
+    __slots__ = ('quantiles', 'count_calls', 'sketch')
+
+    CLASS_NAME = 'mp_summary'
+
+    def __init__(self, name, root_metric: 'Metric' = None,
+                 metric_level: tp.Optional[MetricLevel] = None,
+                 internal: bool = False,
+                 quantiles: tp.Sequence[float] = (0.5, 0.95),
+                 count_calls: bool = True,
+                 relative_accuracy: float = 0.01, *args, **kwargs):
+        super().__init__(name, root_metric, metric_level, internal=internal,
+                         quantiles=quantiles, count_calls=count_calls,
+                         relative_accuracy=relative_accuracy, *args, **kwargs)
+        self.quantiles = list(quantiles)  # type: tp.List[float]
+        self.count_calls = count_calls  # type: bool
+        # used only to compute bucket keys
+        self.sketch = DDSketch(relative_accuracy)  # type: DDSketch
+
+    def _encode_totals(self, labels: dict) -> tp.List[str]:
+        return [encode_key('value', self.fully_qualified_name + '.sum', labels),
+                encode_key('value', self.fully_qualified_name + '.count', labels)]
+
+    def _handle(self, value: float, **labels) -> None:
+        store = get_multiprocess_store()
+        bucket_key = self.sketch.bucket_key(value)
+        extra = [self.sketch.relative_accuracy, self.quantiles, bucket_key]
+        key = self.get_keys(labels, lambda all_labels: [
+            encode_key('sketch', self.fully_qualified_name, all_labels, extra)], bucket_key)[0]
+        store.add(key, 1)
+        if self.count_calls:
+            keys = self.get_keys(labels, self._encode_totals)
+            store.add(keys[0], value)
+            store.add(keys[1], 1)
@@ -0,0 +1,35 @@
+import typing as tp
+
+from .base import MetricLevel
+
+
+def sample_rate_to_every(sample_rate: float) -> int:
+    """
+    Convert a sample rate into N, such that every N-th call is recorded
+
+    :raises ValueError: sample_rate is not in (0, 1]
+    """
+    if not 0 < sample_rate <= 1:
+        raise ValueError('sample_rate must be larger than 0 and at most 1, not %s' % (sample_rate,))
+    return max(int(round(1 / sample_rate)), 1)
+
+
+class SamplingMixin:
+    """
+    Record only every N-th call to handle(), so that metrics updated in tight loops cost less.
+
+    The class must define sample_every, the N, and sample_countdown in it's slots,
+    and scale the values by sample_every in to_metric_data().
+
+    Sampling is deterministic, so that it costs only a decrement. The countdown is not
+    synchronized between threads, so under concurrent access the rate is approximate.
+    """
+    __slots__ = ()
+
+    def handle(self, level: tp.Union[int, MetricLevel], *args, **kwargs) -> None:
+        if self.sample_every > 1 and self._effective_level >= level:
+            self.sample_countdown -= 1
+            if self.sample_countdown > 0:
+                return
+            self.sample_countdown = self.sample_every
+        super().handle(level, *args, **kwargs)
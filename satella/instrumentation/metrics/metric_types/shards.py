@@ -0,0 +1,80 @@
+import threading
+import typing as tp
+import weakref
+
+from satella.coding.typing import NoArgCallable
+
+MIN_SHARDS_TO_MERGE = 8
+
+
+class ThreadShards:
+    """
+    A set of per-thread shards of some mutable state.
+
+    Each thread gets it's own shard, created with shard_factory upon first access, so the
+    hot path can update it without any locking. Readers iterate over all the shards and
+    merge them.
+
+    Shards of threads that have died are merged into a base shard, so that no data is lost and
+    the amount of shards is bounded by the amount of threads alive, even if threads are
+    short-lived. This is done when the shards are iterated over, and when shards are created.
+
+    :param shard_factory: a callable that returns a fresh shard
+    :param merge: a callable that returns a new shard holding the sum of two given shards.
+        It must not modify them, since readers may be iterating over them.
+    """
+    __slots__ = ('shard_factory', 'merge', 'local', 'shards', 'base', 'lock', 'merge_at')
+
+    def __init__(self, shard_factory: NoArgCallable[tp.Any],
+                 merge: tp.Callable[[tp.Any, tp.Any], tp.Any]):
+        self.shard_factory = shard_factory
+        self.merge = merge
+        self.local = threading.local()
+        self.shards = []  # type: tp.List[tp.Tuple[weakref.ref, tp.Any]]
+        self.base = shard_factory()
+        self.lock = threading.Lock()
+        self.merge_at = MIN_SHARDS_TO_MERGE  # type: int
+
+    def get(self) -> tp.Any:
+        """
+        Return the shard belonging to current thread, creating it if necessary
+        """
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.shard_factory()
+            with self.lock:
+                self.shards.append((weakref.ref(threading.current_thread()), shard))
+                if len(self.shards) >= self.merge_at:
+                    self._merge_dead()
+                    self.merge_at = max(MIN_SHARDS_TO_MERGE, 2 * len(self.shards))
+            self.local.shard = shard
+            return shard
+
+    def _merge_dead(self) -> None:
+        """
+        Merge shards of threads that have died into the base shard.
+
+        Must be called with lock held.
+        """
+        alive = []
+        for thread_ref, shard in self.shards:
+            thread = thread_ref()
+            if thread is not None and thread.is_alive():
+                alive.append((thread_ref, shard))
+            else:
+                self.base = self.merge(self.base, shard)
+        self.shards = alive
+
+    def __iter__(self) -> tp.Iterator[tp.Any]:
+        with self.lock:
+            self._merge_dead()
+            shards = [self.base]
+            shards.extend(shard for _, shard in self.shards)
+        return iter(shards)
+
+    def __len__(self) -> int:
+        """
+        Return the amount of per-thread shards, not counting the base shard
+        """
+        return len(self.shards)
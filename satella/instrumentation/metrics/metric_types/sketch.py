@@ -0,0 +1,142 @@
+import math
+import typing as tp
+
+
+class DDSketch:
+    """
+    A mergeable quantile sketch with bounded relative error, as described in
+    `DDSketch <https://arxiv.org/abs/1908.10693>`_.
+
+    Values are counted in logarithmically-sized buckets, so inserting is O(1), memory is bounded
+    by max_buckets and two sketches of the same relative accuracy can be merged by adding
+    their bucket counts.
+
+    :param relative_accuracy: relative accuracy of returned quantiles, between 0 and 1
+    :param max_buckets: maximum amount of buckets per sign. If exceeded, the lowest buckets
+        (by magnitude) will be collapsed together, losing accuracy for the smallest values only.
+    """
+    __slots__ = ('relative_accuracy', 'max_buckets', 'gamma', 'log_gamma', 'positive',
+                 'negative', 'zero_count', 'count')
+
+    MIN_INDEXABLE_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        assert 0 < relative_accuracy < 1, 'relative_accuracy must be between 0 and 1'
+        self.relative_accuracy = relative_accuracy  # type: float
+        self.max_buckets = max_buckets  # type: int
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)  # type: float
+        self.log_gamma = math.log(self.gamma)  # type: float
+        self.positive = {}  # type: tp.Dict[int, int]
+        self.negative = {}  # type: tp.Dict[int, int]
+        self.zero_count = 0  # type: int
+        self.count = 0  # type: int
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def _collapse(self, buckets: tp.Dict[int, int]) -> None:
+        while len(buckets) > self.max_buckets:
+            lowest, second_lowest = sorted(buckets)[:2]
+            buckets[second_lowest] += buckets.pop(lowest)
+
+    def add(self, value: float) -> None:
+        """
+        Add a value to the sketch
+        """
+        self.count += 1
+        if value > self.MIN_INDEXABLE_VALUE:
+            buckets = self.positive
+        elif value < -self.MIN_INDEXABLE_VALUE:
+            buckets = self.negative
+            value = -value
+        else:
+            self.zero_count += 1
+            return
+
+        index = self._index(value)
+        try:
+            buckets[index] += 1
+        except KeyError:
+            buckets[index] = 1
+            if len(buckets) > self.max_buckets:
+                self._collapse(buckets)
+
+    def bucket_key(self, value: float) -> tp.Tuple[int, int]:
+        """
+        Return a key of the bucket that given value would be counted in, for use with
+        :meth:`add_bucket`.
+
+        :return: a tuple of (sign, index), where sign is 1, 0 or -1
+        """
+        if value > self.MIN_INDEXABLE_VALUE:
+            return 1, self._index(value)
+        elif value < -self.MIN_INDEXABLE_VALUE:
+            return -1, self._index(-value)
+        else:
+            return 0, 0
+
+    def add_bucket(self, key: tp.Tuple[int, int], amount: int) -> None:
+        """
+        Add given amount of values to a bucket
+
+        :param key: a key of the bucket, as returned by :meth:`bucket_key`
+        :param amount: amount of values to add
+        """
+        sign, index = key
+        self.count += amount
+        if sign == 0:
+            self.zero_count += amount
+            return
+        buckets = self.positive if sign > 0 else self.negative
+        buckets[index] = buckets.get(index, 0) + amount
+        self._collapse(buckets)
+
+    def merge(self, other: 'DDSketch') -> 'DDSketch':
+        """
+        Add all values from other into this sketch and return self.
+
+        :raises ValueError: other has a different relative accuracy
+        """
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Cannot merge sketches of different relative accuracy')
+        for buckets, other_buckets in ((self.positive, other.positive),
+                                       (self.negative, other.negative)):
+            for index, amount in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + amount
+            self._collapse(buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q: float) -> tp.Optional[float]:
+        """
+        Return an approximation of the q-th quantile of added values, or None if the sketch
+        is empty.
+
+        :param q: quantile to compute, between 0 and 1
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
@@ -1,4 +1,5 @@
 import collections
+import functools
 import typing as tp
 import warnings
 
@@ -6,22 +7,38 @@ from satella.coding.transforms.percentile import percentile
 from .base import EmbeddedSubmetrics, MetricLevel
 from .measurable_mixin import MeasurableMixin
 from .registry import register_metric
+from .sampling import SamplingMixin, sample_rate_to_every
+from .sketch import DDSketch
 from ..data import MetricData, MetricDataCollection
 
 
 @register_metric
-class SummaryMetric(EmbeddedSubmetrics, MeasurableMixin):
+class SummaryMetric(SamplingMixin, EmbeddedSubmetrics, MeasurableMixin):
     """
     A metric that can register some values, sequentially, and then calculate quantiles from it.
     It calculates configurable quantiles over a sliding window of amount of measurements.
 
+    Alternatively, a sketch backend can be chosen. In that case values will be counted in a
+    :class:`~satella.instrumentation.metrics.metric_types.sketch.DDSketch`, which has bounded
+    memory, O(1) inserts and cheap merging of children for the total. Quantiles are then computed
+    over all values seen since the metric was created, not over a sliding window, and
+    last_calls is disregarded.
+
     :param last_calls: last calls to handle() to take into account
     :param quantiles: a sequence of quantiles to return in to_metric_data
     :param aggregate_children: whether to sum up children values (if present)
     :param count_calls: whether to count total amount of calls and total time
+    :param backend: either 'window' (the default) for a sliding window of last_calls values,
+        or 'ddsketch' for a quantile sketch
+    :param relative_accuracy: relative accuracy of the sketch, used only for the sketch backend
+    :param max_buckets: maximum amount of buckets of the sketch, used only for the sketch backend
+    :param sample_rate: fraction of calls to handle() that will be recorded. Every N-th call,
+        where N is 1/sample_rate rounded, is recorded, and the total amount of calls and the
+        total time are multiplied by N in to_metric_data().
     """
     __slots__ = ('last_calls', 'calls_queue', 'quantiles', 'aggregate_children',
-                 'count_calls', 'tot_calls', 'tot_time')
+                 'count_calls', 'tot_calls', 'tot_time', 'sketch', 'sample_every',
+                 'sample_countdown')
 
     CLASS_NAME = 'summary'
 
@@ -30,12 +47,25 @@ class SummaryMetric(EmbeddedSubmetrics, MeasurableMixin):
                  internal: bool = False,
                  last_calls: int = 100, quantiles: tp.Sequence[float] = (0.5, 0.95),
                  aggregate_children: bool = True,
-                 count_calls: bool = True, *args,
+                 count_calls: bool = True,
+                 backend: str = 'window',
+                 relative_accuracy: float = 0.01,
+                 max_buckets: int = 2048,
+                 sample_rate: float = 1, *args,
                  **kwargs):
         super().__init__(name, root_metric, metric_level, *args, internal=internal,
                          last_calls=last_calls, quantiles=quantiles,
                          aggregate_children=aggregate_children, count_calls=count_calls,
-                         **kwargs)
+                         backend=backend, relative_accuracy=relative_accuracy,
+                         max_buckets=max_buckets, sample_rate=sample_rate, **kwargs)
+        self.sample_every = sample_rate_to_every(sample_rate)  # type: int
+        self.sample_countdown = self.sample_every  # type: int
+        if backend == 'window':
+            self.sketch = None  # type: tp.Optional[DDSketch]
+        elif backend == 'ddsketch':
+            self.sketch = DDSketch(relative_accuracy, max_buckets)
+        else:
+            raise ValueError('Unknown backend %s' % (backend,))
         self.last_calls = last_calls  # type: int
         self.calls_queue = collections.deque()  # type: tp.List[float]
         self.quantiles = quantiles  # type: tp.List[float]
@@ -52,17 +82,39 @@ class SummaryMetric(EmbeddedSubmetrics, MeasurableMixin):
         if labels or self.embedded_submetrics_enabled:
             return super()._handle(time_taken, **labels)
 
+        if self.sketch is not None:
+            self.sketch.add(time_taken)
+            return
+
         if len(self.calls_queue) == self.last_calls:
             self.calls_queue.pop()
 
         self.calls_queue.appendleft(time_taken)
 
+    def absorb(self, child: 'SummaryMetric') -> None:
+        self.tot_calls += child.tot_calls
+        self.tot_time += child.tot_time
+        if self.sketch is not None:
+            self.sketch.merge(child.sketch)
+            return
+        for value in reversed(child.calls_queue):
+            if len(self.calls_queue) == self.last_calls:
+                self.calls_queue.pop()
+            self.calls_queue.appendleft(value)
+
+    def get_totals(self) -> tp.Tuple[int, float]:
+        """
+        Return total amount of calls and total time, scaled up if this metric is sampled
+        """
+        return self.tot_calls * self.sample_every, self.tot_time * self.sample_every
+
     def to_metric_data(self) -> MetricDataCollection:
         k = self._to_metric_data()
         if self.count_calls:
-            k += MetricData(self.name + '.count', self.tot_calls, self.labels, self.get_timestamp(),
+            tot_calls, tot_time = self.get_totals()
+            k += MetricData(self.name + '.count', tot_calls, self.labels, self.get_timestamp(),
                             self.internal)
-            k += MetricData(self.name + '.sum', self.tot_time, self.labels, self.get_timestamp(),
+            k += MetricData(self.name + '.sum', tot_time, self.labels, self.get_timestamp(),
                             self.internal)
         return k
 
@@ -70,35 +122,53 @@ class SummaryMetric(EmbeddedSubmetrics, MeasurableMixin):
         if self.embedded_submetrics_enabled:
             k = super().to_metric_data()
             if self.aggregate_children:
-                total_calls = []
-                for child in self.children:
-                    total_calls.extend(child.calls_queue)
-                total_calls.sort()
+                if self.sketch is not None:
+                    total_calls = DDSketch(self.sketch.relative_accuracy, self.sketch.max_buckets)
+                    for child in self.children:
+                        total_calls.merge(child.sketch)
+                else:
+                    total_calls = []
+                    for child in self.children:
+                        total_calls.extend(child.calls_queue)
+                    total_calls.sort()
 
                 q = self.calculate_quantiles(total_calls)
                 q.postfix_with('total')
                 k += q
 
             if self.count_calls:
-                k += MetricData(self.name + '.count', self.tot_calls, self.labels,
+                tot_calls, tot_time = self.get_totals()
+                k += MetricData(self.name + '.count', tot_calls, self.labels,
                                 self.get_timestamp(), self.internal)
-                k += MetricData(self.name + '.sum', self.tot_time, self.labels,
+                k += MetricData(self.name + '.sum', tot_time, self.labels,
                                 self.get_timestamp(),
                                 self.internal)
 
             return k
+        elif self.sketch is not None:
+            return self.calculate_quantiles(self.sketch)
         else:
             return self.calculate_quantiles(self.calls_queue)
 
-    def calculate_quantiles(self, calls_queue) -> MetricDataCollection:
+    def calculate_quantiles(self, calls_queue: tp.Union[tp.Iterable[float], DDSketch]) -> \
+            MetricDataCollection:
+        """
+        Calculate quantiles from either a sequence of values or a sketch
+        """
         output = MetricDataCollection()
-        sorted_calls = sorted(calls_queue)
+        if isinstance(calls_queue, DDSketch):
+            is_empty = not calls_queue
+            get_quantile = calls_queue.quantile
+        else:
+            sorted_calls = sorted(calls_queue)
+            is_empty = not sorted_calls
+            get_quantile = functools.partial(percentile, sorted_calls)
         for p_val in self.quantiles:
-            if not sorted_calls:
+            if is_empty:
                 output += MetricData(self.name, 0.0, {'quantile': p_val, **self.labels},
                                      self.get_timestamp(), self.internal)
             else:
-                output += MetricData(self.name, percentile(sorted_calls, p_val),
+                output += MetricData(self.name, get_quantile(p_val),
                                      {'quantile': p_val, **self.labels}, self.get_timestamp(),
                                      self.internal)
         return output
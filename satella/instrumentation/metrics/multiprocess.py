@@ -0,0 +1,338 @@
+"""
+Support for metrics shared between multiple processes, such as pre-forked workers.
+
+Every process writes it's values into it's own memory-mapped file in a common directory, so that
+no IPC is needed when a metric is updated. A single process (the exporter) merges all of these
+files when it's asked for metric data.
+
+This works only on POSIX systems.
+"""
+import collections
+import contextlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import typing as tp
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .data import MetricData, MetricDataCollection
+from .metric_types.sketch import DDSketch
+
+__all__ = ['MultiprocessStore', 'encode_key', 'enable_multiprocess', 'disable_multiprocess',
+           'get_multiprocess_store', 'collect_multiprocess', 'compact_multiprocess']
+
+_HEADER = struct.Struct('<Q')  # amount of bytes used, including the header
+_KEY_LENGTH = struct.Struct('<I')
+_VALUE = struct.Struct('<d')
+_INITIAL_SIZE = 64 * 1024
+_FILE_NAME = re.compile(r'^metrics_(\d+)\.db$')
+ARCHIVE_FILE_NAME = 'metrics_archive.db'
+LOCK_FILE_NAME = 'metrics.lock'
+
+
+def _pad(length: int) -> int:
+    return (length + 7) // 8 * 8
+
+
+def encode_key(kind: str, name: str, labels: dict, extra=None) -> str:
+    """
+    Encode a key of a value in the store.
+
+    Labels are sorted, so that the same series from different processes share the key.
+
+    :param kind: 'value' for values summed across processes, or 'sketch' for DDSketch buckets
+    :param name: fully qualified name of the metric
+    :param labels: labels of the series
+    :param extra: extra data, for sketches it's [relative_accuracy, quantiles, bucket_key]
+    """
+    return json.dumps([kind, name, sorted(labels.items()), extra])
+
+
+class MultiprocessStore:
+    """
+    A file of float values keyed by strings, written through a shared memory map.
+
+    Entries are only appended, and never removed. Each entry is the length of the key, the key
+    itself padded to 8 bytes and a double, so a value can be updated in place.
+
+    This is thread-safe, but only a single process should write to a given file.
+
+    :param path: path to the file. It will be created if it does not exist.
+    """
+
+    def __init__(self, path: str):
+        self.path = path  # type: str
+        self.lock = threading.Lock()
+        self.offsets = {}  # type: tp.Dict[str, int]
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        size = os.fstat(self.fd).st_size
+        if size < _INITIAL_SIZE:
+            os.ftruncate(self.fd, _INITIAL_SIZE)
+            size = _INITIAL_SIZE
+        self.mmap = mmap.mmap(self.fd, size)
+        self.used = _HEADER.unpack_from(self.mmap, 0)[0] or _HEADER.size  # type: int
+        for key, offset in _iterate_entries(self.mmap, self.used):
+            self.offsets[key] = offset
+
+    def _allocate(self, key: str) -> int:
+        encoded = key.encode('utf8')
+        entry_size = _pad(_KEY_LENGTH.size + len(encoded)) + _VALUE.size
+        if self.used + entry_size > len(self.mmap):
+            new_size = len(self.mmap)
+            while self.used + entry_size > new_size:
+                new_size *= 2
+            self.mmap.close()
+            os.ftruncate(self.fd, new_size)
+            self.mmap = mmap.mmap(self.fd, new_size)
+
+        offset = self.used
+        _KEY_LENGTH.pack_into(self.mmap, offset, len(encoded))
+        self.mmap[offset + _KEY_LENGTH.size:offset + _KEY_LENGTH.size + len(encoded)] = encoded
+        value_offset = offset + entry_size - _VALUE.size
+        _VALUE.pack_into(self.mmap, value_offset, 0.0)
+        self.used += entry_size
+        # the header is updated last, so that readers never see a partial entry
+        _HEADER.pack_into(self.mmap, 0, self.used)
+        self.offsets[key] = value_offset
+        return value_offset
+
+    def add(self, key: str, delta: float) -> None:
+        """
+        Add delta to the value stored under given key, creating it with a value of zero if
+        it's not present.
+
+        :param key: key of the value
+        :param delta: value to add
+        """
+        with self.lock:
+            try:
+                offset = self.offsets[key]
+            except KeyError:
+                offset = self._allocate(key)
+            _VALUE.pack_into(self.mmap, offset, _VALUE.unpack_from(self.mmap, offset)[0] + delta)
+
+    def close(self) -> None:
+        """Close this store"""
+        self.mmap.close()
+        os.close(self.fd)
+
+
+def _iterate_entries(data, used: int) -> tp.Iterator[tp.Tuple[str, int]]:
+    """Return an iterator of (encoded key, offset of value)"""
+    offset = _HEADER.size
+    while offset < used:
+        key_length = _KEY_LENGTH.unpack_from(data, offset)[0]
+        key = bytes(data[offset + _KEY_LENGTH.size:offset + _KEY_LENGTH.size + key_length])
+        offset += _pad(_KEY_LENGTH.size + key_length)
+        yield key.decode('utf8'), offset
+        offset += _VALUE.size
+
+
+def _read_file(path: str) -> tp.Dict[str, float]:
+    with open(path, 'rb') as file:
+        data = file.read()
+    if len(data) < _HEADER.size:
+        return {}
+    used = min(_HEADER.unpack_from(data, 0)[0], len(data))
+    return {key: _VALUE.unpack_from(data, offset)[0]
+            for key, offset in _iterate_entries(data, used)}
+
+
+_store = None  # type: tp.Optional[MultiprocessStore]
+_directory = None  # type: tp.Optional[str]
+_store_lock = threading.Lock()
+
+
+def _reset_store_after_fork() -> None:
+    global _store, _store_lock
+    _store_lock = threading.Lock()
+    if _store is not None:
+        # this is parent's file, so the child must not write to it
+        _store.close()
+        _store = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_store_after_fork)
+
+
+def _check_supported() -> None:
+    if fcntl is None or sys.platform.startswith('win'):
+        raise OSError('Multiprocess metrics are supported only on POSIX systems')
+
+
+def enable_multiprocess(directory: str) -> None:
+    """
+    Make multiprocess metrics (mp_counter, mp_histogram and mp_summary) of this process and all
+    processes forked from it write into given directory.
+
+    The directory should be emptied before the first process starts.
+
+    :param directory: directory shared by all processes
+    :raises OSError: platform is not POSIX
+    """
+    global _directory, _store
+    _check_supported()
+    os.makedirs(directory, exist_ok=True)
+    with _store_lock:
+        _directory = directory
+        if _store is not None:
+            _store.close()
+        _store = None
+
+
+def disable_multiprocess() -> None:
+    """
+    Close the store of current process. Multiprocess metrics will raise RuntimeError until
+    enable_multiprocess() is called again.
+
+    The directory and it's files are left intact.
+    """
+    global _directory, _store
+    with _store_lock:
+        _directory = None
+        if _store is not None:
+            _store.close()
+        _store = None
+
+
+def get_multiprocess_store() -> MultiprocessStore:
+    """
+    Return the store of current process, opening it if necessary
+
+    :raises RuntimeError: enable_multiprocess() was not called
+    """
+    global _store
+    store = _store
+    if store is not None:
+        return store
+    with _store_lock:
+        if _store is None:
+            if _directory is None:
+                raise RuntimeError('Call enable_multiprocess() first')
+            _store = MultiprocessStore(os.path.join(_directory, 'metrics_%s.db' % (os.getpid(),)))
+        return _store
+
+
+def _is_alive(pid: int) -> bool:
+    # POSIX-only, on Windows signal 0 is CTRL_C_EVENT. Guarded by _check_supported()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _sum_files(paths: tp.Iterable[str]) -> tp.Dict[str, float]:
+    values = collections.defaultdict(float)
+    for path in paths:
+        try:
+            file_values = _read_file(path)
+        except FileNotFoundError:  # compacted in the meantime
+            continue
+        for key, value in file_values.items():
+            values[key] += value
+    return values
+
+
+@contextlib.contextmanager
+def _locked(directory: str, exclusive: bool) -> tp.Iterator[None]:
+    """
+    Lock the directory against compaction, or for compaction if exclusive
+
+    :raises OSError: platform is not POSIX
+    """
+    _check_supported()
+    with open(os.path.join(directory, LOCK_FILE_NAME), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def compact_multiprocess(directory: str) -> None:
+    """
+    Merge files of processes that are no longer alive into a single archive file, and delete them.
+
+    This should be called only by a single process, ideally the one that collects the metrics.
+    Concurrent calls to :func:`collect_multiprocess` will wait for it to complete, so that
+    they don't count values of the merged files twice.
+
+    :param directory: directory given to enable_multiprocess()
+    :raises OSError: platform is not POSIX
+    """
+    with _locked(directory, True):
+        _compact(directory)
+
+
+def _compact(directory: str) -> None:
+    dead = []
+    for name in os.listdir(directory):
+        match = _FILE_NAME.match(name)
+        if match and not _is_alive(int(match.group(1))):
+            dead.append(os.path.join(directory, name))
+    if not dead:
+        return
+
+    archive_path = os.path.join(directory, ARCHIVE_FILE_NAME)
+    paths = dead + [archive_path] if os.path.exists(archive_path) else dead
+    values = _sum_files(paths)
+    temporary_path = archive_path + '.tmp'
+    if os.path.exists(temporary_path):
+        os.unlink(temporary_path)
+    store = MultiprocessStore(temporary_path)
+    try:
+        for key, value in values.items():
+            store.add(key, value)
+    finally:
+        store.close()
+    os.replace(temporary_path, archive_path)
+    for path in dead:
+        os.unlink(path)
+
+
+def collect_multiprocess(directory: str) -> MetricDataCollection:
+    """
+    Merge metric data of all processes, including the dead ones.
+
+    Use it as the source of metric data for an exporter, eg. by overloading
+    :meth:`~satella.instrumentation.metrics.exporters.PrometheusHTTPExporterThread.get_metric_data`.
+
+    :param directory: directory given to enable_multiprocess()
+    :return: merged metric data, with fully qualified names
+    :raises OSError: platform is not POSIX
+    """
+    with _locked(directory, False):
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if _FILE_NAME.match(name) or name == ARCHIVE_FILE_NAME]
+        values = _sum_files(paths)
+    output = []
+    sketches = {}  # type: tp.Dict[tuple, tp.Tuple[DDSketch, list]]
+    for encoded_key, value in values.items():
+        kind, name, labels, extra = json.loads(encoded_key)
+        labels = dict(labels)
+        if kind == 'value':
+            output.append(MetricData(name, value, labels))
+        elif kind == 'sketch':
+            relative_accuracy, quantiles, bucket_key = extra
+            sketch_key = name, tuple(labels.items()), relative_accuracy, tuple(quantiles)
+            if sketch_key not in sketches:
+                sketches[sketch_key] = DDSketch(relative_accuracy), labels
+            sketches[sketch_key][0].add_bucket(tuple(bucket_key), int(value))
+
+    for (name, _, _, quantiles), (sketch, labels) in sketches.items():
+        for quantile in quantiles:
+            output.append(MetricData(name, sketch.quantile(quantile),
+                                     {'quantile': quantile, **labels}))
+    return MetricDataCollection(output)
@@ -12,6 +12,14 @@ from ..metric_types.measurable_mixin import MeasurableMixin
 logger = logging.getLogger(__name__)
 
 
+def _count_hits_and_misses(cache: CacheDict, keys: tp.List[K]) -> None:
+    hits = sum(1 for key in keys if cache.has_info_about(key))
+    if hits and cache.cache_hits:
+        cache.cache_hits.runtime(hits)
+    if hits < len(keys) and cache.cache_miss:
+        cache.cache_miss.runtime(len(keys) - hits)
+
+
 class MetrifiedCacheDict(CacheDict[K, V]):
     """
     A CacheDict with metrics!
@@ -20,6 +28,9 @@ class MetrifiedCacheDict(CacheDict[K, V]):
     :param cache_miss: a counter metric that will be updated with +1 each time there's a cache miss
     :param refreshes: a metric that will be updated with +1 each time there's a cache refresh
     :param how_long_refresh_takes: a metric that will be ticked with time value_getter took
+
+    Calls to value_getter_many count as a refresh per key requested, and get_many() counts a hit
+    or a miss per key.
     """
 
     def __init__(self, stale_interval, expiration_interval, value_getter,
@@ -29,7 +40,9 @@ class MetrifiedCacheDict(CacheDict[K, V]):
                  cache_hits: tp.Optional[CounterMetric] = None,
                  cache_miss: tp.Optional[CounterMetric] = None,
                  refreshes: tp.Optional[CounterMetric] = None,
-                 how_long_refresh_takes: tp.Optional[MeasurableMixin] = None):
+                 how_long_refresh_takes: tp.Optional[MeasurableMixin] = None,
+                 value_getter_many=None,
+                 **kwargs):
         if refreshes:
             old_value_getter = value_getter
 
@@ -45,9 +58,26 @@ class MetrifiedCacheDict(CacheDict[K, V]):
         if how_long_refresh_takes:
             value_getter = how_long_refresh_takes.measure(value_getter=time_getter)(value_getter)
 
+        if value_getter_many is not None:
+            if refreshes:
+                old_value_getter_many = value_getter_many
+
+                def value_getter_many_replacement(items):
+                    try:
+                        return old_value_getter_many(items)
+                    finally:
+                        if self.refreshes:
+                            self.refreshes.runtime(len(items))
+
+                value_getter_many = value_getter_many_replacement
+
+            if how_long_refresh_takes:
+                value_getter_many = how_long_refresh_takes.measure(value_getter=time_getter)(
+                    value_getter_many)
+
         super().__init__(stale_interval, expiration_interval, value_getter,
                          value_getter_executor, cache_failures_interval, time_getter,
-                         default_value_factory)
+                         default_value_factory, value_getter_many, **kwargs)
         self.cache_hits = cache_hits
         self.cache_miss = cache_miss
         self.refreshes = refreshes
@@ -62,6 +92,11 @@ class MetrifiedCacheDict(CacheDict[K, V]):
                 self.cache_miss.runtime(+1)
         return super().__getitem__(item)
 
+    def get_many(self, keys: tp.Iterable[K]) -> tp.Dict[K, V]:
+        keys = list(keys)
+        _count_hits_and_misses(self, keys)
+        return super().get_many(keys)
+
 
 class MetrifiedLRUCacheDict(LRUCacheDict[K, V]):
     """
@@ -71,6 +106,9 @@ class MetrifiedLRUCacheDict(LRUCacheDict[K, V]):
     :param cache_miss: a counter metric that will be updated with +1 each time there's a cache miss
     :param refreshes: a metric that will be updated with +1 each time there's a cache refresh
     :param how_long_refresh_takes: a metric that will be ticked with time value_getter took
+
+    Calls to value_getter_many count as a refresh per key requested, and get_many() counts a hit
+    or a miss per key.
     """
 
     def __init__(self, stale_interval: float, expiration_interval: float,
@@ -84,6 +122,7 @@ class MetrifiedLRUCacheDict(LRUCacheDict[K, V]):
                  refreshes: tp.Optional[Metric] = None,
                  how_long_refresh_takes: tp.Optional[MeasurableMixin] = None,
                  evictions: tp.Optional[Metric] = None,
+                 value_getter_many=None,
                  **kwargs):
         if refreshes:
             old_value_getter = value_getter
@@ -100,9 +139,27 @@ class MetrifiedLRUCacheDict(LRUCacheDict[K, V]):
         if how_long_refresh_takes:
             value_getter = how_long_refresh_takes.measure(value_getter=time_getter)(value_getter)
 
+        if value_getter_many is not None:
+            if refreshes:
+                old_value_getter_many = value_getter_many
+
+                def value_getter_many_replacement(items):
+                    try:
+                        return old_value_getter_many(items)
+                    finally:
+                        if self.refreshes:
+                            self.refreshes.runtime(len(items))
+
+                value_getter_many = value_getter_many_replacement
+
+            if how_long_refresh_takes:
+                value_getter_many = how_long_refresh_takes.measure(value_getter=time_getter)(
+                    value_getter_many)
+
         super().__init__(stale_interval, expiration_interval, value_getter,
                          value_getter_executor, cache_failures_interval, time_getter,
-                         default_value_factory, max_size=max_size)
+                         default_value_factory, value_getter_many, max_size=max_size,
+                         **kwargs)
         self.cache_hits = cache_hits
         self.cache_miss = cache_miss
         self.refreshes = refreshes
@@ -123,6 +180,11 @@ class MetrifiedLRUCacheDict(LRUCacheDict[K, V]):
                 self.cache_miss.runtime(+1)
         return super().__getitem__(item)
 
+    def get_many(self, keys: tp.Iterable[K]) -> tp.Dict[K, V]:
+        keys = list(keys)
+        _count_hits_and_misses(self, keys)
+        return super().get_many(keys)
+
 
 class MetrifiedExclusiveWritebackCache(ExclusiveWritebackCache[K, V]):
     __slots__ = ('cache_miss', 'cache_hits')
@@ -136,7 +198,7 @@ class MetrifiedExclusiveWritebackCache(ExclusiveWritebackCache[K, V]):
         self.cache_miss = cache_miss
         self.cache_hits = cache_hits
         if entries_waiting is not None:
-            entries_waiting.callable = self.get_queue_length()
+            entries_waiting.callable = self.get_queue_length
 
     def __getitem__(self, item):
         if item in self.in_cache:
@@ -2,6 +2,9 @@ import abc
 import collections
 import copy
 import math
+import os
+import tempfile
+import threading
 import time
 import unittest
 from enum import Enum
@@ -11,11 +14,14 @@ from satella.coding.concurrent import call_in_separate_thread
 from satella.coding.structures import TimeBasedHeap, Heap, typednamedtuple, \
     OmniHashableMixin, DictObject, apply_dict_object, Immutable, frozendict, SetHeap, \
     DictionaryView, HashableWrapper, TwoWayDictionary, Ranking, SortedList, SliceableDeque, \
-    DirtyDict, KeyAwareDefaultDict, Proxy, ReprableMixin, TimeBasedSetHeap, ExpiringEntryDict, SelfCleaningDefaultDict, \
-    CacheDict, StrEqHashableMixin, ComparableIntEnum, HashableIntEnum, ComparableAndHashableBy, \
-    ComparableAndHashableByInt, SparseMatrix, ExclusiveWritebackCache, Subqueue, \
-    CountingDict, ComparableEnum, LRU, LRUCacheDict, Vector, DefaultDict, PushIterable, \
-    ComparableAndHashableByStr, NotEqualToAnything, NOT_EQUAL_TO_ANYTHING, DictionaryEQAble, SetZip, OnStrOnlyName
+    DirtyDict, KeyAwareDefaultDict, Proxy, ReprableMixin, TimeBasedSetHeap, ExpiringEntryDict, \
+    SelfCleaningDefaultDict, CacheDict, StrEqHashableMixin, ComparableIntEnum, HashableIntEnum, \
+    ComparableAndHashableBy, ComparableAndHashableByInt, SparseMatrix, ExclusiveWritebackCache, \
+    Subqueue, CountingDict, ComparableEnum, LRU, LRUCacheDict, TinyLFUCacheDict, \
+    TwoTierCacheDict, CountMinSketch, Vector, DefaultDict, PushIterable, \
+    ComparableAndHashableByStr, NotEqualToAnything, NOT_EQUAL_TO_ANYTHING, DictionaryEQAble, \
+    SetZip, OnStrOnlyName
+from satella.coding.structures.dictionaries.expiring import ExpiringEntryDictThread
 
 
 def continue_testing_omni(self, omni_class):
@@ -150,6 +156,59 @@ class TestStructures(unittest.TestCase):
         self.assertEqual(cd[4], 2)
         self.assertEqual(len(cd), 3)
 
+    def test_lru_cache_dict_weight(self):
+        cd = LRUCacheDict(1, 2, lambda key: 'x' * key, max_size=100,
+                          weigher=lambda key, value: len(value), max_weight=10)
+        self.assertEqual(cd[4], 'xxxx')
+        self.assertEqual(cd[5], 'xxxxx')
+        self.assertEqual(cd.total_weight, 9)
+        cd[4]
+        self.assertEqual(cd[3], 'xxx')    # evicts 5
+        self.assertEqual(set(cd), {3, 4})
+        self.assertEqual(cd.total_weight, 7)
+        self.assertEqual(cd[20], 'x' * 20)    # too heavy to be stored
+        self.assertEqual(len(cd), 0)
+        self.assertEqual(len(cd.lru), 0)
+        self.assertEqual(cd.total_weight, 0)
+        cd.feed(2, 'xx')
+        cd.invalidate(2)
+        self.assertEqual(cd.total_weight, 0)
+
+        cd = LRUCacheDict(1, 2, lambda key: b'x' * key, max_weight=1000)
+        cd[500]
+        cd[600]
+        self.assertEqual(set(cd), {600})
+
+    def test_tinylfu_cache_dict(self):
+        def run(cache):
+            for _ in range(20):
+                for key in range(50):     # the hot set
+                    cache[key]
+            for key in range(1000, 2000):    # a scan
+                cache[key]
+            cache.hits = cache.misses = 0
+            for key in range(50):
+                cache[key]
+            return cache.hit_ratio
+
+        self.assertEqual(run(LRUCacheDict(10, 20, lambda key: key, max_size=100)), 0)
+        cd = TinyLFUCacheDict(10, 20, lambda key: key, max_size=100)
+        self.assertGreater(run(cd), 0.9)
+        self.assertLessEqual(len(cd), 100)
+        self.assertEqual(len(cd), len(cd.policy))
+        del cd[10]
+        self.assertEqual(len(cd), len(cd.policy))
+
+    def test_count_min_sketch(self):
+        sketch = CountMinSketch(64, 1000)
+        for _ in range(10):
+            sketch.increment('a')
+        sketch.increment('b')
+        self.assertEqual(sketch.estimate('a'), 10)
+        self.assertGreaterEqual(sketch.estimate('b'), 1)
+        sketch.age()
+        self.assertEqual(sketch.estimate('a'), 5)
+
     def test_lru(self):
         lru = LRU()
         lru.add('a')
@@ -226,7 +285,100 @@ class TestStructures(unittest.TestCase):
         wbc.sync()
         self.assertRaises(KeyError, lambda: a[4])
 
-    def test_sparse_matrix(self):
+    def test_exclusive_writeback_cache_coalesce(self):
+        a = {}
+        batches = []
+
+        def write_many(values):
+            batches.append(values)
+            a.update(values)
+
+        def delete_many(keys):
+            batches.append(keys)
+            for key in keys:
+                del a[key]
+
+        wbc = ExclusiveWritebackCache(None, a.__getitem__, coalesce=True, flush_interval=0.2,
+                                      write_many=write_many, delete_many=delete_many)
+        for i in range(1000):
+            wbc[1] = i
+        wbc[2] = 2
+        self.assertEqual(wbc.get_queue_length(), 2)
+        time.sleep(0.5)
+        self.assertEqual(batches, [{1: 999, 2: 2}])
+        self.assertEqual(wbc.get_queue_length(), 0)
+        del wbc[2]
+        wbc.sync()
+        self.assertEqual(a, {1: 999})
+        self.assertEqual(batches[1], [2])
+
+        written = []
+
+        def write_method(key, value):
+            time.sleep(0.01)
+            written.append(key)
+
+        wbc = ExclusiveWritebackCache(write_method, a.__getitem__, coalesce=True,
+                                      flush_interval=10, flush_size=5, max_dirty=10)
+        for i in range(50):
+            wbc[i] = i
+            self.assertLessEqual(wbc.get_queue_length(), 10)
+        wbc.sync()
+        self.assertEqual(sorted(written), list(range(50)))
+
+    def test_exclusive_writeback_cache_coalesce_failure(self):
+        a = {1: 1, 2: 2}
+        fail = [True]
+
+        def write_many(values):
+            if fail[0]:
+                raise IOError('backend down')
+            a.update(values)
+
+        def delete_method(key):
+            del a[key]
+
+        wbc = ExclusiveWritebackCache(None, a.__getitem__, delete_method, coalesce=True,
+                                      flush_interval=10, write_many=write_many,
+                                      store_key_errors=False)
+        wbc[1] = 5
+        del wbc[2]
+        self.assertRaises(IOError, wbc.flush)
+        self.assertEqual(a, {1: 1, 2: 2})
+        self.assertEqual(wbc.get_queue_length(), 2)
+        self.assertEqual(wbc[1], 5)
+        self.assertRaises(KeyError, lambda: wbc[2])
+        wbc[1] = 6
+        fail[0] = False
+        wbc.sync()
+        self.assertEqual(a, {1: 6})
+        self.assertEqual(wbc.get_queue_length(), 0)
+        self.assertRaises(KeyError, lambda: wbc[2])
+
+    def test_exclusive_writeback_cache_failure_back_off(self):
+        calls = []
+        fail = [True]
+
+        def write_many(values):
+            calls.append(values)
+            if fail[0]:
+                raise IOError('backend down')
+
+        self.assertRaises(ValueError, ExclusiveWritebackCache, None, None, coalesce=True,
+                          max_dirty=0)
+        wbc = ExclusiveWritebackCache(None, None, coalesce=True, flush_interval=0.2,
+                                      max_dirty=1, write_many=write_many)
+        wbc[1] = 1
+        writer = threading.Thread(target=wbc.__setitem__, args=(2, 2))
+        writer.start()
+        time.sleep(1)
+        self.assertLess(len(calls), 10)
+        fail[0] = False
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        wbc.sync()
+        self.assertEqual(calls[-1], {2: 2})
+
         sm = SparseMatrix()
         sm[1, 2] = 1
         sm[0, 0] = 2
@@ -493,6 +645,140 @@ class TestStructures(unittest.TestCase):
         cd.feed(5, 6)
         self.assertEqual(cd[5], 6)
 
+    def test_cache_dict_single_flight(self):
+        calls = []
+
+        def value_getter(key):
+            calls.append(key)
+            time.sleep(0.5)
+            return key * 2
+
+        cd = LRUCacheDict(1, 2, value_getter, max_size=3)
+        threads = [call_in_separate_thread()(lambda: cd[2])() for _ in range(10)]
+        self.assertEqual([thread.result(timeout=5) for thread in threads], [4] * 10)
+        self.assertEqual(calls, [2])
+        self.assertFalse(cd.in_flight)
+
+        cd = CacheDict(0, 2, value_getter)
+        cd.feed(3, 6)
+        futures = {id(cd.schedule_a_fetch(3)) for _ in range(10)}
+        self.assertEqual(len(futures), 1)
+        self.assertEqual(cd.get_value_block(3), 6)
+        self.assertEqual(calls, [2, 3])
+
+    def test_cache_dict_get_many(self):
+        calls = []
+
+        def value_getter_many(keys):
+            calls.append(sorted(keys))
+            return {key: key * 2 for key in keys if key != 5}
+
+        def value_getter(key):
+            raise AssertionError('should not be called')
+
+        cd = CacheDict(1, 2, value_getter, cache_failures_interval=2,
+                       value_getter_many=value_getter_many)
+        cd.feed(1, 3)
+        self.assertEqual(cd.get_many([1, 2, 3, 5]), {1: 3, 2: 4, 3: 6})
+        self.assertEqual(calls, [[2, 3, 5]])
+        self.assertEqual(cd[2], 4)
+        self.assertRaises(KeyError, lambda: cd[5])
+        self.assertEqual(cd.get_many([2, 5]), {2: 4})
+        self.assertEqual(len(calls), 1)
+
+        time.sleep(1.2)
+        self.assertEqual(cd.get_many([1, 2, 3]), {1: 3, 2: 4, 3: 6})
+        time.sleep(0.2)
+        self.assertEqual(calls[1], [1, 2, 3])
+        self.assertEqual(cd[1], 2)
+
+        cd = LRUCacheDict(1, 2, value_getter, value_getter_many=value_getter_many,
+                          default_value_factory=lambda: None, max_size=2)
+        self.assertEqual(cd.get_many([4, 5, 6]), {4: 8, 5: None, 6: 12})
+        self.assertLessEqual(len(cd), 2)
+
+        cd.value_getter_executor.shutdown()
+        self.assertRaises(RuntimeError, cd.get_many, [7])
+        self.assertFalse(cd.in_flight)
+
+    def test_cache_dict_sweep(self):
+        now = [0]
+        calls = []
+
+        def value_getter(key):
+            calls.append(key)
+            if key < 0:
+                raise KeyError(key)
+            return key
+
+        cd = CacheDict(10, 20, value_getter, cache_failures_interval=5,
+                       time_getter=lambda: now[0], refresh_ahead=8, sweep_batch_size=2)
+        for key in range(4):
+            cd.feed(key, key)
+        self.assertEqual(cd.get_many([0, -1]), {0: 0})
+        now[0] = 9
+        self.assertEqual(cd.sweep(), 1)
+        self.assertEqual(cd.sweep(), 0)
+        self.assertEqual(cd.sweep(), 0)
+        time.sleep(0.2)
+        self.assertEqual(sorted(calls), [-1, 0])
+        self.assertEqual(set(cd.timestamp_data), {0, 1, 2, 3})
+        now[0] = 25
+        self.assertEqual(cd.sweep(10), 3)
+        self.assertEqual(list(cd), [0])
+
+    def test_cache_dict_jitter(self):
+        now = [0]
+        cd = CacheDict(10, 20, lambda key: key, time_getter=lambda: now[0], jitter=0.5)
+        for key in range(100):
+            cd.feed(key, key)
+        now[0] = 7.5
+        cd.get_many(range(100))
+        time.sleep(0.2)
+        refreshed = sum(cd.timestamp_data[key] == now[0] for key in range(100))
+        self.assertGreater(refreshed, 20)
+        self.assertLess(refreshed, 80)
+
+    def test_two_tier_cache_dict(self):
+        calls = []
+
+        def value_getter(key):
+            calls.append(key)
+            return key * 2
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            with TwoTierCacheDict(10, 20, value_getter, max_size=2, path=path) as cd:
+                for key in range(4):
+                    self.assertEqual(cd[key], key * 2)
+                self.assertEqual(len(cd), 2)
+                self.assertEqual(cd[0], 0)
+                self.assertEqual(cd.get_many([1, 2]), {1: 2, 2: 4})
+                self.assertEqual(calls, [0, 1, 2, 3])
+                cd.invalidate(3)
+
+            with TwoTierCacheDict(10, 20, value_getter, max_size=10, path=path) as cd:
+                self.assertEqual(cd[0], 0)
+                self.assertEqual(cd[3], 6)
+                self.assertEqual(calls, [0, 1, 2, 3, 3])
+
+            with TwoTierCacheDict(0, 0.1, value_getter, max_size=10, path=path) as cd:
+                time.sleep(0.2)
+                self.assertEqual(cd.sweep(), 4)
+                self.assertEqual(cd[1], 2)
+                self.assertEqual(calls, [0, 1, 2, 3, 3, 1])
+
+    def test_two_tier_cache_dict_closed_sweep(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'cache.db')
+            with TwoTierCacheDict(10, 20, lambda key: key, max_size=2, path=path,
+                                  sweep_in_background=True) as cd:
+                self.assertEqual(cd[1], 1)
+            cd.cleanup()
+            cd.close()
+            self.assertEqual(cd.sweep(), 0)
+            ExpiringEntryDictThread().cleanup()
+
     def test_cache_dict_default_value_factory(self):
         class TestCacheGetter:
             def __call__(self, key):
@@ -811,6 +1097,47 @@ class TestStructures(unittest.TestCase):
         item = tbh.pop_timestamp(30)
         self.assertTrue(item == 'kota' or item == 'ala')
 
+    def test_tbsh_pop_item(self):
+        tbh = TimeBasedSetHeap()
+        for i in range(100):
+            tbh.put(100 - i, i)
+        tbh.put(0, 50)
+        tbh.put(200, 10)
+        self.assertEqual(tbh.pop_item(20), (80, 20))
+        self.assertRaises(ValueError, lambda: tbh.pop_item(20))
+        self.assertEqual(tbh.pop_timestamp(30), 70)
+        self.assertRaises(ValueError, lambda: tbh.pop_timestamp(30))
+        tbh.remove(99)
+        self.assertEqual(tbh.pop(), (0, 50))
+        self.assertEqual(tbh.get_timestamp(10), 200)
+        popped = list(tbh.pop_less_than(1000))
+        self.assertEqual(len(popped), 96)
+        self.assertEqual(popped, sorted(popped))
+        self.assertEqual(popped[-1], (200, 10))
+
+    def test_tbsh_list_mutators(self):
+        tbh = TimeBasedSetHeap()
+        tbh.append((30, 'a'))
+        tbh.extend([(20, 'b'), (40, 'a')])
+        tbh += [(10, 'c')]
+        self.assertEqual(len(tbh), 3)
+        self.assertEqual(tbh.get_timestamp('a'), 40)
+        self.assertRaises(TypeError, lambda: tbh.__setitem__(0, (5, 'd')))
+        self.assertRaises(TypeError, lambda: tbh.__delitem__(0))
+        self.assertRaises(TypeError, lambda: tbh.insert(0, (5, 'd')))
+        self.assertRaises(TypeError, tbh.sort)
+        self.assertEqual(list(tbh.pop_less_than(100)), [(10, 'c'), (20, 'b'), (40, 'a')])
+        tbh.put(10, 'c')
+        tbh.clear()
+        self.assertFalse(tbh)
+        self.assertRaises(ValueError, lambda: tbh.pop_item('c'))
+
+    def test_heap_pop_item(self):
+        heap = Heap(range(100))
+        for i in range(0, 100, 3):
+            heap.pop_item(i)
+        self.assertEqual(list(heap.iter_ascending()), [i for i in range(100) if i % 3])
+
     def test_tbh(self):
         tbh = TimeBasedHeap()
 
@@ -1,13 +1,16 @@
 import logging
+import socket
 import time
 import unittest
 
 import requests
 
 from satella.instrumentation.metrics import MetricData, MetricDataCollection
-from satella.instrumentation.metrics import getMetric
+from satella.instrumentation.metrics import getMetric, MetricLevel
 from satella.instrumentation.metrics.exporters import metric_data_collection_to_prometheus, \
-    PrometheusHTTPExporterThread
+    PrometheusHTTPExporterThread, PrometheusRenderCache, PushExporterThread, \
+    metric_data_to_graphite, metric_data_to_statsd
+from satella.instrumentation.metrics.exporters.push import pack_lines
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +32,54 @@ class TestExporters(unittest.TestCase):
         b = metric_data_collection_to_prometheus(a)
         self.assertIn("""root_metric{k="4"} 6""", b)
 
+    def test_render_cache(self):
+        cache = PrometheusRenderCache({'service': 'my_service'})
+        a = MetricDataCollection([MetricData('root.metric', 3, {'k': 2, 'm': '"'}),
+                                  MetricData('root.metric', 6, {'k': 4}),
+                                  MetricData('root.internal', 6, internal=True)])
+        b = cache.render(a)
+        self.assertIn('root_metric{k="4",service="my_service"} 6\n', b)
+        self.assertIn('root_metric{k="2",m="\\"",service="my_service"} 3\n', b)
+        self.assertNotIn('internal', b)
+
+        a = MetricDataCollection([MetricData('root.metric', 3, {'k': 2, 'm': '"'}),
+                                  MetricData('root.metric', 7.0, {'k': 4}, 10)])
+        b = cache.render(a)
+        self.assertIn('root_metric{k="4",service="my_service"} 7.0 10000\n', b)
+        self.assertIn('root_metric{k="2",m="\\"",service="my_service"} 3\n', b)
+        self.assertEqual(len(cache.series), 2)
+
+        self.assertEqual(cache.render(MetricDataCollection()), '\n')
+        self.assertEqual(len(cache.series), 0)
+
+    def test_render_cache_openmetrics(self):
+        cache = PrometheusRenderCache(openmetrics=True)
+        a = MetricDataCollection([MetricData('root.metric', 3, {'k': 'a\nb'}),
+                                  MetricData('root.other', float('-inf')),
+                                  MetricData('root.metric', 6, {'ge': float('inf')})])
+        lines = cache.render(a).splitlines()
+        self.assertEqual(set(lines), {'# TYPE root_metric unknown', 'root_metric{k="a\\nb"} 3',
+                                      'root_metric{ge="+Inf"} 6', '# TYPE root_other unknown',
+                                      'root_other -Inf', '# EOF'})
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[-1], '# EOF')
+        family = None
+        for line in lines[:-1]:
+            if line.startswith('# TYPE '):
+                family = line.split()[2]
+            else:
+                self.assertEqual(line.partition('{')[0].split()[0], family)
+
+    def test_prefix_respects_levels(self):
+        getMetric('').reset()
+        getMetric('leveled', 'base', MetricLevel.DEBUG)
+        getMetric('leveled.metric', 'int').runtime(5)
+        exporter = PrometheusHTTPExporterThread('localhost', 1027)
+        self.assertFalse(exporter.get_metric_data_for_prefix('leveled.metric').values)
+        getMetric('leveled').level = MetricLevel.RUNTIME
+        md, = exporter.get_metric_data_for_prefix('leveled.metric').values
+        self.assertEqual(md.value, 5)
+
     def test_exporter_http_server(self):
         with PrometheusHTTPExporterThread('localhost', 1025):
             metr = getMetric('test.metric', 'int')
@@ -39,3 +90,113 @@ class TestExporters(unittest.TestCase):
             self.assertIn('test_metric 5', data.text)
             data2 = requests.get('http://localhost:1025/404')
             self.assertEqual(404, data2.status_code)
+
+    def test_exporter_http_server_threaded(self):
+        with PrometheusHTTPExporterThread('localhost', 1026, threaded=True):
+            getMetric('test.subtree.metric', 'int').runtime(5)
+            getMetric('test.other', 'int').runtime(6)
+            time.sleep(0.5)
+            data = requests.get('http://localhost:1026/metrics?prefix=test.subtree',
+                                headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(200, data.status_code)
+            self.assertEqual('gzip', data.headers['Content-Encoding'])
+            self.assertIn('Accept-Encoding', data.headers['Vary'])
+            self.assertIn('test_subtree_metric 5', data.text)
+            self.assertNotIn('test_other', data.text)
+
+            data = requests.get('http://localhost:1026/metrics',
+                                headers={'Accept': 'application/openmetrics-text; version=1.0.0',
+                                         'Accept-Encoding': 'identity'})
+            self.assertNotIn('Content-Encoding', data.headers)
+            self.assertTrue(data.headers['Content-Type'].startswith('application/openmetrics-text'))
+            self.assertIn('test_other 6', data.text)
+            self.assertTrue(data.text.endswith('# EOF\n'))
+
+            data = requests.get('http://localhost:1026/metrics?prefix=does.not.exist')
+            self.assertEqual(404, data.status_code)
+
+    def test_statsd_and_graphite_format(self):
+        md = MetricData('root.metric', 3, {'k': 2})
+        self.assertEqual(metric_data_to_statsd(md, {'service': 'a'}),
+                         'root.metric:3|g|#k:2,service:a')
+        self.assertEqual(metric_data_to_graphite(md, timestamp=10), 'root.metric;k=2 3 10')
+        self.assertEqual(metric_data_to_graphite(MetricData('a', 1.5, timestamp=20)), 'a 1.5 20')
+
+    def test_statsd_and_graphite_escaping(self):
+        md = MetricData('root.metric', 3, {'path': '/a:b,c|d#e\nf', 'agent': 'x;y=z w\tv'})
+        self.assertEqual(metric_data_to_statsd(md),
+                         'root.metric:3|g|#path:/a_b_c_d_e_f,agent:x;y=z w\tv')
+        self.assertEqual(metric_data_to_graphite(md, timestamp=10),
+                         'root.metric;path=/a:b,c|d#e_f;agent=x_y_z_w_v 3 10')
+
+    def test_pack_lines(self):
+        packets = list(pack_lines([b'aaaa', b'bbbb', b'cccc', b'dddddddddddd'], 9))
+        self.assertEqual(packets, [b'aaaa\nbbbb', b'cccc', b'dddddddddddd'])
+
+    def test_push_exporter_udp(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        for i in range(100):
+            getMetric('push.metric%s' % (i,), 'int').runtime(i)
+        with PushExporterThread('127.0.0.1', sock.getsockname()[1], interval=60,
+                                max_packet_size=512):
+            pass
+        lines = []
+        while len(lines) < 100:
+            packet = sock.recv(65536)
+            self.assertLessEqual(len(packet), 512)
+            lines.extend(packet.decode('utf8').split('\n'))
+        sock.close()
+        self.assertIn('push.metric5:5|g', lines)
+
+    @unittest.skipUnless(socket.has_ipv6, 'IPv6 not supported')
+    def test_push_exporter_udp_ipv6(self):
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        try:
+            sock.bind(('::1', 0))
+        except OSError:
+            sock.close()
+            self.skipTest('IPv6 loopback not available')
+        sock.settimeout(5)
+        getMetric('push.ipv6', 'int').runtime(3)
+        with PushExporterThread('::1', sock.getsockname()[1], interval=60):
+            pass
+        lines = []
+        while 'push.ipv6:3|g' not in lines:
+            lines.extend(sock.recv(65536).decode('utf8').split('\n'))
+        sock.close()
+
+    def test_push_exporter_skips_non_numeric(self):
+        exporter = PushExporterThread('127.0.0.1', 1, extra_labels={'service': 'a'})
+        mdc = MetricDataCollection(MetricData('string', 'value'), MetricData('int', 2),
+                                   MetricData('internal', 2, internal=True))
+        self.assertEqual(exporter.render(mdc), [b'int:2|g|#service:a'])
+
+    def test_push_exporter_tcp_back_pressure(self):
+        getMetric('').reset()
+        getMetric('push.metric', 'int').runtime(5)
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        port = server.getsockname()[1]
+        server.close()
+
+        exporter = PushExporterThread('127.0.0.1', port, protocol='graphite', transport='tcp',
+                                      max_pending_lines=2)
+        exporter.flush()
+        exporter.flush()
+        exporter.flush()
+        self.assertEqual(len(exporter.pending), 2)
+        self.assertEqual(exporter.lines_dropped, 1)
+
+        server = socket.socket()
+        server.bind(('127.0.0.1', port))
+        server.listen(1)
+        exporter.flush()
+        self.assertEqual(len(exporter.pending), 0)
+        conn, _ = server.accept()
+        conn.settimeout(5)
+        self.assertIn(b'push.metric 5 ', conn.recv(65536))
+        conn.close()
+        server.close()
+        exporter._close()
@@ -1,7 +1,7 @@
 import logging
 import unittest
 
-from satella.instrumentation.metrics.data import MetricData, MetricDataCollection
+from satella.instrumentation.metrics.data import MetricData, MetricDataCollection, intern_labels
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +24,26 @@ class TestMetricData(unittest.TestCase):
         a.add_labels({'service': 'wtf'})
         self.assertEqual(next(iter(a.values)).labels, {'labels': 'key', 'service': 'wtf'})
 
+    def test_intern_labels(self):
+        self.assertIs(intern_labels({'a': 1}), intern_labels({'a': 1}))
+        self.assertIsNot(intern_labels({'a': 1}), intern_labels({'a': 1.0}))
+        self.assertEqual(intern_labels({'a': [1]}), {'a': [1]})
+        self.assertIs(MetricData('a', 1, {'k': 'v'}).labels, MetricData('b', 2, {'k': 'v'}).labels)
+
+    def test_prefix_keeps_hashes_correct(self):
+        a = MetricDataCollection(MetricData('root', 3, {'a': 5}), MetricData('root.sum', 3))
+        a.prefix_with('test')
+        self.assertIn(MetricData('test.root', 3, {'a': 5}), a.values)   # found by it's hash
+        self.assertTrue(MetricDataCollection(MetricData('test.root', 3, {'a': 5}),
+                                             MetricData('test.root.sum', 3)).strict_eq(a))
+        a.postfix_with('total')
+        self.assertIn(MetricData('test.root.sum.total', 3), a.values)
+        self.assertTrue(MetricDataCollection(MetricData('test.root.total', 3, {'a': 5}),
+                                             MetricData('test.root.sum.total', 3)).strict_eq(a))
+        a += MetricData('test.root.total', 4, {'a': 5})
+        self.assertEqual(len(a.values), 2)
+        self.assertEqual(next(v for v in a.values if v.labels).value, 4)
+
     def test_json_serialization(self):
         a = MetricDataCollection(MetricData('root', 2, {'labels': 'key'}))
         b = a.to_json()
@@ -1,14 +1,22 @@
+import asyncio
 import inspect
 import logging
+import math
+import threading
 import time
+import typing as tp
 import unittest
+from unittest import mock
 
 from satella.coding.sequences import n_th
 from satella.coding.transforms import is_subset
 
 from satella.exceptions import MetricAlreadyExists
+from satella.instrumentation import metrics
 from satella.instrumentation.metrics import getMetric, MetricLevel, MetricData, \
     MetricDataCollection, AggregateMetric, LabeledMetric
+from satella.instrumentation.metrics.metric_types.sketch import DDSketch
+from satella.instrumentation.metrics.metric_types.callable import _timed_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +32,19 @@ def choose(postfix: str, mdc: MetricDataCollection, labels=None) -> MetricData:
             return child
 
 
+def to_dict(mdc: MetricDataCollection) -> dict:
+    return {md.name: md.value for md in mdc.values}
+
+
+def value_of(mdc: MetricDataCollection, name: str, labels: tp.Optional[dict] = None):
+    """Return the value of a series, since MetricData's equality ignores values"""
+    labels = labels or {}
+    for md in mdc.values:
+        if md.name == name and md.labels == labels:
+            return md.value
+    raise KeyError('%s %s not found' % (name, labels))
+
+
 class TestMetric(unittest.TestCase):
 
     def test_child_metrics(self):
@@ -70,6 +91,44 @@ class TestMetric(unittest.TestCase):
         callable_ = getMetric('callable', 'callable', value_getter=lambda: 5.0)
         self.assertEqual(list(callable_.to_metric_data().values)[0].value, 5.0)
 
+    def test_callable_timeout(self):
+        values = [1]
+
+        def slow():
+            time.sleep(1)
+            return values[0]
+
+        slow_metric = getMetric('callable.slow', 'callable', value_getter=slow, timeout=0.2)
+        getMetric('callable.slow2', 'callable', value_getter=slow, timeout=0.2)
+        fast_metric = getMetric('callable.fast', 'callable', value_getter=lambda: 5, timeout=0.2)
+        # registered up front, not in the middle of a scrape
+        slow_callables = metrics.metrics_by_type['satella.metrics.slow_callables', 'counter']
+        started = time.monotonic()
+        data = getMetric('callable').to_metric_data()
+        self.assertLess(time.monotonic() - started, 0.6)
+        self.assertEqual(to_dict(data), {'callable.fast': 5})
+        slow_data = slow_callables.to_metric_data()
+        self.assertEqual(choose('slow_callables', slow_data, {'metric': 'callable.slow'}).value, 1)
+        self.assertTrue(all(md.internal for md in slow_data.values))
+
+        time.sleep(1)
+        values[0] = 2
+        self.assertEqual(to_dict(slow_metric.to_metric_data()), {'slow': 1})
+        time.sleep(1)
+        self.assertEqual(to_dict(slow_metric.to_metric_data()), {'slow': 2})
+        self.assertEqual(to_dict(fast_metric.to_metric_data()), {'fast': 5})
+
+        getMetric('').reset()
+        self.assertFalse(_timed_metrics)
+
+    def test_callable_ttl(self):
+        calls = []
+        callable_ = getMetric('callable', 'callable', value_getter=lambda: calls.append(1) or
+                              len(calls), ttl=60)
+        self.assertEqual(list(callable_.to_metric_data().values)[0].value, 1)
+        self.assertEqual(list(callable_.to_metric_data().values)[0].value, 1)
+        self.assertEqual(len(calls), 1)
+
     def test_linkfail(self):
         d = {'online': False, 'offline': False}
 
@@ -125,10 +184,65 @@ class TestMetric(unittest.TestCase):
         self.assertEqual(choose('total.sum', metric_data).value, 3.6)
         self.assertEqual(choose('total.count', metric_data).value, 2)
 
+    def test_histogram_sharded(self):
+        metric = getMetric('test_histogram', 'histogram', sharded=True)
+
+        def run():
+            for _ in range(500):
+                metric.runtime(1, label='value')
+                metric.runtime(2.6, label='value')
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        metric_data = metric.to_metric_data()
+        self.assertEqual(choose('', metric_data, {'le': 1.0, 'ge': 2.5, 'label': 'value'}).value,
+                         2000)
+        self.assertEqual(choose('count', metric_data, {'label': 'value'}).value, 4000)
+        self.assertEqual(choose('total', metric_data, {'le': 1.0, 'ge': 2.5}).value, 2000)
+        self.assertAlmostEqual(choose('total.sum', metric_data).value, 7200.0)
+        self.assertEqual(choose('total.count', metric_data).value, 4000)
+
+    def test_histogram_handle_many(self):
+        values = [0.001, 0.01, 0.3, 1, 2.5, 2.6, 100, -1]
+        for numpy_module in ('default', None):
+            with self.subTest(numpy=numpy_module):
+                getMetric('').reset()
+                single = getMetric('test_histogram_single', 'histogram')
+                batch = getMetric('test_histogram_batch', 'histogram')
+                for value in values:
+                    single.runtime(value, label='value')
+                if numpy_module is None:
+                    with mock.patch(
+                            'satella.instrumentation.metrics.metric_types.histogram.numpy', None):
+                        batch.handle_many(values, label='value')
+                else:
+                    batch.handle_many(values, label='value')
+                batch.handle_many(values, logging_level=MetricLevel.DEBUG, label='value')
+                self.assertEqual(single.get_state(), batch.get_state())
+                self.assertEqual(single.get_child({'label': 'value'}).get_state(),
+                                 batch.get_child({'label': 'value'}).get_state())
+
     def test_empty(self):
         metric = getMetric('empty', 'empty')
         self.assertEqual(len(metric.to_metric_data().values), 0)
 
+    def test_get_metric_fast_path(self):
+        metric = getMetric('fast.path.metric', 'counter')
+        self.assertIs(metric, getMetric('fast.path.metric', 'counter'))
+        self.assertRaises(MetricAlreadyExists, lambda: getMetric('fast.path.metric', 'summary'))
+        self.assertIs(getMetric('fast.path', 'base'), getMetric('fast.path'))
+        getMetric('fast.path.metric', 'counter', MetricLevel.DEBUG)
+        self.assertEqual(metric.level, MetricLevel.DEBUG)
+
+        getMetric('fast.path').reset()
+        self.assertIsNot(metric, getMetric('fast.path.metric', 'counter'))
+        getMetric('').reset()
+        self.assertIsNot(metric, getMetric('fast.path.metric', 'counter'))
+
     def test_metric_already_exists(self):
         getMetric('testmetric2', 'cps')
         try:
@@ -176,6 +290,97 @@ class TestMetric(unittest.TestCase):
         self.assertTrue(inspect.isgeneratorfunction(generator))
         self.assertGreaterEqual(next(iter(my_metric.to_metric_data().values)).value, 1)
 
+    def test_measure_coroutine(self):
+        metric = getMetric('my_metric', 'summary', quantiles=[0.5])
+
+        @metric.measure()
+        async def coroutine():
+            await asyncio.sleep(0.5)
+            return 2
+
+        self.assertTrue(inspect.iscoroutinefunction(coroutine))
+        self.assertEqual(asyncio.run(coroutine()), 2)
+        self.assertGreaterEqual(metric.tot_time, 0.5)
+
+    def test_measure_async_generator(self):
+        metric = getMetric('my_metric', 'summary', quantiles=[0.5])
+
+        @metric.measure()
+        async def generator():
+            yield 2
+            await asyncio.sleep(0.5)
+            yield 3
+
+        async def consume():
+            return [item async for item in generator()]
+
+        self.assertTrue(inspect.isasyncgenfunction(generator))
+        self.assertEqual(asyncio.run(consume()), [2, 3])
+        self.assertGreaterEqual(metric.tot_time, 0.5)
+        self.assertEqual(metric.tot_calls, 1)
+
+    def test_measure_coroutine_cancelled(self):
+        for include_exceptions in (False, True):
+            metric = getMetric('my_metric%s' % (include_exceptions,), 'summary')
+
+            @metric.measure(include_exceptions=include_exceptions)
+            async def coroutine():
+                await asyncio.sleep(10)
+
+            async def cancel():
+                task = asyncio.ensure_future(coroutine())
+                await asyncio.sleep(0.1)
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+            asyncio.run(cancel())
+            self.assertEqual(metric.tot_calls, int(include_exceptions))
+
+    def test_measure_async_generator_delegates(self):
+        metric = getMetric('my_metric', 'summary')
+        closed = []
+
+        @metric.measure()
+        async def generator():
+            try:
+                received = yield 1
+                while True:
+                    try:
+                        received = yield received * 2
+                    except KeyError:
+                        received = -1
+            finally:
+                closed.append(True)
+
+        async def drive():
+            gen = generator()
+            results = [await gen.__anext__(), await gen.asend(5),
+                       await gen.athrow(KeyError()), await gen.asend(4)]
+            await gen.aclose()
+            return results
+
+        self.assertEqual(asyncio.run(drive()), [1, 10, -2, 8])
+        self.assertEqual(closed, [True])
+        self.assertEqual(metric.tot_calls, 1)
+
+    def test_measure_nanoseconds_and_value_getter(self):
+        metric = getMetric('my_metric', 'summary')
+        self.assertRaises(ValueError, metric.measure, nanoseconds=True, value_getter=time.time)
+
+    def test_measure_async_context_manager(self):
+        metric = getMetric('my_metric', 'summary', quantiles=[0.5])
+
+        async def measured():
+            async with metric.measure(nanoseconds=True):
+                await asyncio.sleep(0.5)
+
+        asyncio.run(measured())
+        self.assertIsInstance(metric.tot_time, int)
+        self.assertGreaterEqual(metric.tot_time, 500000000)
+
     def test_quantile_context_manager(self):
         metric = getMetric('test_metric', 'summary', quantiles=[0.5])
         with metric.measure():
@@ -210,6 +415,57 @@ class TestMetric(unittest.TestCase):
                                                         {'quantile': 0.95})).strict_eq(
             metric.to_metric_data()))
 
+    def test_ddsketch(self):
+        sketch = DDSketch(relative_accuracy=0.01)
+        for i in range(1, 10001):
+            sketch.add(i)
+        sketch.add(0)
+        sketch.add(-5)
+        self.assertEqual(len(sketch), 10002)
+        self.assertAlmostEqual(sketch.quantile(0.5), 4999, delta=50)
+        self.assertAlmostEqual(sketch.quantile(0.99), 9900, delta=99)
+        self.assertAlmostEqual(sketch.quantile(0), -5, delta=0.05)
+        self.assertIsNone(DDSketch().quantile(0.5))
+
+        other = DDSketch(relative_accuracy=0.01)
+        for i in range(10001, 20001):
+            other.add(i)
+        sketch.merge(other)
+        self.assertAlmostEqual(sketch.quantile(0.5), 9999, delta=100)
+        self.assertRaises(ValueError, lambda: sketch.merge(DDSketch(relative_accuracy=0.05)))
+
+    def test_ddsketch_max_buckets(self):
+        sketch = DDSketch(relative_accuracy=0.01, max_buckets=10)
+        for i in range(1, 10001):
+            sketch.add(i)
+        self.assertEqual(len(sketch.positive), 10)
+        self.assertAlmostEqual(sketch.quantile(1), 10000, delta=100)
+
+    def test_summary_sketch(self):
+        metric = getMetric('summary_sketch', 'summary', quantiles=[0.5, 0.95],
+                           backend='ddsketch', enable_timestamp=False)
+        for i in range(9):
+            metric.runtime(10.0)
+        metric.runtime(15.0)
+        metric_data = metric.to_metric_data()
+        self.assertAlmostEqual(choose('', metric_data, {'quantile': 0.5}).value, 10.0, delta=0.1)
+        self.assertAlmostEqual(choose('', metric_data, {'quantile': 0.95}).value, 10.0, delta=0.1)
+        self.assertEqual(choose('count', metric_data).value, 10)
+
+    def test_summary_sketch_children(self):
+        metric = getMetric('summary_sketch', 'summary', quantiles=[0.5], backend='ddsketch')
+        metric.runtime(10.0, label='value')
+        metric.runtime(20.0, label='wtf')
+        metric.runtime(30.0, label='wtf')
+        metric_data = metric.to_metric_data()
+        self.assertAlmostEqual(choose('', metric_data, {'quantile': 0.5, 'label': 'wtf'}).value,
+                               20.0, delta=0.2)
+        self.assertAlmostEqual(choose('total', metric_data, {'quantile': 0.5}).value, 20.0,
+                               delta=0.2)
+
+    def test_summary_unknown_backend(self):
+        self.assertRaises(ValueError, lambda: getMetric('summary_bad', 'summary', backend='bad'))
+
     def test_labels(self):
         metric = getMetric('root.test.FloatValue', 'float', enable_timestamp=False)
         metric.runtime(2, label='value')
@@ -257,6 +513,155 @@ class TestMetric(unittest.TestCase):
                                              MetricData('counter.sum', 4)).strict_eq(
             counter.to_metric_data()))
 
+    def test_counter_sharded(self):
+        counter = getMetric('counter', 'counter', enable_timestamp=False, count_calls=True,
+                            sharded=True)
+
+        def run():
+            for _ in range(1000):
+                counter.runtime(1)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(len(counter.shards), 8)
+        self.assertTrue(MetricDataCollection(MetricData('counter', 8000),
+                                             MetricData('counter.count', 8000)).strict_eq(
+            counter.to_metric_data()))
+
+    def test_counter_sharded_children(self):
+        counter = getMetric('counter', 'counter', enable_timestamp=False, sharded=True)
+        counter.runtime(1, service='user')
+        counter.runtime(2, service='session')
+        counter.runtime(1, service='user')
+        self.assertTrue(MetricDataCollection(MetricData('counter', 2, {'service': 'user'}),
+                                             MetricData('counter', 2, {'service': 'session'}),
+                                             MetricData('counter.sum', 4)).strict_eq(
+            counter.to_metric_data()))
+
+    def test_sharded_thread_churn(self):
+        counter = getMetric('counter', 'counter', enable_timestamp=False, sharded=True)
+        histogram = getMetric('histogram', 'histogram', buckets=[1], sharded=True)
+
+        def run():
+            counter.runtime(1, service='user')
+            histogram.runtime(2)
+
+        for _ in range(200):
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+
+        child = counter.children_mapping[(('service', 'user'),)]
+        self.assertLessEqual(len(counter.shards), 8)
+        self.assertLessEqual(len(child.shards), 8)
+        self.assertLessEqual(len(histogram.shards), 8)
+        data = counter.to_metric_data()
+        self.assertEqual(value_of(data, 'counter', {'service': 'user'}), 200)
+        self.assertEqual(value_of(data, 'counter.sum'), 200)
+        self.assertEqual(histogram.get_state(), ([0, 200], 400, 200))
+        self.assertEqual(len(counter.shards), 0)
+
+    def test_max_children(self):
+        metric = getMetric('root.counter', 'counter', max_children=2)
+        metric.runtime(1, user=1)
+        metric.runtime(2, user=2)
+        metric.runtime(3, user=1)
+        metric.runtime(4, user=3)   # evicts user=2
+        metric.runtime(5, user=4)   # evicts user=1
+        self.assertEqual(len(metric.children_mapping), 2)
+        self.assertEqual(metric.evictions, 2)
+        data = metric.to_metric_data()
+        self.assertEqual(value_of(data, 'counter', {'user': '__overflow__'}), 6)
+        self.assertEqual(value_of(data, 'counter', {'user': 3}), 4)
+        self.assertEqual(value_of(data, 'counter', {'user': 4}), 5)
+        self.assertEqual(value_of(data, 'counter.sum'), 15)
+        self.assertEqual(value_of(data, 'counter.evictions'), 2)
+        self.assertRaises(KeyError, value_of, data, 'counter', {'user': 2})
+
+    def test_max_children_histogram(self):
+        metric = getMetric('root.histogram', 'histogram', buckets=[1], max_children=1)
+        for user in range(100):
+            metric.runtime(0.5, user=user)
+        self.assertEqual(len(metric.children), 2)
+        self.assertEqual(metric.evictions, 99)
+        data = metric.to_metric_data()
+        self.assertEqual(value_of(data, 'histogram.count', {'user': '__overflow__'}), 99)
+        self.assertEqual(value_of(data, 'histogram.sum', {'user': '__overflow__'}), 49.5)
+        self.assertEqual(value_of(data, 'histogram', {'user': '__overflow__', 'le': 0.0,
+                                                      'ge': 1}), 99)
+        self.assertEqual(value_of(data, 'histogram.count', {'user': 99}), 1)
+        self.assertEqual(value_of(data, 'histogram.total.count'), 100)
+
+    def test_max_children_cps_and_ewma(self):
+        metric = getMetric('root.cps', 'cps', time_unit_vectors=[60], max_children=1)
+        for user in range(10):
+            metric.runtime(user=user)
+            metric.runtime(user=user)
+        data = metric.to_metric_data()
+        self.assertEqual(value_of(data, 'cps', {'user': '__overflow__', 'period': 60}), 18)
+        self.assertEqual(value_of(data, 'cps', {'user': 9, 'period': 60}), 2)
+        self.assertEqual(value_of(data, 'cps.total', {'period': 60}), 20)
+
+        now = [0.0]
+        metric = getMetric('root.ewma', 'ewma', half_lives=[1], max_children=1,
+                           time_getter=lambda: now[0])
+        metric.runtime(2, user=1)
+        now[0] = 1
+        metric.runtime(4, user=2)   # evicts user=1
+        data = metric.to_metric_data()
+        # the value of user=1 has decayed to half a call by now
+        self.assertAlmostEqual(value_of(data, 'ewma', {'user': '__overflow__', 'half_life': 1}),
+                               2)
+        self.assertAlmostEqual(value_of(data, 'ewma.rate', {'user': '__overflow__',
+                                                            'half_life': 1}),
+                               0.5 * math.log(2))
+        self.assertAlmostEqual(value_of(data, 'ewma.total', {'half_life': 1}), 10 / 3)
+
+    def test_max_children_unsupported(self):
+        for metric_type in ('int', 'float', 'linkfail'):
+            self.assertRaises(ValueError, getMetric, 'root.' + metric_type, metric_type,
+                              max_children=1)
+
+    def test_max_children_invalid(self):
+        for max_children in (0, -1):
+            self.assertRaises(ValueError, getMetric, 'root.counter%s' % (-max_children,),
+                              'counter', max_children=max_children)
+
+    def test_counter_sample_rate(self):
+        metric = getMetric('root.counter', 'counter', sample_rate=0.25, count_calls=True)
+        for _ in range(100):
+            metric.runtime(2)
+        self.assertEqual(metric.value, 50)
+        data = metric.to_metric_data()
+        self.assertEqual(value_of(data, 'counter'), 200)
+        self.assertEqual(value_of(data, 'counter.count'), 100)
+
+    def test_histogram_sample_rate(self):
+        metric = getMetric('root.histogram', 'histogram', buckets=[1], sample_rate=0.1)
+        for _ in range(100):
+            metric.runtime(0.5, key='value')
+        metric.handle_many([2] * 100)
+        data = metric.to_metric_data()
+        self.assertEqual(value_of(data, 'histogram', {'key': 'value', 'le': 0.0, 'ge': 1}), 100)
+        self.assertEqual(value_of(data, 'histogram.total', {'le': 1, 'ge': float('inf')}), 100)
+        self.assertEqual(value_of(data, 'histogram.total.count'), 200)
+        self.assertAlmostEqual(value_of(data, 'histogram.total.sum'), 250)
+        self.assertRaises(ValueError, getMetric, 'root.histogram2', 'histogram', sample_rate=0)
+
+    def test_summary_sample_rate(self):
+        metric = getMetric('root.summary', 'summary', quantiles=[0.5], sample_rate=0.5)
+        for _ in range(10):
+            metric.runtime(1)
+        self.assertEqual(len(metric.calls_queue), 5)
+        data = metric.to_metric_data()
+        self.assertEqual(value_of(data, 'summary', {'quantile': 0.5}), 1)
+        self.assertEqual(value_of(data, 'summary.count'), 10)
+        self.assertEqual(value_of(data, 'summary.sum'), 10)
+
     def test_counter_count_calls(self):
         counter = getMetric('counter', 'counter', enable_timestamp=False, count_calls=True)
         counter.runtime(1, service='user')
@@ -289,6 +694,24 @@ class TestMetric(unittest.TestCase):
                 MetricData('root.test.FloatValue', 1.0),
                 MetricData('root.test.IntValue', 3)).strict_eq(root_metric.to_metric_data()))
 
+    def test_effective_level_cache(self):
+        metric = getMetric('level.cache.deep.counter', 'counter', enable_timestamp=False)
+        metric.runtime(1, label='value')
+        parent = getMetric('level.cache')
+        self.assertEqual(metric.level, MetricLevel.RUNTIME)
+
+        parent.level = MetricLevel.DISABLED
+        self.assertEqual(metric.level, MetricLevel.DISABLED)
+        self.assertEqual(metric.get_child({'label': 'value'}).level, MetricLevel.DISABLED)
+        metric.runtime(1)
+        metric.runtime(1, label='value')
+
+        parent.level = MetricLevel.INHERIT
+        getMetric().level = MetricLevel.DEBUG
+        self.assertEqual(metric.level, MetricLevel.DEBUG)
+        metric.debug(1, label='value')
+        self.assertEqual(metric.get_value_and_calls(), (2, 2))
+
     def testInheritance(self):
         metric = getMetric('root.test.FloatValue', 'float', MetricLevel.INHERIT,
                            enable_timestamp=False)
@@ -327,6 +750,44 @@ class TestMetric(unittest.TestCase):
                                              MetricData('CPSValue', 2, {'period': 2})).strict_eq(
             metric.to_metric_data()))
 
+    def test_ewma(self):
+        now = [0.0]
+        metric = getMetric('root.ewma', 'ewma', half_lives=[1, 10], time_getter=lambda: now[0])
+        for _ in range(1000):
+            now[0] += 0.01
+            metric.runtime(2)
+        rate_1, rate_10 = metric.get_rates()
+        self.assertAlmostEqual(rate_1, 100, delta=1)
+        self.assertLess(rate_10, 100)
+        self.assertEqual(metric.get_averages(), [2, 2])
+        now[0] += 1
+        self.assertAlmostEqual(metric.get_rates()[0], 50, delta=1)
+        metric.runtime(4)
+        self.assertAlmostEqual(metric.get_averages()[0], 2.027, places=3)
+        data = metric.to_metric_data()
+        self.assertAlmostEqual(value_of(data, 'ewma.rate', {'half_life': 1}), 51, delta=1)
+        self.assertAlmostEqual(value_of(data, 'ewma.rate', {'half_life': 10}),
+                               metric.get_rates()[1])
+        self.assertAlmostEqual(value_of(data, 'ewma', {'half_life': 1}), 2.027, places=3)
+        self.assertAlmostEqual(value_of(data, 'ewma', {'half_life': 10}),
+                               metric.get_averages()[1])
+
+    def test_ewma_labels(self):
+        metric = getMetric('root.ewma', 'ewma', half_lives=[60])
+        metric.runtime(key='value')
+        metric.runtime(5, key='other')
+        data = metric.to_metric_data()
+        self.assertEqual({md.name for md in data.values},
+                         {'ewma.rate', 'ewma.rate.total', 'ewma', 'ewma.total'})
+        rate = math.log(2) / 60
+        self.assertAlmostEqual(value_of(data, 'ewma.rate', {'half_life': 60, 'key': 'value'}),
+                               rate, places=5)
+        self.assertAlmostEqual(value_of(data, 'ewma.rate.total', {'half_life': 60}),
+                               2 * rate, places=5)
+        self.assertAlmostEqual(value_of(data, 'ewma', {'half_life': 60, 'key': 'other'}), 5,
+                               places=5)
+        self.assertAlmostEqual(value_of(data, 'ewma.total', {'half_life': 60}), 5, places=5)
+
     def test_cps_labels(self):
         metric = getMetric('root.CPSValue', 'cps', time_unit_vectors=[1], enable_timestamp=False)
         metric.runtime(key='value')
@@ -334,3 +795,23 @@ class TestMetric(unittest.TestCase):
             MetricDataCollection(MetricData('CPSValue', 1, {'period': 1, 'key': 'value'}),
                                  MetricData('CPSValue.total', 1, {'period': 1})).strict_eq(
                 metric.to_metric_data()))
+
+    def test_cps_ring_buffer(self):
+        now = [1000.0]
+        with mock.patch('satella.instrumentation.metrics.metric_types.cps.time.monotonic',
+                        lambda: now[0]):
+            metric = getMetric('root.CPSValue', 'cps', time_unit_vectors=[1, 5],
+                               enable_timestamp=False)
+            self.assertEqual(len(metric.bins), 51)
+            for _ in range(10000):
+                metric.runtime()
+            self.assertEqual(len(metric.bins), 51)
+            self.assertEqual(metric.count_clicks(), [10000, 10000])
+            now[0] += 2
+            metric.runtime()
+            self.assertEqual(metric.count_clicks(), [1, 10001])
+            now[0] += 4.5
+            self.assertEqual(metric.count_clicks(), [0, 1])
+            now[0] += 10
+            metric.runtime()
+            self.assertEqual(metric.count_clicks(), [1, 1])
@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from satella.instrumentation.metrics import getMetric
+from satella.instrumentation.metrics import multiprocess
+from satella.instrumentation.metrics.multiprocess import MultiprocessStore, \
+    enable_multiprocess, disable_multiprocess, collect_multiprocess, compact_multiprocess
+
+
+def to_dict(mdc) -> dict:
+    return {(md.name, tuple(sorted(md.labels.items()))): md.value for md in mdc.values}
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'requires fork()')
+class TestMultiprocess(unittest.TestCase):
+    def setUp(self) -> None:
+        getMetric('').reset()
+        self.directory = tempfile.mkdtemp()
+        enable_multiprocess(self.directory)
+
+    def tearDown(self) -> None:
+        disable_multiprocess()
+        shutil.rmtree(self.directory)
+
+    def run_in_child(self, fun) -> int:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                fun()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    def test_store(self):
+        path = os.path.join(self.directory, 'store.db')
+        store = MultiprocessStore(path)
+        store.add('a', 2)
+        store.add('a', 3)
+        for i in range(5000):       # force growing the file
+            store.add('key %s' % (i,), i)
+        store.close()
+        store = MultiprocessStore(path)
+        store.add('a', 1)
+        store.close()
+        values = multiprocess._read_file(path)
+        self.assertEqual(values['a'], 6)
+        self.assertEqual(values['key 4999'], 4999)
+
+    def test_counter(self):
+        counter = getMetric('mp.counter', 'mp_counter')
+        counter.runtime(2, service='a')
+        self.run_in_child(lambda: counter.runtime(3, service='a'))
+        self.run_in_child(lambda: counter.runtime(4))
+        self.assertEqual(to_dict(collect_multiprocess(self.directory)),
+                         {('mp.counter', (('service', 'a'),)): 5,
+                          ('mp.counter', ()): 4})
+        self.assertFalse(getMetric().to_metric_data().values)
+
+    def test_counter_default_delta(self):
+        counter = getMetric('mp.counter', 'mp_counter')
+        plain_counter = getMetric('plain.counter', 'counter')
+        counter.runtime()
+        plain_counter.runtime()
+        self.assertEqual(to_dict(collect_multiprocess(self.directory)),
+                         {('mp.counter', ()): plain_counter.value})
+
+    def test_histogram(self):
+        histogram = getMetric('mp.histogram', 'mp_histogram', buckets=[1, 2])
+        histogram.runtime(0.5)
+        self.run_in_child(lambda: histogram.runtime(1.5))
+        self.run_in_child(lambda: histogram.runtime(3))
+        data = to_dict(collect_multiprocess(self.directory))
+        self.assertEqual(data[('mp.histogram', (('ge', 1), ('le', 0.0)))], 1)
+        self.assertEqual(data[('mp.histogram', (('ge', 2), ('le', 1)))], 1)
+        self.assertEqual(data[('mp.histogram', (('ge', float('inf')), ('le', 2)))], 1)
+        self.assertEqual(data[('mp.histogram.sum', ())], 5)
+        self.assertEqual(data[('mp.histogram.count', ())], 3)
+
+    def test_summary(self):
+        summary = getMetric('mp.summary', 'mp_summary', quantiles=[0.5])
+        self.run_in_child(lambda: [summary.runtime(value) for value in range(1, 51)])
+        self.run_in_child(lambda: [summary.runtime(value) for value in range(51, 101)])
+        data = to_dict(collect_multiprocess(self.directory))
+        self.assertAlmostEqual(data[('mp.summary', (('quantile', 0.5),))], 50, delta=1)
+        self.assertEqual(data[('mp.summary.count', ())], 100)
+
+    def test_compact(self):
+        counter = getMetric('mp.counter', 'mp_counter')
+        counter.runtime(1)
+        for _ in range(3):
+            self.run_in_child(lambda: counter.runtime(2))
+        compact_multiprocess(self.directory)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['metrics.lock', 'metrics_%s.db' % (os.getpid(),),
+                          'metrics_archive.db'])
+        self.run_in_child(lambda: counter.runtime(10))
+        compact_multiprocess(self.directory)
+        self.assertEqual(to_dict(collect_multiprocess(self.directory)),
+                         {('mp.counter', ()): 17})
+
+    def test_compact_while_collecting(self):
+        counter = getMetric('mp.counter', 'mp_counter')
+        counter.runtime(1)
+        for _ in range(20):
+            self.run_in_child(lambda: counter.runtime(1))
+        compactor = threading.Thread(target=compact_multiprocess, args=(self.directory,))
+        compactor.start()
+        while compactor.is_alive():
+            self.assertEqual(to_dict(collect_multiprocess(self.directory)),
+                             {('mp.counter', ()): 21})
+        compactor.join()
+        self.assertEqual(to_dict(collect_multiprocess(self.directory)),
+                         {('mp.counter', ()): 21})
+
+    def test_not_enabled(self):
+        disable_multiprocess()
+        self.assertRaises(RuntimeError, getMetric('mp.counter', 'mp_counter').runtime, 1)
+
+
+class TestMultiprocessUnsupported(unittest.TestCase):
+    def test_no_fcntl(self):
+        code = """
+import sys
+sys.modules['fcntl'] = None
+from satella.instrumentation.metrics import getMetric
+from satella.instrumentation.metrics.multiprocess import enable_multiprocess
+getMetric('counter', 'counter').runtime(1)
+try:
+    enable_multiprocess('.')
+except OSError:
+    sys.exit(0)
+sys.exit(1)
+"""
+        self.assertEqual(subprocess.call([sys.executable, '-c', code]), 0)
@@ -85,6 +85,32 @@ class TestThreadPoolExecutor(unittest.TestCase):
         self.assertEqual(n_th(cache_miss.to_metric_data().values).value, 1)
         self.assertEqual(n_th(refreshes.to_metric_data().values).value, 1)
 
+    def test_metrified_cache_dict_get_many(self):
+        cache_hits = getMetric('cachedict_many.hits', 'counter')
+        cache_miss = getMetric('cachedict_many.miss', 'counter')
+        refreshes = getMetric('refreshes_many', 'counter')
+        how_long_takes = getMetric('how_long_takes_many', 'summary')
+
+        def getter_many(keys):
+            time.sleep(0.2)
+            return {key: key * 2 for key in keys}
+
+        mcd = MetrifiedCacheDict(10, 20, lambda key: key * 2, cache_hits=cache_hits,
+                                 cache_miss=cache_miss,
+                                 refreshes=refreshes,
+                                 how_long_refresh_takes=how_long_takes,
+                                 value_getter_many=getter_many)
+        self.assertEqual(mcd.get_many([1, 2]), {1: 2, 2: 4})
+        self.assertEqual(n_th(cache_hits.to_metric_data().values).value, 0)
+        self.assertEqual(n_th(cache_miss.to_metric_data().values).value, 2)
+        self.assertEqual(n_th(refreshes.to_metric_data().values).value, 2)
+        self.assertGreaterEqual(how_long_takes.tot_time, 0.2)
+        self.assertEqual(mcd.get_many([1, 2, 3]), {1: 2, 2: 4, 3: 6})
+        self.assertEqual(n_th(cache_hits.to_metric_data().values).value, 2)
+        self.assertEqual(n_th(cache_miss.to_metric_data().values).value, 3)
+        self.assertEqual(n_th(refreshes.to_metric_data().values).value, 3)
+        self.assertEqual(how_long_takes.tot_calls, 2)
+
     def test_metrified_lru_cache_dict(self):
         cache_hits = getMetric('lrucachedict.hits', 'counter')
         cache_miss = getMetric('lrucachedict.miss', 'counter')